@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_batch: what the batch tools, iv64_export and iv64_contact, share.
+
+Import it before pygame: it puts SDL on its dummy drivers, so the tools
+run without a display.
+
+Both take a FOLDER, -r and --name=value options (parse_options), read and
+order the folder as the pygame viewer does (folder_files) and spread
+their work over a pool of processes whose results are handed back in
+order, with only a few of them waiting at any time (ordered).
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+from collections import deque
+import multiprocessing
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import iv64_pygame
+import iv64_sort
+
+
+def parse_size(text):
+	w, h = text.lower().split('x')
+	return (int(w), int(h))
+
+
+def choice(name, values):
+	"""return a converter of option values that accepts values only"""
+	def convert(value):
+		if value not in values:
+			raise SystemExit('%s is one of %s' % (name, ', '.join(values)))
+		return value
+	return convert
+
+
+def flag(value):
+	"""converter of the options that take no value"""
+	return True
+
+
+def parse_options(argv, options, types, doc):
+	"""return the folder and the options of argv. Every tool has --order,
+	--workers and -r (--recursive) besides its own options.
+	@param  options  the tool's options with their defaults
+	@param  types    converters of the option values by name, flag for
+	                 the options that take no value
+	@param  doc      usage, shown when argv is wrong"""
+	defaults = dict(order=None, workers=multiprocessing.cpu_count(),
+	                recursive=False)
+	defaults.update(options)
+	options = defaults
+	converters = dict(order=choice('order', iv64_sort.ORDERS), workers=int)
+	converters.update(types)
+	folder = None
+	for arg in argv:
+		if arg in ('-r', '--recursive'):
+			options['recursive'] = True
+			continue
+		if not arg.startswith('--'):
+			folder = arg
+			continue
+		name, sep, value = arg[2:].partition('=')
+		if name not in options:
+			raise SystemExit('unknown option %s\n%s' % (arg, doc))
+		if name in converters:
+			value = converters[name](value)
+		options[name] = value
+	if folder is None:
+		raise SystemExit(doc)
+	return folder, options
+
+
+def folder_files(path, recursive=False, order=None):
+	"""return the iv64_pygame.Folder of path and the absolute paths of its
+	images in the order the viewer plays them, sorted by an iv64_sort order
+	if one is given. Exits when there are no images"""
+	folder = iv64_pygame.Folder(path, recursive=recursive)
+	queue = iv64_pygame.Queue(folder.images())
+	if not queue.total_files():
+		raise SystemExit('no images in %s' % folder.path)
+	if order is not None:
+		sortkeys = iv64_sort.SortKeys(folder.path)
+		names = list(queue.files)
+		queue.apply_order((order, names, sortkeys.positions(names, order)))
+	return folder, list(queue.files)
+
+
+def ordered(fn, jobs, workers, window, initializer=None, initargs=()):
+	"""yield fn(job) for every job, run on a pool of workers processes, in
+	the order of jobs. At most window jobs are handed out ahead of the one
+	waited for, so the results waiting to be taken stay few however many
+	jobs there are"""
+	pool = multiprocessing.Pool(workers, initializer, initargs)
+	try:
+		waiting = deque()
+		for job in jobs:
+			waiting.append(pool.apply_async(fn, (job,)))
+			if len(waiting) >= window:
+				yield waiting.popleft().get()
+		while waiting:
+			yield waiting.popleft().get()
+	finally:
+		pool.terminate()
+		pool.join()
@@ -0,0 +1,616 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_bench: headless benchmarks of the load, fit and render paths of the
+pygame, pyglet and cocos viewers.
+
+	python iv64_bench.py [--corpus=DIR] [--out=FILE] [--repeat=N]
+	                     [--frontends=pygame,pyglet,cocos]
+	                     [--sizes=640x480,1920x1080,4000x3000]
+	                     [--scan-files=N] [--display]
+	                     [--compare=OLD.json] [--threshold=1.25]
+
+A corpus of JPEG, PNG, GIF and TIFF images at several resolutions, plus a
+folder of empty files for the scans, is generated with PIL. The images are
+made from seeded noise, so every machine generates the same corpus, and
+they are kept in DIR when one is given so the generation is only paid
+once.
+
+Each frontend runs in a child process of its own, so they cannot disturb
+each other's caches or GL state. No display is needed: pygame runs on the
+SDL dummy video driver and pyglet and cocos in pyglet's headless (EGL)
+mode. With --display they use hidden windows on the display there is
+instead, for example under xvfb-run or Mesa's software renderer. Every
+child gets an empty cache directory, so nothing is left over from
+earlier runs.
+
+Results are written as JSON: one record per benchmark and parameter set
+with the minimum, median, mean and maximum time in milliseconds, and for
+the conversions between pygame and PIL images the bytes copied per call. With
+--compare the medians are checked against an earlier results file and the
+exit status is 1 when something got slower than the threshold allows.
+
+The pyglet and cocos loaders are also run over the corpus again and again
+while the descriptors open in the child are counted. Any descriptor left
+open by them is reported as leaked and makes the exit status 1 as well.
+"""
+from __future__ import print_function
+
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+FRONTENDS = ('pygame', 'pyglet', 'cocos')
+SIZES = ((640, 480), (1920, 1080), (4000, 3000))
+FORMATS = (('JPEG', 'jpg'), ('PNG', 'png'), ('GIF', 'gif'), ('TIFF', 'tif'))
+WINDOW = (1280, 720)
+SCAN_FILES = 20000
+DESCRIPTOR_LOOPS = 50
+
+timer = timeit.default_timer
+
+
+### Corpus --------------------------------------------------------------------
+def _noise(size, seed):
+	"""return seeded RGB noise of size, smoothed so that it compresses more
+	like a photograph than like random bytes"""
+	from PIL import Image
+	w, h = max(1, size[0] // 8), max(1, size[1] // 8)
+	n = w * h * 3
+	data = b''.join(hashlib.sha256(('%d:%d' % (seed, i)).encode('ascii'))
+	                .digest() for i in range(n // 32 + 1))[:n]
+	frombytes = getattr(Image, 'frombytes', None) or Image.fromstring
+	return frombytes('RGB', (w, h), data).resize(size, Image.BICUBIC)
+
+
+def image_name(format, size):
+	"""return the corpus file name of the image of format and size"""
+	ext = dict(FORMATS)[format]
+	return '%s_%dx%d.%s' % (format.lower(), size[0], size[1], ext)
+
+
+def make_corpus(path, sizes=SIZES, scan_files=SCAN_FILES):
+	"""fill path with an image per format and size and a `scan` folder of
+	scan_files empty files. Files already there are kept"""
+	if not os.path.isdir(path):
+		os.makedirs(path)
+	for seed, size in enumerate(sizes):
+		image = None
+		for format, ext in FORMATS:
+			filename = os.path.join(path, image_name(format, size))
+			if os.path.exists(filename):
+				continue
+			if image is None:
+				image = _noise(size, seed)
+			if format == 'GIF':
+				from PIL import Image
+				image.convert('P', palette=Image.ADAPTIVE).save(filename)
+			elif format == 'JPEG':
+				image.save(filename, quality=90)
+			else:
+				image.save(filename)
+	scan = os.path.join(path, 'scan')
+	if not os.path.isdir(scan):
+		os.makedirs(scan)
+	names = set(os.listdir(scan))
+	for i in range(scan_files):
+		# mostly images, a few others and hidden files as in real folders
+		if i % 50 == 0:
+			name = '.hidden%06d' % i
+		elif i % 10 == 0:
+			name = 'notes%06d.txt' % i
+		else:
+			name = 'img%06d.%s' % (i, FORMATS[i % len(FORMATS)][1])
+		if name not in names:
+			open(os.path.join(scan, name), 'wb').close()
+
+
+def corpus_images(path, sizes=SIZES):
+	"""return [(filename, format, size)] of the corpus images"""
+	return [(os.path.join(path, image_name(format, size)), format, size)
+	        for size in sizes for format, ext in FORMATS]
+
+
+### Measuring -----------------------------------------------------------------
+def measure(frontend, name, fn, repeat, number=1, setup=None, **params):
+	"""time fn and return the result record. fn is called `number` times
+	per run and the time per call is kept; setup, if given, is called
+	before every run without being timed. An exception ends the benchmark
+	and is kept in the record instead of the times"""
+	record = dict(frontend=frontend, name=name, params=params,
+	              runs=repeat, number=number)
+	times = []
+	try:
+		for i in range(repeat):
+			if setup is not None:
+				setup()
+			start = timer()
+			for j in range(number):
+				fn()
+			times.append((timer() - start) / number * 1000.0)
+	except Exception as e:
+		record['error'] = '%s: %s' % (type(e).__name__, e)
+		return record
+	times.sort()
+	middle = len(times) // 2
+	if len(times) % 2:
+		median = times[middle]
+	else:
+		median = (times[middle - 1] + times[middle]) / 2.0
+	record.update(min=times[0], median=median,
+	              mean=sum(times) / len(times), max=times[-1])
+	return record
+
+
+def open_descriptors():
+	"""return the number of descriptors open in this process, None where
+	they cannot be counted"""
+	for path in ('/proc/self/fd', '/dev/fd'):
+		if os.path.isdir(path):
+			return len(os.listdir(path))
+	return None
+
+
+def check_descriptors(frontend, name, fn, number=DESCRIPTOR_LOOPS,
+                      **params):
+	"""call fn number times and return the record of the descriptors it
+	left open, in `leaked`"""
+	record = dict(frontend=frontend, name=name, params=params,
+	              number=number)
+	try:
+		fn()  # whatever is opened once and kept is not a leak
+		before = open_descriptors()
+		if before is None:
+			record['error'] = 'cannot count open descriptors'
+			return record
+		for i in range(number):
+			fn()
+		record['leaked'] = open_descriptors() - before
+	except Exception as e:
+		record['error'] = '%s: %s' % (type(e).__name__, e)
+	return record
+
+
+def record_key(record):
+	"""key matching the records of the same benchmark in two results"""
+	return (record['frontend'], record['name'],
+	        json.dumps(record['params'], sort_keys=True))
+
+
+def _image_params(format, size):
+	return dict(format=format, size='%dx%d' % size)
+
+
+def _pil_version():
+	try:
+		import PIL
+		from PIL import Image
+	except ImportError:
+		return None
+	return getattr(PIL, '__version__', getattr(Image, 'VERSION', None))
+
+
+### pygame --------------------------------------------------------------------
+def bench_pygame(corpus, sizes, repeat):
+	"""return (info, records) of the pygame viewer"""
+	os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+	os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+	import pygame
+	import iv64_cache
+	import iv64_pygame as viewer
+
+	pygame.display.init()
+	screen = pygame.display.set_mode(WINDOW)
+	winrect = screen.get_rect()
+	clear = iv64_cache.shared.clear
+	info = dict(pygame=pygame.version.ver, pil=_pil_version(),
+	            numpy=viewer.numpy is not None,
+	            driver=pygame.display.get_driver())
+	records = []
+
+	def add(name, fn, **kwargs):
+		records.append(measure('pygame', name, fn, **kwargs))
+
+	for filename, format, size in corpus_images(corpus, sizes):
+		params = _image_params(format, size)
+		add('loadImage', lambda: viewer.loadImage(filename),
+		    repeat=repeat, setup=clear, **params)
+		add('loadImage reduced', lambda: viewer.loadImage(filename, WINDOW),
+		    repeat=repeat, setup=clear, **params)
+		image, rect = viewer.loadImage(filename)
+		add('ImageView.fit_to_window',
+		    lambda: viewer.ImageView.fit_to_window(image, rect, winrect),
+		    repeat=repeat, **params)
+		fitted, fitted_rect = viewer.ImageView.fit_to_window(image, rect,
+		                                                     winrect)
+		add('ImageView.padded_image',
+		    lambda: viewer.ImageView.padded_image(fitted, winrect.size,
+		                                          (0, 0, 0)),
+		    repeat=repeat, **params)
+
+	# conversions between pygame and PIL images, with the bytes they copy
+	from PIL import Image
+	util = viewer.ImageUtil
+
+	def add_conversion(name, fn, **params):
+		before = util.bytes_copied
+		record = measure('pygame', name, fn, repeat=repeat, **params)
+		if 'error' not in record:
+			calls = record['runs'] * record['number']
+			record['bytes_copied'] = (util.bytes_copied - before) // calls
+		records.append(record)
+
+	for size in sizes:
+		filename = os.path.join(corpus, image_name('PNG', size))
+		pilimage = Image.open(filename).convert('RGBX')
+		shared = util.fromPIL(pilimage)
+		image, rect = viewer.loadImage(filename)
+		params = dict(size='%dx%d' % size)
+		add_conversion('ImageUtil.fromPIL', lambda: util.fromPIL(pilimage),
+		               **params)
+		add_conversion('ImageUtil.toPIL', lambda: util.toPIL(image),
+		               surface='display', **params)
+		add_conversion('ImageUtil.toPIL', lambda: util.toPIL(shared),
+		               surface='RGBX', **params)
+		add_conversion('ImageUtil.resize',
+		               lambda: util.resize(shared, WINDOW), **params)
+	clear()
+
+	# frames of a crossfade, made to last long enough for every run
+	files = [f for f, format, size in corpus_images(corpus, sizes)]
+	view = viewer.ImageView(filename=files[0])
+	view.fade_duration = 10 ** 9
+	view.set_filename(files[-1])
+	add('ImageView.update crossfade', view.update, repeat=repeat,
+	    number=10)
+
+	add('Folder scan', lambda: viewer.Folder(os.path.join(corpus, 'scan')),
+	    repeat=repeat, files=len(os.listdir(os.path.join(corpus, 'scan'))))
+
+	# from moving on to a file to its first frame on screen
+	queue = viewer.Queue(files)
+	view = viewer.ImageView(filename=queue.current_file())
+
+	def slide():
+		queue.next()
+		view.set_filename(queue.current_file())
+		screen.blit(view.image, (0, 0))
+		pygame.display.flip()
+	add('slide latency', slide, repeat=repeat, setup=clear)
+	add('slide latency cached', slide, repeat=repeat)
+
+	pygame.display.quit()
+	return info, records
+
+
+### pyglet and cocos ----------------------------------------------------------
+def _import_pyglet(display):
+	"""import pyglet, in headless mode unless display is set"""
+	import pyglet
+	if not display:
+		pyglet.options['headless'] = True
+	pyglet.options['vsync'] = False
+	return pyglet
+
+
+def _dispose_model(pyglet, model):
+	"""stop the background work of a SlideshowModel"""
+	for name in dir(model):
+		if name.startswith('_check_'):
+			pyglet.clock.unschedule(getattr(model, name))
+	model._watcher.stop()
+
+
+def _bench_model(frontend, pyglet, viewer, corpus, repeat):
+	"""return the record of a full scan by a SlideshowModel"""
+	scan = os.path.join(corpus, 'scan')
+
+	def run():
+		model = viewer.SlideshowModel(scan)
+		model._scanner.wait()
+		_dispose_model(pyglet, model)
+	return measure(frontend, 'SlideshowModel scan', run, repeat=repeat,
+	               files=len(os.listdir(scan)))
+
+
+def bench_pyglet(corpus, sizes, repeat, display=False):
+	"""return (info, records) of the pyglet viewer"""
+	pyglet = _import_pyglet(display)
+	from pyglet import gl
+	import iv64_cache
+	import iv64_pyglet as viewer
+
+	clear = iv64_cache.shared.clear
+	window = viewer.AppWindow(folder=corpus, width=WINDOW[0],
+	                          height=WINDOW[1], visible=False)
+	info = dict(pyglet=pyglet.version, pil=_pil_version(), headless=not display,
+	            renderer=viewer.gl_info.get_renderer(),
+	            mipmaps=viewer.mipmap_mode() is not None)
+	records = []
+
+	def add(name, fn, **kwargs):
+		records.append(measure('pyglet', name, fn, **kwargs))
+
+	view = window.image_view
+	for filename, format, size in corpus_images(corpus, sizes):
+		params = _image_params(format, size)
+		reduction = view.reduction_of(filename, WINDOW)
+		add('ImageView.load_image', lambda: view.load_image(filename),
+		    repeat=repeat, setup=clear, **params)
+		add('ImageView.load_image reduced',
+		    lambda: view.load_image(filename, reduction),
+		    repeat=repeat, setup=clear, reduction=reduction, **params)
+		image = view.load_image(filename, reduction)
+
+		def upload():
+			view.show(image)
+			gl.glFinish()
+		add('ImageView.show', upload, repeat=repeat, **params)
+
+	files = [f for f, format, size in corpus_images(corpus, sizes)]
+
+	def load_all():
+		for filename in files:
+			viewer.Loader.load_image(filename)
+	records.append(check_descriptors('pyglet', 'Loader.load_image', load_all,
+	                                 files=len(files)))
+
+	def decode_all():
+		for filename in files:
+			clear()
+			view.load_image(filename, view.reduction_of(filename, WINDOW))
+	records.append(check_descriptors('pyglet', 'ImageView.load_image',
+	                                 decode_all, files=len(files)))
+
+	records.append(_bench_model('pyglet', pyglet, viewer, corpus, repeat))
+
+	# from moving on to a file to its first frame on screen
+	model = window.ss_model
+
+	def slide():
+		model.next()
+		window.switch_to()
+		window.dispatch_event('on_draw')
+		gl.glFinish()
+	add('slide latency', slide, repeat=repeat, setup=clear)
+	add('slide latency cached', slide, repeat=repeat)
+
+	_dispose_model(pyglet, model)
+	window.close()
+	return info, records
+
+
+def bench_cocos(corpus, sizes, repeat, display=False):
+	"""return (info, records) of the cocos viewer"""
+	pyglet = _import_pyglet(display)
+	from pyglet import gl
+	import cocos
+	from cocos.director import director
+	import iv64_cache
+	import iv64_cocos as viewer
+
+	clear = iv64_cache.shared.clear
+	director.init(width=WINDOW[0], height=WINDOW[1], visible=False,
+	              do_not_scale=True)
+	info = dict(cocos=cocos.version, pyglet=pyglet.version,
+	            pil=_pil_version(), headless=not display)
+	records = []
+
+	def add(name, fn, **kwargs):
+		records.append(measure('cocos', name, fn, **kwargs))
+
+	fit = viewer.FitType.ScaleFitAspectFit
+	add('SizeFitting.scaleToSize',
+	    lambda: viewer.SizeFitting.scaleToSize(4000, 3000, WINDOW[0],
+	                                           WINDOW[1], fit),
+	    repeat=repeat, number=10000)
+
+	loader = viewer.ImageLoader()
+	for filename, format, size in corpus_images(corpus, sizes):
+		add('ImageLoader.load', lambda: loader.load(filename, WINDOW),
+		    repeat=repeat, setup=clear, **_image_params(format, size))
+	files = [f for f, format, size in corpus_images(corpus, sizes)]
+
+	def load_all():
+		for filename in files:
+			clear()
+			loader.load(filename, WINDOW, rendition=False)
+	records.append(check_descriptors('cocos', 'ImageLoader.load', load_all,
+	                                 files=len(files)))
+
+	records.append(_bench_model('cocos', pyglet, viewer, corpus, repeat))
+
+	# from moving on to a file to its first frame on screen
+	layer = viewer.ImageLayer()
+	layer.on_resize(*WINDOW)
+	model = viewer.SlideshowModel(corpus)
+	model.push_handlers(layer)
+
+	def slide():
+		model.next()
+		director.window.switch_to()
+		director.window.clear()
+		layer.visit()
+		gl.glFinish()
+	add('slide latency', slide, repeat=repeat, setup=clear)
+	add('slide latency cached', slide, repeat=repeat)
+
+	_dispose_model(pyglet, model)
+	director.window.close()
+	return info, records
+
+
+BENCHMARKS = dict(pygame=bench_pygame, pyglet=bench_pyglet,
+                  cocos=bench_cocos)
+
+
+### Running -------------------------------------------------------------------
+def run_child(options):
+	"""benchmark one frontend and write (info, records) to options['result']"""
+	frontend = options['child']
+	kwargs = {}
+	if frontend != 'pygame':
+		kwargs['display'] = options['display']
+	info, records = BENCHMARKS[frontend](options['corpus'], options['sizes'],
+	                                     options['repeat'], **kwargs)
+	with open(options['result'], 'w') as f:
+		json.dump(dict(info=info, records=records), f)
+
+
+def run_frontend(frontend, options):
+	"""benchmark frontend in a child process with an empty cache directory,
+	returning (info, records)"""
+	workdir = tempfile.mkdtemp(prefix='iv64_bench')
+	result = os.path.join(workdir, 'result.json')
+	env = dict(os.environ)
+	env['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+	args = [sys.executable, os.path.abspath(__file__),
+	        '--child=%s' % frontend,
+	        '--result=%s' % result,
+	        '--corpus=%s' % options['corpus'],
+	        '--repeat=%d' % options['repeat'],
+	        '--sizes=%s' % ','.join('%dx%d' % s for s in options['sizes'])]
+	if options['display']:
+		args.append('--display')
+	try:
+		# the viewers print as they go, keep that out of the report
+		with open(os.devnull, 'w') as devnull:
+			status = subprocess.call(args, env=env, stdout=devnull,
+			                         cwd=os.path.dirname(args[1]))
+		if status != 0 or not os.path.exists(result):
+			return dict(error='exit status %d' % status), []
+		with open(result) as f:
+			data = json.load(f)
+		return data['info'], data['records']
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(records, old_records, threshold):
+	"""print the benchmarks whose median went up by more than threshold
+	times since old_records and return how many did"""
+	old = dict((record_key(r), r) for r in old_records if 'median' in r)
+	slower = 0
+	for record in records:
+		before = old.get(record_key(record))
+		if before is None or 'median' not in record or not before['median']:
+			continue
+		ratio = record['median'] / before['median']
+		if ratio > threshold:
+			slower += 1
+			print('SLOWER %5.2fx  %s' % (ratio, describe(record)))
+	return slower
+
+
+def describe(record):
+	params = ' '.join('%s=%s' % item
+	                  for item in sorted(record['params'].items()))
+	return '%-7s %-30s %s' % (record['frontend'], record['name'], params)
+
+
+def report(records):
+	for record in records:
+		if 'error' in record:
+			print('%s  %s' % (describe(record), record['error']))
+		elif 'leaked' in record:
+			print('%s  %9d descriptors leaked' % (describe(record),
+			                                      record['leaked']))
+		elif 'bytes_copied' in record:
+			print('%s  %9.3f ms  %d bytes copied' % (
+				describe(record), record['median'], record['bytes_copied']))
+		else:
+			print('%s  %9.3f ms' % (describe(record), record['median']))
+
+
+def parse_size(text):
+	w, h = text.lower().split('x')
+	return (int(w), int(h))
+
+
+def parse_options(argv):
+	"""return the options of argv, which are all --name or --name=value"""
+	options = dict(corpus=None, out='iv64_bench.json', repeat=5,
+	               frontends=FRONTENDS, sizes=SIZES, scan_files=SCAN_FILES,
+	               display=False, compare=None, threshold=1.25, child=None,
+	               result=None)
+	for arg in argv:
+		name, sep, value = arg.lstrip('-').partition('=')
+		name = name.replace('-', '_')
+		if name not in options or not arg.startswith('--'):
+			raise SystemExit('unknown option %s\n%s' % (arg, __doc__))
+		if name == 'display':
+			value = True
+		elif name in ('repeat', 'scan_files'):
+			value = int(value)
+		elif name == 'threshold':
+			value = float(value)
+		elif name == 'frontends':
+			value = tuple(value.split(','))
+		elif name == 'sizes':
+			value = tuple(parse_size(s) for s in value.split(','))
+		options[name] = value
+	return options
+
+
+def main(argv):
+	options = parse_options(argv[1:])
+	if options['child'] is not None:
+		run_child(options)
+		return 0
+
+	corpus = options['corpus']
+	if corpus is None:
+		corpus = os.path.join(tempfile.gettempdir(), 'iv64_bench_corpus')
+	options['corpus'] = corpus = os.path.abspath(corpus)
+	print('corpus: %s' % corpus)
+	make_corpus(corpus, options['sizes'], options['scan_files'])
+
+	results = dict(
+		created   = time.strftime('%Y-%m-%dT%H:%M:%S'),
+		python    = platform.python_version(),
+		platform  = platform.platform(),
+		window    = WINDOW,
+		repeat    = options['repeat'],
+		frontends = {},
+		records   = [],
+	)
+	failed = 0
+	for frontend in options['frontends']:
+		print('benchmarking %s' % frontend)
+		info, records = run_frontend(frontend, options)
+		results['frontends'][frontend] = info
+		results['records'].extend(records)
+		if 'error' in info:
+			print('%s failed: %s' % (frontend, info['error']))
+			failed += 1
+		report(records)
+		for record in records:
+			if record.get('leaked'):
+				print('LEAKED %d descriptors  %s' % (record['leaked'],
+				                                     describe(record)))
+				failed += 1
+
+	with open(options['out'], 'w') as f:
+		json.dump(results, f, indent=1, sort_keys=True)
+	print('results written to %s' % options['out'])
+
+	if options['compare'] is not None:
+		with open(options['compare']) as f:
+			old = json.load(f)
+		if compare(results['records'], old['records'], options['threshold']):
+			return 1
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
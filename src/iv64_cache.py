@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_cache: memory bounded cache of decoded images, shared by the pygame,
+pyglet and cocos viewers.
+
+Entries are keyed on (path, mtime, size, target) where target is the window
+size a rendition was fitted to, or None for the decoded original. Eviction
+is least recently used and counted in bytes, not in entries.
+
+The budget defaults to 256 MB and can be changed with the IV64_CACHE_MB
+environment variable or ImageCache.set_budget().
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+from collections import OrderedDict
+import os
+import threading
+
+
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+
+class ImageCache(object):
+	"""LRU cache of images bounded by the number of bytes held"""
+
+	def __init__(self, budget=DEFAULT_BUDGET):
+		"""initialization.
+		@param  budget  maximum number of bytes held by the cache"""
+		self.budget = budget
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries = OrderedDict()  # key -> (value, nbytes)
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def key(path, target=None):
+		"""return the cache key of a file, optionally for a given target
+		size. Raises OSError if the file cannot be stat'ed"""
+		path = os.path.abspath(path)
+		st = os.stat(path)
+		return (path, st.st_mtime, st.st_size, target)
+
+	def get(self, key):
+		"""return the cached value for key or None"""
+		with self._lock:
+			entry = self._entries.pop(key, None)
+			if entry is None:
+				self.misses += 1
+				return None
+			self._entries[key] = entry  # most recently used goes last
+			self.hits += 1
+			return entry[0]
+
+	def put(self, key, value, nbytes):
+		"""store value, which takes nbytes of memory, under key"""
+		if nbytes > self.budget:
+			return
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self.bytes -= old[1]
+			self._entries[key] = (value, nbytes)
+			self.bytes += nbytes
+			self._evict()
+
+	def fetch(self, path, load, sizeof, target=None):
+		"""return the value for path and target from the cache, calling
+		load() on a miss and storing its result at sizeof(result) bytes"""
+		try:
+			key = self.key(path, target)
+		except OSError:
+			return load()
+		value = self.get(key)
+		if value is None:
+			value = load()
+			self.put(key, value, sizeof(value))
+		return value
+
+	def set_budget(self, budget):
+		"""change the byte budget, evicting entries if needed"""
+		with self._lock:
+			self.budget = budget
+			self._evict()
+
+	def clear(self):
+		"""drop all entries"""
+		with self._lock:
+			self._entries.clear()
+			self.bytes = 0
+
+	def stats(self):
+		"""return a dictionary of the cache counters"""
+		lookups = self.hits + self.misses
+		return dict(
+			entries   = len(self._entries),
+			bytes     = self.bytes,
+			budget    = self.budget,
+			hits      = self.hits,
+			misses    = self.misses,
+			evictions = self.evictions,
+			hit_rate  = float(self.hits) / lookups if lookups else 0.0,
+		)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def _evict(self):
+		"""drop least recently used entries until under budget. The lock
+		must be held by the caller"""
+		while self.bytes > self.budget and self._entries:
+			key, (value, nbytes) = self._entries.popitem(last=False)
+			self.bytes -= nbytes
+			self.evictions += 1
+
+
+def _budget_from_env():
+	try:
+		return int(os.environ['IV64_CACHE_MB']) * 1024 * 1024
+	except (KeyError, ValueError):
+		return DEFAULT_BUDGET
+
+# cache shared by everything in the process
+shared = ImageCache(_budget_from_env())
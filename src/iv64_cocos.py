@@ -10,9 +10,11 @@ Let's see if this will cut my coding time by half.
 Created by See-ming Lee on 2011-11-01.
 Copyright (c) 2011 See-ming Lee. All rights reserved.
 """
+from collections import namedtuple
 import re
 import os
 import os.path
+import sys
 from cocos.director import director
 from cocos.layer import Layer
 from cocos.layer import ColorLayer
@@ -22,12 +24,21 @@ from cocos.text import Label
 from cocos.actions import CallFunc
 from cocos.actions import FadeIn
 from cocos.actions import FadeOut
+from cocos.actions import FadeTo
 from cocos.actions import Delay
 import PIL
 from PIL import Image
 import cocos
+import iv64_decode
+import iv64_hud
+import iv64_probe
+import iv64_renditions
+import iv64_scan
+import iv64_shuffle
+import iv64_sort
+import iv64_trace
+import iv64_watch
 import pyglet
-from pyglet.image import SolidColorImagePattern
 from random import randrange
 from cocos.actions import IntervalAction
 
@@ -45,6 +56,64 @@ class FontUnavailableError(ImageViewerError): pass
 class InvalidFolderError(ImageViewerError): pass
 
 
+### Resource Loaders ----------------------------------------------------------
+class LoadedImage(namedtuple('LoadedImage', 'filename info image rendition')):
+	"""What the ImageLayer needs to show a slide: the iv64_probe ImageInfo
+	of the file (None if its header could not be read), the pyglet
+	ImageData to put on screen and whether that is a cached rendition still
+	to be replaced by the full image"""
+	__slots__ = ()
+
+
+class ImageLoader(object):
+	"""Loads the slides of the ImageLayer. Each file is decoded once:
+	its size comes from the header probe, the pixels from the image cache,
+	decoded at the reduced level suiting the window, and the next slide is
+	decoded ahead on a background thread. The full image replacing a
+	rendition is decoded on a thread of its own."""
+
+	def __init__(self):
+		self._prefetcher = iv64_decode.Decoder('loader')
+		self._upgrader = iv64_decode.Decoder('upgrade')
+
+	@property
+	def depth(self):
+		"""number of files waiting for or being prefetched"""
+		return self._prefetcher.depth
+
+	@iv64_trace.traced('ImageLoader.load')
+	def load(self, filename, window_size, rendition=True):
+		"""return the LoadedImage of filename for window_size. With
+		rendition a cached rendition is handed out when there is one, and
+		the full image is decoded on the upgrade thread, see upgraded()"""
+		info = iv64_probe.shared.probe(filename)
+		if rendition:
+			shown = iv64_renditions.shared.lookup(filename, window_size)
+			if shown is not None:
+				image = self.decode(shown, window_size)
+				self._upgrader.request(filename, window_size)
+				return LoadedImage(filename, info, image, True)
+			iv64_renditions.shared.schedule(filename, window_size)
+		image = self.decode(filename, window_size, info)
+		return LoadedImage(filename, info, image, False)
+
+	def decode(self, filename, window_size, info=None):
+		"""return the pyglet ImageData of filename from the image cache,
+		decoding it on a miss"""
+		reduction = iv64_decode.reduction_of(filename, window_size, info)
+		return iv64_decode.load(filename, reduction)
+
+	def upgraded(self, filename, window_size):
+		"""return (done, image) of the full image of filename a rendition
+		was handed out for, see iv64_decode.Decoder.result()"""
+		return self._upgrader.result(filename, window_size)
+
+	def prefetch(self, filename, window_size):
+		"""decode filename on the background thread so that it is in the
+		cache when it is shown. Only the latest request is kept"""
+		self._prefetcher.request(filename, window_size)
+
+
 ### Model Helper --------------------------------------------------------------
 def shell_quote(s):
 	return "'" + s.replace("'", "'\\''") + "'"
@@ -95,6 +164,7 @@ class SizeFitting(object):
 	three different algorithms."""
 
 	@staticmethod
+	@iv64_trace.traced('scaleToSize')
 	def scaleToSize(orig_w, orig_h, target_w, target_h,
 	                fit_type=FitType.ScaleFitFull):
 		orig_w = float(orig_w)
@@ -133,6 +203,18 @@ class SizeFitting(object):
 
 		return (xscale, yscale, result_w, result_h, dx, dy)
 
+	@staticmethod
+	def scaleFileToSize(filename, target_w, target_h,
+	                    fit_type=FitType.ScaleFitFull):
+		"""scaleToSize for an image file, with its size read from the file
+		header instead of decoding it. Returns None if the header cannot be
+		read"""
+		info = iv64_probe.shared.probe(filename)
+		if info is None:
+			return None
+		return SizeFitting.scaleToSize(info.width, info.height,
+		                               target_w, target_h, fit_type)
+
 
 class BackgroundLayer(ColorLayer):
 	"""The absolute bottomest window."""
@@ -161,23 +243,24 @@ class ImageUtil(object):
 
 	@staticmethod
 	def toPIL(image):
-		"""convert a pygame image to a PIL image"""
-#		raw = pygame.image.tostring(image, "RGBX")
-		raw = image.get_image_data()
-		return Image.fromstring("RGBX",
-		                           image.get_size(),
-		                           raw)
+		"""convert a pyglet image to a PIL image. The PIL image reads the
+		pixels pyglet hands out, which are those of the image itself when
+		it holds RGBA rows top down, as fromPIL() makes them"""
+		data = image.get_image_data()
+		raw = data.get_data('RGBA', -data.width * 4)
+		return Image.frombuffer('RGBA', (data.width, data.height), raw,
+		                        'raw', 'RGBA', 0, 1)
 
 	@staticmethod
 	def fromPIL(pilimage):
-		"""convert a PIL image to a pygame image"""
-		raw = pilimage.tostring()
-		return pygame.image.fromstring(raw, pilimage.size, "RGBX")
+		"""convert a PIL image to a pyglet image, which reads the bytes PIL
+		hands out"""
+		return iv64_decode.from_pil(pilimage)
 
 	@staticmethod
 	def resize(image, size, filter=Image.BICUBIC):
-		"""resize a pygame image"""
-		return fromPIL(toPIL(image).resize(size, filter))
+		"""resize a pyglet image with PIL's resampling"""
+		return ImageUtil.fromPIL(ImageUtil.toPIL(image).resize(size, filter))
 
 
 class ImageLayer(Layer):
@@ -196,76 +279,70 @@ class ImageLayer(Layer):
 		self.window_height = None
 		self.sprites = []
 		self.fading = []
-		self.z = 10
+		self.loader = ImageLoader()
 		self.anchor = (0, 0)
 		self.transform_anchor = (0, 0)
-		self.layers=[]
+
+		# two slot stage, see stage(): the incoming node shows the current
+		# slide above the outgoing one fading out the previous slide
+		self.incoming = None
+		self.outgoing = None
 
 
 	def on_slideshow_model_update(self, model):
 		print("ImageLayer.on_slideshow_model_update")
 		self.image_file = model.current_file
-		self.add_image_sprite()
+		self.add_image_sprite(model.upcoming_file)
 
 
-	def add_image_sprite(self):
+	def add_image_sprite(self, upcoming_file=None):
 
 		print("ImageLayer.add_image_layer()")
 
-		pil = PIL.Image.open(self.image_file)
-		pyglet_img = pyglet.image.load(self.image_file)
 		target_w = self.window_width
 		target_h = self.window_height
-		orig_w = pil.size[0]
-		orig_h = pil.size[1]
 
-		id = self.next_id
-		print(pil)
+		# show a cached rendition at once and the full image a moment later
+		slide = self.loader.load(self.image_file, (target_w, target_h))
+		pyglet_img = slide.image
+
+		print(slide.info)
 
 		( xscale, yscale,
 		  result_w, result_h, dx, dy ) = SizeFitting.scaleToSize(
-										 orig_w, orig_h,
+										 pyglet_img.width, pyglet_img.height,
 				                         target_w, target_h,
 		                                 FitType.ScaleFitAspectFit)
-		imgsprite = Sprite(pyglet_img)
-		imgsprite.anchor = (0, 0)
-		imgsprite.transform_anchor = (result_w/2, result_h/2)
-
-		bg_w = int(float(target_w) / xscale)
-		bg_h = int(float(target_h) / yscale)
-
-		background = SolidColorImagePattern(
-			color=self.color_black
-		).create_image(width=bg_w, height=bg_h)
-
-		bgsprite = Sprite(background)
-		bgsprite.add(imgsprite, z=id, name="image%d" % id)
-		bgsprite.anchor = (0, 0)
-		bgsprite.scale = xscale
+		# the BackgroundLayer underneath is black already, so the slide does
+		# not get a window sized background texture of its own
+		with iv64_hud.shared.timing('upload', self.image_file):
+			imgsprite = self.stage(pyglet_img, xscale)
+		if slide.rendition:
+			pyglet.clock.schedule_once(self.upgrade_image_sprite, 0.05,
+			                           self.image_file, (target_w, target_h))
 
 
-		self.add(bgsprite, z=id, name="spritelayer%d" % id)
+		self.animate()
 
-
-		self.animate(bgsprite, imgsprite)
+		# decode the next slide while this one is shown
+		if upcoming_file is not None:
+			self.loader.prefetch(upcoming_file, (target_w, target_h))
 
 
 		## !!! CENTERING !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 		self.position = (target_w/2, target_h/2)
-		## Remove the lign below to center on display (as oppposed to anchoing at (0,0)
-#		imgsprite.position = (-(target_w-result_w)/2/xscale, -(target_h-result_h)/2/yscale )
 
 		## !!!!!!!!!!!!!!
 		##############
 
 		########## DEBUG
-		bg = bgsprite
-		lists = [ "orig_w result_w bg_w target_w xscale".split(" "),
-		          "orig_h result_h bg_h target_h yscale".split(" "),
-		          "bg.width bg.height bg.anchor bg.transform_anchor".split(" "),
+		img = imgsprite
+		lists = [ "result_w target_w xscale".split(" "),
+		          "result_h target_h yscale".split(" "),
+		          "img.width img.height img.anchor img.transform_anchor".split(" "),
 		          "self.position self.get_local_transform() self.get_world_transform()".split(" ")
 				]
-		debug = "id: %2d " %id
+		debug = "file: %s " % self.image_file
 		for list in lists:
 			debug += "\n"
 			for  key in list:
@@ -274,27 +351,69 @@ class ImageLayer(Layer):
 
 
 
-	def animate(self, bg, img):
-		self.layers.append([bg, img])
-		bg.opacity = 0
-		img.opacity = 0
-		img.do ( FadeIn(0.5))
-		bg.do ( FadeIn(1 ))
-
-		qlen = len(self.layers)
-
-		if qlen> 1:
-			layer = self.layers[-2]
-			layer[0].do ( FadeOut(1) + CallFunc(self.kill_nodes))
-			layer[1].do ( FadeOut(1) )
-
-	def kill_nodes(self):
-		copy = self.layers[:]
-		self.layers = self.layers[-3:] # remove everything except last two
+	def upgrade_image_sprite(self, dt, image_file, window_size):
+		"""replace the rendition shown by the incoming node with the full
+		quality image, scaled so that it covers the same area, once the
+		loader's upgrade thread has decoded it. Only the upload is left to
+		the main thread"""
+		if image_file != self.image_file or self.incoming is None:
+			return
+		done, pyglet_img = self.loader.upgraded(image_file, window_size)
+		if not done:
+			pyglet.clock.schedule_once(self.upgrade_image_sprite, 0.05,
+			                           image_file, window_size)
+			return
+		if pyglet_img is None:
+			return  # the rendition stays
+		imgsprite = self.incoming
+		ratio = float(imgsprite.image.width) / pyglet_img.width
+		with iv64_hud.shared.timing('upload', image_file):
+			imgsprite.image = pyglet_img
+		imgsprite.scale *= ratio
+
+	@iv64_trace.traced('stage')
+	def stage(self, image, scale):
+		"""put image on the incoming node and what it showed on the outgoing
+		one. The same two nodes serve every slide and whatever they were
+		still doing is cancelled, so however fast the user pages there are
+		never more than two sprites to draw"""
+		if self.incoming is None:
+			self.incoming = Sprite(image)
+			self.incoming.anchor = (0, 0)
+			self.add(self.incoming, z=2, name="incoming")
+			self.outgoing = Sprite(image)
+			self.outgoing.anchor = (0, 0)
+			self.outgoing.visible = False
+			self.add(self.outgoing, z=1, name="outgoing")
+		else:
+			self.incoming.stop()
+			self.outgoing.stop()
+			self.outgoing.image = self.incoming.image
+			self.outgoing.scale = self.incoming.scale
+			self.outgoing.opacity = self.incoming.opacity
+			self.outgoing.visible = self.incoming.visible
+			self.incoming.image = image
+		self.incoming.scale = scale
+		return self.incoming
+
+	def animate(self):
+		self.incoming.opacity = 0
+		self.incoming.visible = True
+		self.incoming.do ( FadeIn(0.5))
+
+		# fade out from wherever the interrupted fade in got to
+		if self.outgoing.visible:
+			self.outgoing.do ( FadeTo(0, 1) + CallFunc(self.hide_outgoing))
+
+	def hide_outgoing(self):
+		self.outgoing.visible = False
 
-		for layer in copy[:-3]:
-			for elem in layer:
-				elem.kill()
+	@property
+	def animating(self):
+		"""whether a slide is fading in or out"""
+		return self.incoming is not None and (
+			self.incoming.are_actions_running() or
+			self.outgoing.are_actions_running())
 
 
 	@property
@@ -309,26 +428,11 @@ class ImageLayer(Layer):
 	def color_black(selfself):
 		return (0, 0, 0, 255)
 
-	@property
-	def next_id(self):
-		self.z += 1
-		return self.z
-
 	def on_resize(self, width, height):
 		print("ImageLayer.on_resize()")
 		self.window_width = width
 		self.window_height = height
 
-	@classmethod
-	def load_texture(cls, file):
-		try:
-			image = pyglet.image.load(file)
-		except pyglet.image.codecs.dds.DDSException:
-			print ("%s is not a valid image file." % file)
-			raise ImageViewerError
-
-		return image
-
 
 
 
@@ -377,6 +481,10 @@ class FileInfoLayer(Layer):
 		self.label.element.text = self.text
 		print("FileInfoLayer: %s" % self.text)
 
+	def on_slideshow_model_scan(self, model):
+		if self.model is not None:
+			self.label.element.text = self.text
+
 	def on_draw(self):
 		self.background.draw()
 		self.label.draw()
@@ -391,6 +499,67 @@ class FileInfoLayer(Layer):
 		        self.model.current_file)
 
 
+class PerfHUDLayer(Layer):
+	"""Performance overlay in the top left corner: frame times, latencies
+	of the current file, cache and prefetch state. Toggled with H; the text
+	is made again at most every iv64_hud.REFRESH seconds while it is
+	shown"""
+
+	is_event_handler = False
+
+	def __init__(self, image_layer):
+		print("INIT >>> PerfHUDLayer.init() ")
+		super(PerfHUDLayer, self).__init__()
+		self.image_layer = image_layer
+		self.stats = iv64_hud.shared
+		self.model = None
+		self.visible = False
+		self.label = Label(
+			'', x=10, y=director.get_window_size()[1] - 10,
+			font_name='Gill Sans',
+			font_size=10,
+		    color=(250, 250, 250, 255),
+		    anchor_x = "left",
+		    anchor_y = "top",
+		    multiline = True,
+		    width = 600
+		)
+		self.add(self.label, name="label")
+		self.schedule(self.step)
+
+	def step(self, dt):
+		"""called every frame: count it and update the text when due"""
+		self.stats.frame(self.image_layer.animating)
+		if self.visible and self.stats.due():
+			self.refresh()
+
+	def refresh(self):
+		current = None
+		if self.model is not None:
+			current = self.model.current_file
+		lines = self.stats.lines(
+			current, queues=[('prefetch', self.image_layer.loader.depth)])
+		text = '\n'.join(lines)
+		if text != self.label.element.text:
+			self.label.element.text = text
+
+	def toggle_visibility(self):
+		self.visible = not self.visible
+		if self.visible:
+			self.refresh()
+
+	def on_slideshow_model_update(self, model):
+		self.model = model
+
+	def on_key_press(self, symbol, modifiers):
+		if symbol == pyglet.window.key.H:
+			self.toggle_visibility()
+			return True
+
+	def on_resize(self, width, height):
+		self.label.position = (10, height - 10)
+
+
 
 
 
@@ -399,8 +568,10 @@ class SlideshowModel(pyglet.event.EventDispatcher):
 
 
 
-	def __init__(self, folder):
-		"""initialize with name of the folder"""
+	def __init__(self, folder, recursive=False, seed=None):
+		"""initialize with name of the folder. In recursive mode subfolders
+		are read too and files holds paths relative to the folder in a
+		compact PathIndex. seed makes the random order reproducible"""
 		super(SlideshowModel, self).__init__()
 		try:
 			self.folder = folder
@@ -413,11 +584,33 @@ class SlideshowModel(pyglet.event.EventDispatcher):
 			print "An exception occurred: message: ", e.msg
 			self.folder = None
 
-		self.all_files = [f for f in os.listdir(self.folder)
-		                 if FileType.isnot_sys.match(f)]
-		self.image_files = [f for f in self.all_files
-		                   if FileType.is_image.match(f)]
+		# the folder is read in the background: wait for the first image
+		# only and let files grow while the slideshow runs
+		self.recursive = recursive
+		if recursive:
+			self.all_files = iv64_scan.PathIndex()
+			self.image_files = iv64_scan.PathIndex()
+		else:
+			self.all_files = []
+			self.image_files = []
 		self.files = self.image_files
+		self._positions = iv64_watch.Positions(self.files)
+		self._scanned_total = 0
+		self._sort_keys = iv64_sort.SortKeys(self.folder)
+		self.order = None  # iv64_sort order, None for the folder's own
+		self._scanner = iv64_scan.Scanner(self._scan(), self.image_files.extend)
+
+		# pick up files added to the folder while the slideshow runs. The
+		# watcher starts before the scan and its events are applied once
+		# the scan is over, see _check_watch
+		self._watcher = iv64_watch.FolderWatcher(self.folder,
+		                                         recursive=recursive)
+		self._watcher.start()
+		pyglet.clock.schedule_interval(self._check_watch, 0.25)
+
+		self._scanner.start()
+		self._scanner.wait_first()
+		pyglet.clock.schedule_interval(self._check_scan, 0.25)
 
 		self.loop = True
 		self.random = False
@@ -426,11 +619,12 @@ class SlideshowModel(pyglet.event.EventDispatcher):
 		self._direction = "forward"
 		self._play_random = False
 
-		# used for tracking random files. in particular, allow
-		# to go back to files just previously viewed when playing in random
+		# random order is an iv64_shuffle.Shuffle, made when random play is
+		# first turned on. It allows going back to files just previously
+		# viewed without keeping any history
 		self._play_random = False
-		self._id_queue_past = []
-		self._id_queue = []
+		self.seed = seed
+		self._shuffle = None
 
 		# animation properties
 		self._autonext_interval_msec = 2000 # in milliseconds
@@ -438,6 +632,57 @@ class SlideshowModel(pyglet.event.EventDispatcher):
 		# animation started
 		self._playing = False
 
+	def _scan(self):
+		"""read the folder, filling all_files and yielding image names"""
+		if self.recursive:
+			names = iv64_scan.walk_names(self.folder)
+		else:
+			names = iv64_scan.iter_names(self.folder)
+		for f in names:
+			if FileType.isnot_sys.match(os.path.basename(f)):
+				self.all_files.append(f)
+				if FileType.is_image.match(f):
+					yield f
+
+	def _check_scan(self, dt):
+		"""tell the views about files found since the last check"""
+		done = self._scanner.done
+		if self.total_files != self._scanned_total:
+			self._scanned_total = self.total_files
+			self.dispatch_event("on_slideshow_model_scan", self)
+		if done:
+			pyglet.clock.unschedule(self._check_scan)
+
+	def _check_watch(self, dt):
+		"""apply the changes seen by the folder watcher, once the scan is
+		over: files it found as well are in files then and are not added
+		twice"""
+		if not self._scanner.done:
+			return
+		changes = self._watcher.poll()
+		if not changes:
+			return
+		current = self.current_file if self.files else None
+		self.apply_changes(changes)
+		if self.total_files != self._scanned_total:
+			self._scanned_total = self.total_files
+			self.dispatch_event("on_slideshow_model_scan", self)
+		if self.files and self.current_file != current:
+			self._dispatch_slideshow_update()
+
+	def apply_changes(self, changes):
+		"""apply iv64_watch events to files, keeping current_id on the same
+		file"""
+		def wanted(name):
+			return (FileType.isnot_sys.match(os.path.basename(name)) and
+			        FileType.is_image.match(name))
+		self._current_id = self._positions.apply(
+			changes, self._current_id, wanted)
+		# files added go at the end, files removed move the ones after them
+		if self._shuffle is not None and \
+		   any(change[0] != iv64_watch.ADD for change in changes):
+			self._shuffle.reset(len(self.files), self._current_id)
+
 	@property
 	def direction(self):
 		return self._direction
@@ -452,11 +697,20 @@ class SlideshowModel(pyglet.event.EventDispatcher):
 
 	@property
 	def current_file(self):
+		return os.path.join(self.folder, self.files[self.current_id])
+
+	@property
+	def upcoming_file(self):
+		"""the file next() is going to show"""
+		if not self.files:
+			return None
 		if self.play_random:
-			filename = self.files.index(self.current_id)
+			i = self.shuffle.peek()
+		elif self.direction is "forward":
+			i = (self._current_id + 1) % len(self.files)
 		else:
-			filename = self.files[self.current_id]
-		return os.path.join(self.folder, filename)
+			i = (self._current_id - 1) % len(self.files)
+		return os.path.join(self.folder, self.files[i])
 
 	@property
 	def total_files(self):
@@ -526,12 +780,7 @@ class SlideshowModel(pyglet.event.EventDispatcher):
 
 		# random
 		else:
-			if not len(self._id_queue):
-				self._id_queue = range(len(self.files))
-			else:
-				self._current_id = random.randrange(len(self._id_queue))
-				self._id_queue.remove(self.current_id)
-				self._id_queue_past.append(self.current_id)
+			self._current_id = self.shuffle.next()
 
 		self._dispatch_slideshow_update()
 
@@ -550,14 +799,63 @@ class SlideshowModel(pyglet.event.EventDispatcher):
 
 		# random
 		else:
-			if not len(self._id_queue_past):
+			if not self.shuffle.position:
 				return # no more previous queue to go to, so don't do anything
 			else:
-				self._current_id = self._id_queue_past.pop()
-				self._id_queue.append(self.current_id)
+				self._current_id = self.shuffle.prev()
 
 		self._dispatch_slideshow_update()
 
+	def toggle_random(self):
+		"""switch between playing in order and in random order. The random
+		order carries on from the current file"""
+		self._play_random = not self._play_random
+		if self._play_random:
+			if self._shuffle is None:
+				self._shuffle = iv64_shuffle.Shuffle(len(self.files), self.seed)
+				self.seed = self._shuffle.seed
+				print("random order seed: %d" % self.seed)
+			self._shuffle.reset(len(self.files), self._current_id)
+
+	@property
+	def shuffle(self):
+		"""the random order, kept in step with the number of files: files
+		appended join it from the next pass on"""
+		if len(self.files) > self._shuffle.n:
+			self._shuffle.grow(len(self.files))
+		elif len(self.files) < self._shuffle.n:
+			self._shuffle.reset(len(self.files), self._current_id)
+		return self._shuffle
+
+	def set_order(self, order):
+		"""play the files in order, one of iv64_sort.ORDERS. The files are
+		sorted in the background and put in order by _check_sort"""
+		self.order = order
+		self._sort_keys.sort(self.files, order)
+		pyglet.clock.unschedule(self._check_sort)
+		pyglet.clock.schedule_interval(self._check_sort, 0.25)
+
+	def next_order(self):
+		"""switch to the order after the current one"""
+		self.set_order(iv64_sort.next_order(self.order))
+
+	def _check_sort(self, dt):
+		"""put the files in order once they are sorted, keeping current_id
+		on the same file"""
+		result = self._sort_keys.poll()
+		if result is None:
+			return
+		pyglet.clock.unschedule(self._check_sort)
+		current = iv64_sort.reorder(self.files, result, self._current_id)
+		if current is None:
+			self.set_order(self.order) # files were removed, sort again
+			return
+		self._positions.reordered(len(result[1]))
+		self._current_id = current
+		if self._shuffle is not None:
+			self._shuffle.reset(len(self.files), self._current_id)
+		self.dispatch_event("on_slideshow_model_scan", self)
+
 	def limit_id_range(self):
 		self._current_id = (self._current_id + len(self.files)) \
 				% len(self.files)
@@ -586,6 +884,7 @@ class SlideshowModel(pyglet.event.EventDispatcher):
 
 
 SlideshowModel.register_event_type("on_slideshow_model_update")
+SlideshowModel.register_event_type("on_slideshow_model_scan")
 
 
 ### Controllers ---------------------------------------------------------------
@@ -593,10 +892,10 @@ SlideshowModel.register_event_type("on_slideshow_model_update")
 class SlideshowController(object):
 	"""controller for slideshow interactions"""
 
-	def __init__(self, folder):
+	def __init__(self, folder, recursive=False, seed=None):
 		"""Create a controller capable of handling the slidehow user inputs"""
 #		super(SlideshowController, self).__init__()
-		self.model = SlideshowModel(folder)
+		self.model = SlideshowModel(folder, recursive=recursive, seed=seed)
 #		self.ssPlayback = SlideshowPlayback(model=self.model, duration=1.5)
 
 
@@ -627,6 +926,14 @@ class SlideshowController(object):
 			self.do( Repeat( CallFunc( modelNextImage ) + Delay (1.5) ) )
 
 
+		# random order on/off
+		elif symbol == pyglet.window.key.R:
+			self.model.toggle_random()
+
+		# next play order
+		elif symbol == pyglet.window.key.O:
+			self.model.next_order()
+
 		# window resizing
 		elif symbol in [pyglet.window.key.BRACKETLEFT,
 		                pyglet.window.key.BRACKETRIGHT]:
@@ -697,31 +1004,38 @@ class SingleImageScene(Scene):
 
 class Controller():
 
-	def __init__(self, folder):
+	def __init__(self, folder, recursive=False, seed=None):
 		director.init(
 			width=800, height=600, caption="Image Viewer", fullscreen=False,
 		    do_not_scale=True, resizable=True
 		)
+		# the director draws and flips on its own: time the flips
+		if iv64_trace.shared.enabled:
+			director.window.flip = iv64_trace.shared.wrap('present',
+			                                              director.window.flip)
 
 		bg = BackgroundLayer(0, 0, 0, 255, width=800, height=600)
 		img = ImageLayer()
 		info = FileInfoLayer()
+		hud = PerfHUDLayer(img)
 
 		self.scene = SingleImageScene()
 		self.scene.add(bg,   z=1, name = "bg")
 		self.scene.add(img,  z=4, name = "img")
 		self.scene.add(info, z=9, name = "info")
+		self.scene.add(hud,  z=10, name = "hud")
 		self.scene.push_all_handlers()
 
 
-		self.slideshowController = SlideshowController(folder)
+		self.slideshowController = SlideshowController(folder, recursive, seed)
 		self.slideshowController.add_model_update_handlers(
-			[bg, img, info]
+			[bg, img, info, hud]
 		)
 		director.window.push_handlers(self.slideshowController)
 		director.window.push_handlers(bg)
 		director.window.push_handlers(img)
 		director.window.push_handlers(info)
+		director.window.push_handlers(hud) # before the controller sees H
 
 
 		print ("INIT >>> SingleImageScene.init()")
@@ -731,12 +1045,19 @@ class Controller():
 	def run(self):
 		director.run(self.scene)
 		self.slideshowController.start_model()
+		iv64_probe.shared.save()
 
 
 
 
 def main():
-	controller = Controller('/Volumes/Proteus/virtualbox/_share/bru')
+	recursive = '-r' in sys.argv or '--recursive' in sys.argv
+	seed = None
+	for a in sys.argv:
+		if a.startswith('--seed='):
+			seed = int(a[len('--seed='):])
+	controller = Controller('/Volumes/Proteus/virtualbox/_share/bru', recursive,
+	                        seed)
 	controller.run()
 
 
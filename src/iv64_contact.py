@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_contact: contact sheets of a folder, page after page.
+
+	python iv64_contact.py FOLDER [--out=DIR] [--format=png|jpg]
+	                       [--cols=6] [--rows=5] [--thumb=240x180]
+	                       [--gap=8] [--order=ORDER] [--workers=N] [-r]
+
+The folder is read and ordered as the pygame viewer does it and every
+image becomes a cell of a grid: its thumbnail with the caption the viewer's
+file info shows, [n/total]: filename, the name relative to the folder.
+Pages of cols x rows cells are written to DIR as sheet_0001.png and so on.
+
+Thumbnails are made on a pool of processes. JPEGs are decoded as a DCT
+scaled draft no larger than needed, as the viewer does with a window size,
+and scaled down with ImageView.fit_to_window. Only the pixels of a
+thumbnail come back from a worker.
+
+Pages are put together in order as thumbnails arrive, and at most four
+thumbnails per worker are waiting at any time, so the memory used is one
+page and a few thumbnails however many files the folder holds.
+"""
+from __future__ import print_function
+
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import os
+import sys
+
+import iv64_batch
+import pygame
+from pygame.locals import Rect
+import iv64_cache
+import iv64_pygame
+from iv64_pygame import FileInfo, ImageView
+
+BG_COLOR = (250, 250, 250)
+THUMB_BG_COLOR = (50, 50, 50)
+CAPTION_COLOR = (50, 50, 50)
+FORMATS = ('png', 'jpg')
+
+
+def sheet_name(number, format):
+	return 'sheet_%04d.%s' % (number, format)
+
+
+def _init_worker():
+	"""set up a process of the pool: thumbnails are converted, which needs
+	a display mode, and never looked at twice, so nothing is cached"""
+	pygame.display.init()
+	pygame.display.set_mode((1, 1))
+	iv64_cache.shared.set_budget(0)
+
+
+def make_thumbnail(job):
+	"""worker: return (index, size, RGB string) of the thumbnail of a file,
+	(index, None, None) if it cannot be read. job is (index, filename,
+	thumb size)"""
+	index, filename, size = job
+	cell = Rect((0, 0), size)
+	try:
+		image, rect = iv64_pygame.loadImage(filename, size)
+	except iv64_pygame.ImageViewerError:
+		return index, None, None
+	thumb, rect = ImageView.fit_to_window(
+		image, iv64_pygame.probeRect(filename) or rect, cell)
+	return index, rect.size, pygame.image.tostring(thumb, 'RGB')
+
+
+def thumbnails(files, size, workers):
+	"""yield (index, size, RGB string) of the thumbnails of files, in
+	order, keeping at most 4 * workers of them waiting"""
+	jobs = ((index, filename, size) for index, filename in enumerate(files))
+	return iv64_batch.ordered(make_thumbnail, jobs, workers, 4 * workers,
+	                          _init_worker)
+
+
+class ContactSheet(object):
+	"""Lays out thumbnails and their captions on pages of cols x rows
+	cells, one page at a time"""
+
+	def __init__(self, cols, rows, thumb, gap=8):
+		"""initialization.
+		@param  cols   cells per row
+		@param  rows   rows per page
+		@param  thumb  (width, height) thumbnails are fitted to
+		@param  gap    pixels around the cells"""
+		self.cols = cols
+		self.rows = rows
+		self.thumb = thumb
+		self.gap = gap
+		self.font = pygame.font.Font(pygame.font.match_font('Helvetica'), 12)
+		self.cell = (thumb[0], thumb[1] + self.font.get_linesize() + 2)
+		self.size = (cols * (self.cell[0] + gap) + gap,
+		             rows * (self.cell[1] + gap) + gap)
+		self.page = None
+
+	@property
+	def per_page(self):
+		return self.cols * self.rows
+
+	def new_page(self):
+		self.page = pygame.Surface(self.size)
+		self.page.fill(BG_COLOR)
+
+	def caption(self, name, index, total):
+		"""return the caption of a cell, the name shortened from the left
+		until it fits"""
+		text = FileInfo.format(name, index, total)
+		if self.font.size(text)[0] <= self.thumb[0]:
+			return text
+		prefix = FileInfo.format('', index, total) + '...'
+		while name and self.font.size(prefix + name)[0] > self.thumb[0]:
+			name = name[1:]
+		return prefix + name
+
+	def place(self, slot, thumbnail, caption):
+		"""draw a thumbnail, a (size, RGB string) pair or (None, None), and
+		its caption in cell slot of the page"""
+		size, pixels = thumbnail
+		col, row = slot % self.cols, slot // self.cols
+		x = self.gap + col * (self.cell[0] + self.gap)
+		y = self.gap + row * (self.cell[1] + self.gap)
+		box = Rect((x, y), self.thumb)
+		self.page.fill(THUMB_BG_COLOR, box)
+		if size is not None:
+			image = pygame.image.fromstring(pixels, size, 'RGB')
+			self.page.blit(image, image.get_rect(center=box.center))
+		text = self.font.render(caption, 1, CAPTION_COLOR, BG_COLOR)
+		self.page.blit(text, (x, box.bottom + 2))
+
+
+def make_sheets(folder, files, options):
+	"""write the contact sheets of files, the images of folder, and return
+	the number of pages"""
+	pygame.font.init()
+	sheet = ContactSheet(options['cols'], options['rows'], options['thumb'],
+	                     options['gap'])
+	total = len(files)
+	pages = 0
+	for index, size, pixels in thumbnails(files, options['thumb'],
+	                                      options['workers']):
+		slot = index % sheet.per_page
+		if slot == 0:
+			sheet.new_page()
+		name = os.path.relpath(files[index], folder.path)
+		sheet.place(slot, (size, pixels), sheet.caption(name, index, total))
+		if slot == sheet.per_page - 1 or index == total - 1:
+			pages += 1
+			path = os.path.join(options['out'],
+			                    sheet_name(pages, options['format']))
+			pygame.image.save(sheet.page, path)
+			print('[%d/%d]: %s' % (index + 1, total, path), file=sys.stderr)
+	return pages
+
+
+def parse_options(argv):
+	"""return the folder and the options of argv"""
+	return iv64_batch.parse_options(
+		argv,
+		dict(out='contact', format='png', cols=6, rows=5, thumb=(240, 180),
+		     gap=8),
+		dict(format=iv64_batch.choice('format', FORMATS),
+		     thumb=iv64_batch.parse_size, cols=int, rows=int, gap=int),
+		__doc__)
+
+
+def main(argv):
+	folder, options = parse_options(argv[1:])
+	folder, files = iv64_batch.folder_files(folder, options['recursive'],
+	                                        options['order'])
+	if not os.path.isdir(options['out']):
+		os.makedirs(options['out'])
+	pages = make_sheets(folder, files, options)
+	print('%d images on %d sheets' % (len(files), pages), file=sys.stderr)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
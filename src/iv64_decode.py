@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_decode: image files decoded to pyglet ImageData, for the pyglet and
+cocos viewers.
+
+Files are decoded through an iv64_mmap map and kept in the iv64_cache
+image cache (load). With PIL they are decoded at a power of two reduction
+of their size when the window shows them smaller than that
+(reduction_for): JPEGs are reduced by the decoder itself, which is much
+faster than decoding them whole. Without PIL pyglet decodes every file
+whole.
+
+A Decoder decodes on a thread of its own and hands the image back to the
+main thread, which owns the GL context and pyglet's clock, when that asks
+for it. Only the texture upload is left to the main thread.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import threading
+
+import pyglet
+
+import iv64_cache
+import iv64_hud
+import iv64_mmap
+import iv64_probe
+import iv64_trace
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+
+def image_bytes(image):
+	"""memory held by a decoded pyglet image, counted as RGBA"""
+	return image.width * image.height * 4
+
+
+def reduction_for(size, window_size):
+	"""return the largest power of two an image of `size` can be divided by
+	and still be at least as large as it is shown once fitted to
+	window_size, 1 if it cannot be reduced without PIL"""
+	if Image is None:
+		return 1
+	if min(window_size) < 1 or min(size) < 1:
+		return 1  # minimised window or broken header
+	scale = min(float(window_size[0]) / size[0],
+	            float(window_size[1]) / size[1])
+	factor = 1
+	while scale * factor * 2 <= 1.0:
+		factor *= 2
+	return factor
+
+
+def reduction_of(file, window_size, info=None):
+	"""return the power of two file can be decoded reduced by for
+	window_size, from its iv64_probe header info, 1 if it cannot be
+	reduced"""
+	if info is None:
+		info = iv64_probe.shared.probe(file)
+	if info is None:
+		return 1
+	return reduction_for(info.size, window_size)
+
+
+def _rgb(image):
+	"""return a PIL image in RGB, or RGBA if it has transparency"""
+	if image.mode in ('RGB', 'RGBA'):
+		return image
+	if 'A' in image.mode or 'transparency' in image.info:
+		return image.convert('RGBA')
+	return image.convert('RGB')
+
+
+def from_pil(image):
+	"""return the pyglet ImageData of a PIL image, in RGB or RGBA. The
+	ImageData reads the bytes PIL hands out"""
+	image = _rgb(image)
+	if hasattr(image, 'tobytes'):
+		data = image.tobytes()
+	else:
+		data = image.tostring()
+	width, height = image.size
+	# PIL rows go top down, pyglet's bottom up
+	return pyglet.image.ImageData(width, height, image.mode, data,
+	                              pitch=-width * len(image.mode))
+
+
+def load(file, reduction=1):
+	"""return the ImageData of file at 1/reduction of its size from the
+	image cache, decoding it on a miss"""
+	target = None
+	if reduction > 1:
+		target = ('reduced', reduction)
+	def cached():
+		with iv64_hud.shared.timing('decode', file):
+			return decode(file, reduction)
+	return iv64_cache.shared.fetch(file, cached, image_bytes, target)
+
+
+def load_for(file, window_size):
+	"""return the ImageData of file from the image cache, decoded at the
+	reduction suiting window_size"""
+	return load(file, reduction_of(file, window_size))
+
+
+@iv64_trace.traced('decode')
+def decode(file, reduction=1):
+	"""decode file at 1/reduction of its size, whole if PIL cannot read
+	it. Raises IOError if pyglet cannot either"""
+	if reduction > 1:
+		try:
+			return decode_reduced(file, reduction)
+		except IOError:
+			pass  # let pyglet have a go at the full image
+	try:
+		with iv64_mmap.MappedFile(file) as stream:
+			return pyglet.image.load(file, file=stream)
+	except pyglet.image.codecs.dds.DDSException:
+		raise IOError("%s is not a valid image file." % file)
+
+
+def decode_reduced(file, reduction):
+	"""decode file with PIL at 1/reduction of its size"""
+	with iv64_mmap.MappedFile(file) as stream:
+		image = Image.open(stream)
+		width = max(1, image.size[0] // reduction)
+		height = max(1, image.size[1] // reduction)
+		image.draft('RGB', (width, height))
+		image = _rgb(image)
+		if image.size != (width, height):
+			image = image.resize((width, height), Image.ANTIALIAS)
+		return from_pil(image)
+
+
+class Decoder(object):
+	"""Decodes files with load_for() on a thread of its own, one at a time.
+	Only the latest request is kept: one made before it that has not been
+	started yet is dropped"""
+
+	def __init__(self, name='decoder'):
+		"""initialization.
+		@param  name  name of the thread"""
+		self.name = name
+		self._pending = None  # (file, window_size) waiting for the thread
+		self._running = None  # (file, window_size) being decoded
+		self._done = None     # (request, image or None if it failed)
+		self._cond = threading.Condition()
+		self._worker = None
+
+	@property
+	def depth(self):
+		"""number of files waiting for or being decoded"""
+		return (self._pending is not None) + (self._running is not None)
+
+	def request(self, file, window_size):
+		"""decode file for window_size on the thread"""
+		with self._cond:
+			self._pending = (file, tuple(window_size))
+			if self._worker is None:
+				self._worker = threading.Thread(target=self._work,
+				                                name=self.name)
+				self._worker.daemon = True
+				self._worker.start()
+			self._cond.notify()
+
+	def result(self, file, window_size):
+		"""return (done, image) of the request for file and window_size.
+		done is False while it waits or is decoded; image is None if the
+		file could not be decoded or the request was dropped. An image is
+		handed out once"""
+		request = (file, tuple(window_size))
+		with self._cond:
+			if self._done is not None and self._done[0] == request:
+				image = self._done[1]
+				self._done = None
+				return True, image
+			if request in (self._pending, self._running):
+				return False, None
+			return True, None
+
+	def _work(self):
+		"""worker loop for request()"""
+		while True:
+			with self._cond:
+				while self._pending is None:
+					self._cond.wait()
+				request = self._running = self._pending
+				self._pending = None
+			try:
+				image = load_for(*request)
+			except Exception as e:
+				print("decoding %s failed: %s" % (request[0], e))
+				image = None
+			with self._cond:
+				self._done = (request, image)
+				self._running = None
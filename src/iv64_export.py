@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_export: render a slideshow to frame files instead of the screen.
+
+	python iv64_export.py FOLDER [--out=DIR|-] [--format=png|rgb]
+	                      [--size=1280x720] [--fps=25] [--hold=3]
+	                      [--fade=0.85] [--loop] [--order=ORDER]
+	                      [--workers=N] [-r]
+
+The folder is read into a Queue as in the pygame viewer and every frame
+is made the way the viewer makes it: slides are fitted with
+ImageView.fit_to_window and padded_image and blended by its Crossfade.
+It all runs on SDL's dummy video driver, without a window, and is timed
+by frame numbers instead of the clock, so a show renders as fast as the
+machine allows.
+
+The show is cut into segments, one per slide: the frames holding the
+slide followed by the fade to the next one, which --loop adds after the
+last slide too. Segments are rendered on a pool of processes.
+
+With --out=DIR the frames are written to DIR as frame_000001.png and so
+on, or as raw RGB frames (frame_000001.rgb) with --format=rgb. The frames
+holding a slide are all alike, so only the first is rendered and written;
+the others are hard links to it where the file system allows.
+
+With --out=- the raw RGB frames go to stdout in order, to be piped into
+an encoder, for example
+
+	python iv64_export.py ~/Pictures --out=- | ffmpeg -f rawvideo \\
+		-pix_fmt rgb24 -s 1280x720 -r 25 -i - loop.mp4
+
+Each segment is handed back through a temporary file and at most two
+segments per worker wait to be written, so the temporary space used does
+not grow with the length of the show.
+"""
+from __future__ import print_function
+
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import os
+import shutil
+import sys
+import tempfile
+
+import iv64_batch
+import pygame
+from pygame.locals import Rect
+import iv64_cache
+import iv64_pygame
+from iv64_pygame import ImageView
+
+BG_COLOR = (0, 0, 0)
+FORMATS = ('png', 'rgb')
+
+
+def frame_name(number, format):
+	return 'frame_%06d.%s' % (number, format)
+
+
+def _init_worker(size):
+	"""set up a process of the pool: surfaces can only be converted once
+	there is a display mode, the dummy driver's will do. Anything printed
+	goes to stderr, as stdout may be carrying the frames, and no image is
+	cached: a slide is only looked at again by whichever worker renders
+	the next segment, so a full cache per worker would be wasted"""
+	os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+	pygame.display.init()
+	pygame.display.set_mode(size)
+	iv64_cache.shared.set_budget(0)
+
+
+def _slide(filename, winrect):
+	"""return filename fitted and padded to winrect as the viewer shows it,
+	or a blank slide if it cannot be read"""
+	try:
+		image, rect = iv64_pygame.loadImage(filename, winrect.size)
+	except iv64_pygame.ImageViewerError:
+		print('skipping %s' % filename, file=sys.stderr)
+		surface = pygame.Surface(winrect.size).convert()
+		surface.fill(BG_COLOR)
+		return surface
+	fitted, fitted_rect = ImageView.fit_to_window(
+		image, iv64_pygame.probeRect(filename) or rect, winrect)
+	return ImageView.padded_image(fitted, winrect.size, BG_COLOR)
+
+
+def _link(source, target):
+	"""make target a copy of source, a hard link if possible"""
+	if os.path.exists(target):
+		os.unlink(target)
+	try:
+		os.link(source, target)
+	except (OSError, AttributeError):
+		shutil.copyfile(source, target)
+
+
+def _write(surface, path, format):
+	if format == 'png':
+		pygame.image.save(surface, path)
+	else:
+		with open(path, 'wb') as f:
+			f.write(pygame.image.tostring(surface, 'RGB'))
+
+
+def render_segment(job):
+	"""worker: render one segment. job is (index, filename, following,
+	first, options), following being the file faded to or None and first
+	the number of the first frame. Frames go to options['out'] or, for
+	stdout, to a temporary file holding the first frame and the fade frames
+	only. Returns (index, path of that file or None)"""
+	index, filename, following, first, options = job
+	winrect = Rect((0, 0), options['size'])
+	hold, fade = options['hold_frames'], options['fade_frames']
+	slide = _slide(filename, winrect)
+	frames = [slide]
+	if following is not None and fade:
+		# one step more than there are frames, so that none of them is
+		# exactly the slide before or after
+		crossfade = iv64_pygame.Crossfade(slide, _slide(following, winrect),
+		                                  duration=fade + 1)
+		frames = ((crossfade.render(crossfade.start + step)
+		           if step else slide) for step in range(fade + 1))
+
+	if options['out'] == '-':
+		fd, chunk = tempfile.mkstemp(prefix='segment%06d' % index,
+		                             dir=options['tmp'])
+		with os.fdopen(fd, 'wb') as f:
+			for frame in frames:
+				f.write(pygame.image.tostring(frame, 'RGB'))
+		return index, chunk
+
+	out, format = options['out'], options['format']
+	for step, frame in enumerate(frames):
+		if step:
+			number = first + hold + step - 1
+			_write(frame, os.path.join(out, frame_name(number, format)), format)
+			continue
+		held = os.path.join(out, frame_name(first, format))
+		_write(frame, held, format)
+		for number in range(first + 1, first + hold):
+			_link(held, os.path.join(out, frame_name(number, format)))
+	return index, None
+
+
+def _stream(chunk, hold, frame_bytes, out):
+	"""write a segment file to out, its first frame hold times"""
+	with open(chunk, 'rb') as f:
+		held = f.read(frame_bytes)
+		for i in range(hold):
+			out.write(held)
+		shutil.copyfileobj(f, out, frame_bytes)
+	os.unlink(chunk)
+
+
+def segments(files, options):
+	"""return the render_segment jobs of a show of files"""
+	frames = options['hold_frames'] + options['fade_frames']
+	jobs = []
+	for i, filename in enumerate(files):
+		following = None
+		if i + 1 < len(files):
+			following = files[i + 1]
+		elif options['loop'] and len(files) > 1:
+			following = files[0]
+		jobs.append((i, filename, following, i * frames + 1, options))
+	return jobs
+
+
+def export(files, options):
+	"""render the show of files as given by options"""
+	jobs = segments(files, options)
+	workers = options['workers']
+	done = iv64_batch.ordered(render_segment, jobs, workers, 2 * workers,
+	                          _init_worker, (options['size'],))
+	if options['out'] != '-':
+		for index, chunk in done:
+			print('[%d/%d]: %s' % (index + 1, len(jobs), jobs[index][1]),
+			      file=sys.stderr)
+		return
+
+	# stdout: segments are written in order as soon as each is done
+	out = getattr(sys.stdout, 'buffer', sys.stdout)
+	frame_bytes = options['size'][0] * options['size'][1] * 3
+	for index, chunk in done:
+		_stream(chunk, options['hold_frames'], frame_bytes, out)
+	out.flush()
+
+
+def parse_options(argv):
+	"""return the folder and the options of argv"""
+	folder, options = iv64_batch.parse_options(
+		argv,
+		dict(out='frames', format='png', size=(1280, 720), fps=25.0,
+		     hold=3.0, fade=0.85, loop=False),
+		dict(format=iv64_batch.choice('format', FORMATS),
+		     size=iv64_batch.parse_size, fps=float, hold=float, fade=float,
+		     loop=iv64_batch.flag),
+		__doc__)
+	options['hold_frames'] = max(1, int(round(options['hold'] * options['fps'])))
+	options['fade_frames'] = max(0, int(round(options['fade'] * options['fps'])))
+	return folder, options
+
+
+def main(argv):
+	folder, options = parse_options(argv[1:])
+	folder, files = iv64_batch.folder_files(folder, options['recursive'],
+	                                        options['order'])
+
+	tmp = None
+	if options['out'] == '-':
+		tmp = options['tmp'] = tempfile.mkdtemp(prefix='iv64_export')
+	elif not os.path.isdir(options['out']):
+		os.makedirs(options['out'])
+	try:
+		export(files, options)
+	finally:
+		if tmp is not None:
+			shutil.rmtree(tmp, ignore_errors=True)
+	frames = len(files) * options['hold_frames']
+	for job in segments(files, options):
+		if job[2] is not None:
+			frames += options['fade_frames']
+	print('%d slides, %d frames at %s fps' % (len(files), frames,
+	                                         options['fps']), file=sys.stderr)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_hud: the numbers behind the performance overlay of the viewers.
+
+The viewers report every frame they present, and how long decoding,
+scaling and uploading each file took, to the shared PerfStats. The overlay
+asks for its text at most every REFRESH seconds, so a visible overlay costs
+a few text renders per second and a hidden one nothing more than the frame
+bookkeeping.
+
+Frame times are measured between consecutive frames of a transition, as
+frames are only drawn continuously while something moves. A frame that
+takes more than one and a half times the frame budget counts as dropped,
+once for every frame it missed.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+from collections import deque
+from collections import OrderedDict
+import threading
+import time
+
+import iv64_cache
+
+FRAME_BUDGET = 1.0 / 60
+REFRESH = 0.25  # seconds between two updates of the overlay text
+
+# latencies shown on the overlay, in order
+KINDS = ('decode', 'scale', 'upload')
+
+
+def megabytes(nbytes):
+	return '%.1f MB' % (nbytes / (1024.0 * 1024.0))
+
+
+class _Timing(object):
+	__slots__ = ('stats', 'kind', 'key', 'start')
+
+	def __init__(self, stats, kind, key):
+		self.stats = stats
+		self.kind = kind
+		self.key = key
+
+	def __enter__(self):
+		self.start = time.time()
+		return self
+
+	def __exit__(self, *exc):
+		if exc[0] is None:
+			self.stats.record(self.kind, self.key, time.time() - self.start)
+		return False
+
+
+class PerfStats(object):
+	"""Frame pacing and per file latencies of a viewer"""
+
+	def __init__(self, budget=FRAME_BUDGET, refresh=REFRESH, history=120,
+	             files=256):
+		"""initialization.
+		@param  budget   seconds a frame may take
+		@param  refresh  seconds between two updates of the overlay text
+		@param  history  number of frame times the average is taken over
+		@param  files    number of files latencies are kept for"""
+		self.budget = budget
+		self.refresh = refresh
+		self.files = files
+		self.frame_times = deque(maxlen=history)
+		self.frames = 0
+		self.dropped = 0
+		self._last_frame = None
+		self._animating = False
+		self._refreshed = None
+		self._latencies = OrderedDict()  # (kind, key) -> seconds
+		self._lock = threading.Lock()
+
+	def frame(self, animating=False, now=None):
+		"""count a frame put on screen. animating tells whether it is part
+		of a transition"""
+		if now is None:
+			now = time.time()
+		self.frames += 1
+		if animating and self._animating:
+			interval = now - self._last_frame
+			self.frame_times.append(interval)
+			if interval > self.budget * 1.5:
+				self.dropped += int(interval / self.budget + 0.5) - 1
+		self._last_frame = now
+		self._animating = animating
+
+	def record(self, kind, key, seconds):
+		"""keep how long the step kind ('decode', 'scale', 'upload') took
+		for key, usually the file name"""
+		with self._lock:
+			self._latencies.pop((kind, key), None)
+			self._latencies[(kind, key)] = seconds
+			while len(self._latencies) > self.files * len(KINDS):
+				self._latencies.popitem(last=False)
+
+	def timing(self, kind, key):
+		"""return a context manager recording the time spent in it"""
+		return _Timing(self, kind, key)
+
+	def latency(self, kind, key):
+		"""return the seconds kind took for key, None if it is not known"""
+		with self._lock:
+			return self._latencies.get((kind, key))
+
+	@property
+	def frame_ms(self):
+		"""average frame time in milliseconds, None before any transition"""
+		if not self.frame_times:
+			return None
+		return sum(self.frame_times) * 1000.0 / len(self.frame_times)
+
+	def due(self, now=None):
+		"""return True, at most once every refresh seconds, when the
+		overlay text should be made again"""
+		if now is None:
+			now = time.time()
+		if self._refreshed is not None and now - self._refreshed < self.refresh:
+			return False
+		self._refreshed = now
+		return True
+
+	def invalidate(self):
+		"""make the next due() return True, e.g. when the overlay is shown"""
+		self._refreshed = None
+
+	def lines(self, key=None, queues=(), resident=()):
+		"""return the lines of the overlay.
+		@param  key       the file shown, for its latencies
+		@param  queues    (name, length) of the background queues
+		@param  resident  (name, bytes) of the memory held for images"""
+		frame = self.frame_ms
+		if frame is None:
+			text = 'frame  -'
+		else:
+			text = 'frame  %.1f ms  max %.1f ms' % (
+				frame, max(self.frame_times) * 1000.0)
+		lines = [text + '  dropped %d' % self.dropped]
+		latencies = []
+		for kind in KINDS:
+			seconds = self.latency(kind, key)
+			if seconds is not None:
+				latencies.append('%s %.1f ms' % (kind, seconds * 1000.0))
+		lines.append('  '.join(latencies) or 'decode -')
+		cache = iv64_cache.shared.stats()
+		text = 'cache  %d%% hits' % int(cache['hit_rate'] * 100 + 0.5)
+		for name, nbytes in (('images', cache['bytes']),) + tuple(resident):
+			text += '  %s %s' % (name, megabytes(nbytes))
+		lines.append(text)
+		if queues:
+			lines.append('  '.join('%s %d' % item for item in queues))
+		return lines
+
+
+# statistics shared by everything in the process
+shared = PerfStats()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_mmap: image files read through read only memory maps.
+
+The decoders of the pyglet and cocos viewers get a MappedFile instead of
+a file opened for buffered reads. They read straight from the page cache
+without a copy into a read buffer. A file looked at by the prefetcher and
+then again for the screen is in memory once, as the pages of all maps of
+a file are shared.
+
+A map keeps a descriptor of its own, so it is closed as soon as decoding
+is done, which a with block takes care of:
+
+	with iv64_mmap.MappedFile(filename) as f:
+		image = pyglet.image.load(filename, file=f)
+
+The descriptor the file was opened with is closed before the constructor
+returns, so nothing is left open whatever the decoder does with the file.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import io
+import mmap
+import os
+
+
+class MappedFile(object):
+	"""Read only file object over a memory map of a file. Empty files,
+	which cannot be mapped, are read from an empty buffer instead"""
+
+	def __init__(self, path):
+		"""map the file at path. Raises EnvironmentError if it cannot be
+		opened or mapped"""
+		self.name = path
+		self.closed = False
+		f = open(path, 'rb')
+		try:
+			size = os.fstat(f.fileno()).st_size
+			if size:
+				self._data = mmap.mmap(f.fileno(), size,
+				                       access=mmap.ACCESS_READ)
+				madvise = getattr(self._data, 'madvise', None)
+				if madvise is not None:
+					madvise(mmap.MADV_SEQUENTIAL)
+			else:
+				self._data = io.BytesIO(b'')
+		finally:
+			f.close()
+		self.size = size
+
+	def read(self, size=-1):
+		"""read size bytes, everything that is left if size is negative"""
+		if size is None or size < 0:
+			size = self.size - self._data.tell()
+		return self._data.read(size)
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def __getattr__(self, name):
+		# seek, tell, readline and the like come from the map
+		if name == '_data':
+			raise AttributeError(name)
+		return getattr(self._data, name)
+
+	def close(self):
+		"""unmap the file. A map a decoder still holds a buffer of is left
+		to be unmapped when that buffer goes"""
+		if self.closed:
+			return
+		self.closed = True
+		try:
+			self._data.close()
+		except BufferError:
+			pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+		return False
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_probe: read image dimensions, EXIF orientation and capture time and
+format from file headers only, without decoding any pixels.
+
+Supports JPEG (SOF marker, orientation and capture time from the EXIF APP1
+segment), PNG (IHDR), GIF (logical screen descriptor) and TIFF (first IFD
+and its EXIF IFD). Results are
+cached per folder, keyed on each file's mtime and size, and kept in
+$XDG_CACHE_HOME/iv64/probe so that layout, sorting and filtering of a
+folder seen before does not even need to read the headers again.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+from collections import namedtuple
+import hashlib
+import io
+import os
+import pickle
+import struct
+import tempfile
+import threading
+
+import iv64_renditions
+
+
+class ImageInfo(namedtuple('ImageInfo',
+                           'width height orientation format captured')):
+	"""Header information of an image. orientation is the EXIF value, 1
+	when there is none. captured is the EXIF capture time as a
+	'YYYY:MM:DD HH:MM:SS' string, None when there is none"""
+	__slots__ = ()
+
+	@property
+	def size(self):
+		return (self.width, self.height)
+
+	@property
+	def display_size(self):
+		"""size once the EXIF orientation is applied"""
+		if self.orientation >= 5:
+			return (self.height, self.width)
+		return (self.width, self.height)
+
+
+### Header parsers -------------------------------------------------------------
+def _tiff_tags(f, wanted, ifd=None):
+	"""read the tags in `wanted` from the first IFD of the TIFF structure
+	starting at the current position of f, or from the IFD at offset `ifd`
+	of that structure"""
+	base = f.tell()
+	header = f.read(8)
+	if header[:4] == b'II*\0':
+		order = '<'
+	elif header[:4] == b'MM\0*':
+		order = '>'
+	else:
+		return {}
+	offset = struct.unpack(order + 'I', header[4:8])[0]
+	if ifd is not None:
+		offset = ifd
+	f.seek(base + offset)
+	count = struct.unpack(order + 'H', f.read(2))[0]
+	data = f.read(count * 12)
+	tags = {}
+	for i in range(len(data) // 12):
+		tag, kind = struct.unpack_from(order + 'HH', data, i * 12)
+		if tag not in wanted:
+			continue
+		if kind == 3:    # SHORT
+			tags[tag] = struct.unpack_from(order + 'H', data, i * 12 + 8)[0]
+		elif kind == 4:  # LONG
+			tags[tag] = struct.unpack_from(order + 'I', data, i * 12 + 8)[0]
+		elif kind == 2:  # ASCII
+			count = struct.unpack_from(order + 'I', data, i * 12 + 4)[0]
+			if count <= 4:
+				value = data[i * 12 + 8:i * 12 + 8 + count]
+			else:
+				f.seek(base + struct.unpack_from(order + 'I', data,
+				                                 i * 12 + 8)[0])
+				value = f.read(count)
+			tags[tag] = value.rstrip(b'\0 ').decode('ascii', 'replace')
+	return tags
+
+
+def _exif(f):
+	"""return (orientation, capture time) from the TIFF structure starting
+	at the current position of f. The capture time is DateTimeOriginal from
+	the EXIF IFD, or DateTime when that is missing"""
+	base = f.tell()
+	tags = _tiff_tags(f, (274, 306, 34665))
+	times = []
+	if 34665 in tags:
+		f.seek(base)
+		times.append(_tiff_tags(f, (36867,), tags[34665]).get(36867))
+	times.append(tags.get(306))
+	for captured in times:
+		if captured and captured.strip('0: '):  # cameras blank out unset ones
+			return tags.get(274, 1), captured
+	return tags.get(274, 1), None
+
+
+def _probe_jpeg(f):
+	orientation, captured = 1, None
+	f.seek(2)
+	while True:
+		byte = f.read(1)
+		if not byte:
+			return None
+		if byte != b'\xff':
+			continue
+		marker = f.read(1)
+		while marker == b'\xff':
+			marker = f.read(1)
+		if not marker:
+			return None
+		marker = ord(marker)
+		if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+			continue  # markers without a segment
+		if marker in (0xd9, 0xda):
+			return None  # end of image or start of scan before any frame
+		length = struct.unpack('>H', f.read(2))[0]
+		if marker == 0xe1:
+			data = f.read(length - 2)
+			if data[:6] == b'Exif\0\0':
+				orientation, captured = _exif(io.BytesIO(data[6:]))
+		elif 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+			precision, height, width = struct.unpack('>BHH', f.read(5))
+			return ImageInfo(width, height, orientation, 'JPEG', captured)
+		else:
+			f.seek(length - 2, 1)
+
+
+def _probe_png(f):
+	f.seek(8)
+	length, chunk, width, height = struct.unpack('>I4sII', f.read(16))
+	if chunk != b'IHDR':
+		return None
+	return ImageInfo(width, height, 1, 'PNG', None)
+
+
+def _probe_gif(f):
+	f.seek(6)
+	width, height = struct.unpack('<HH', f.read(4))
+	return ImageInfo(width, height, 1, 'GIF', None)
+
+
+def _probe_tiff(f):
+	f.seek(0)
+	tags = _tiff_tags(f, (256, 257))
+	if 256 not in tags or 257 not in tags:
+		return None
+	f.seek(0)
+	orientation, captured = _exif(f)
+	return ImageInfo(tags[256], tags[257], orientation, 'TIFF', captured)
+
+
+def probe_file(filename):
+	"""return the ImageInfo of an image file from its header, or None if the
+	format is not recognised or the header is broken"""
+	try:
+		with open(filename, 'rb') as f:
+			magic = f.read(8)
+			if magic[:2] == b'\xff\xd8':
+				return _probe_jpeg(f)
+			if magic == b'\x89PNG\r\n\x1a\n':
+				return _probe_png(f)
+			if magic[:6] in (b'GIF87a', b'GIF89a'):
+				return _probe_gif(f)
+			if magic[:4] in (b'II*\0', b'MM\0*'):
+				return _probe_tiff(f)
+	except (IOError, OSError, struct.error):
+		pass
+	return None
+
+
+### Per folder cache ----------------------------------------------------------
+class ProbeCache(object):
+	"""Probe results grouped per folder and persisted between runs"""
+
+	def __init__(self, path=None, autosave=500):
+		"""initialization.
+		@param  path      directory the folder tables are kept in
+		@param  autosave  save a folder table after this many new probes"""
+		self.path = path or os.path.join(iv64_renditions.default_path(),
+		                                 'probe')
+		self.autosave = autosave
+		self._folders = {}  # folder -> {name: (mtime, size, info)}
+		self._dirty = {}    # folder -> number of unsaved probes
+		self._lock = threading.RLock()
+
+	def probe(self, filename):
+		"""return the ImageInfo of filename, from the cache when the file
+		has not changed since it was last probed"""
+		filename = os.path.abspath(filename)
+		folder, name = os.path.split(filename)
+		try:
+			st = os.stat(filename)
+		except OSError:
+			return None
+		with self._lock:
+			table = self._table(folder)
+			entry = table.get(name)
+			if entry is not None and entry[:2] == (st.st_mtime, st.st_size):
+				return entry[2]
+		info = probe_file(filename)
+		with self._lock:
+			table[name] = (st.st_mtime, st.st_size, info)
+			self._dirty[folder] = self._dirty.get(folder, 0) + 1
+			if self._dirty[folder] >= self.autosave:
+				self._save(folder)
+		return info
+
+	def save(self):
+		"""write every folder table with unsaved probes"""
+		with self._lock:
+			for folder in list(self._dirty):
+				self._save(folder)
+
+	def _table_path(self, folder):
+		key = folder
+		if not isinstance(key, bytes):
+			key = key.encode('utf-8', 'surrogateescape')
+		return os.path.join(self.path, hashlib.sha1(key).hexdigest())
+
+	def _table(self, folder):
+		table = self._folders.get(folder)
+		if table is None:
+			try:
+				with open(self._table_path(folder), 'rb') as f:
+					table = pickle.load(f)
+			except Exception:
+				table = {}  # missing, broken or saved by an older version
+			self._folders[folder] = table
+		return table
+
+	def _save(self, folder):
+		self._dirty.pop(folder, None)
+		try:
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+			fd, tmp = tempfile.mkstemp(dir=self.path)
+			with os.fdopen(fd, 'wb') as f:
+				pickle.dump(self._folders[folder], f, 2)
+			os.rename(tmp, self._table_path(folder))
+		except (IOError, OSError):
+			pass
+
+
+# cache shared by everything in the process
+shared = ProbeCache()
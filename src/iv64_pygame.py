@@ -9,6 +9,7 @@ Copyright (c) 2011 See-ming Lee. All rights reserved.
 __author__ = 'See-ming Lee'
 __email__ = 'seeminglee@gmail.com'
 
+from array import array
 import os
 import pygame
 from pygame.locals import *
@@ -17,6 +18,19 @@ import string
 import random
 import re
 import sys
+import threading
+try:
+	import numpy
+except ImportError:
+	numpy = None
+import iv64_cache
+import iv64_hud
+import iv64_probe
+import iv64_renditions
+import iv64_scan
+import iv64_sort
+import iv64_trace
+import iv64_watch
 
 
 class ImageViewerError(Exception): pass
@@ -24,42 +38,238 @@ class ImageLoadFileIOError(ImageViewerError): pass
 class FontUnavailableError(ImageViewerError): pass
 
 
-def loadImage(fullname=None):
-	"""Load image and return image object and its rect"""
+# Surfaces are made, converted to the display format and scaled on the
+# prefetch threads as well as on the main loop, and SDL is not thread safe
+# for those. They hold this lock, and so does the main loop while it
+# handles events and draws. Decoding (SDL_image, PIL) runs without it.
+sdl_lock = threading.RLock()
+
+
+@iv64_trace.traced('loadImage')
+def loadImage(fullname=None, size=None):
+	"""Load image and return image object and its rect. Decoded images are
+	kept in the shared image cache.
+	@param  size  optional size of the window the image will be fitted to.
+	              JPEGs are then decoded at the smallest DCT scale (1/2, 1/4,
+	              1/8) that is still at least as large as the fitted size"""
+	target = None
+	if size is not None and FileType.is_jpg.match(fullname):
+		target = ('draft', tuple(size))
+	image = iv64_cache.shared.fetch(fullname,
+	                                lambda: _decodeImage(fullname, size),
+	                                surfaceBytes, target=target)
+	return image, image.get_rect()
+
+
+def _decodeImage(fullname, size=None):
+	"""Decode image from disk"""
+	trace = iv64_trace.shared
 	try:
-		image = pygame.image.load(fullname)
-		if image.get_alpha is None:
-			image = image.convert()
-		else:
-			image = image.convert_alpha()
-	except pygame.error, message:
-		print 'Cannot load image:', fullname
+		with iv64_hud.shared.timing('decode', fullname):
+			with trace.span('decode', file=fullname):
+				if size is not None and FileType.is_jpg.match(fullname):
+					pilimage = ImageUtil.loadDraft(fullname, size)
+					with sdl_lock:
+						image = ImageUtil.fromPIL(pilimage)
+				else:
+					image = pygame.image.load(fullname)
+			with sdl_lock, trace.span('convert_alpha'):
+				if image.get_alpha is None:
+					image = image.convert()
+				else:
+					image = image.convert_alpha()
+		trace.count('decoded bytes', surfaceBytes(image))
+	except (pygame.error, IOError), message:
+		print >> sys.stderr, 'Cannot load image:', fullname
 		# raise SystemExit, message
 		raise ImageLoadFileIOError, message
-	return image, image.get_rect()
+	return image
+
+
+def probeRect(fullname):
+	"""Return the rect of an image file read from its header only, or None.
+	Lets renditions and reduced decodes be fitted with the exact aspect
+	ratio of the original"""
+	info = iv64_probe.shared.probe(fullname)
+	if info is None:
+		return None
+	return Rect((0, 0), info.size)
+
+
+def surfaceBytes(surface):
+	"""Return the number of bytes held by a surface (or a tuple starting
+	with one)"""
+	if isinstance(surface, tuple):
+		surface = surface[0]
+	return surface.get_pitch() * surface.get_height()
 
 
 class ImageUtil(object):
-	"""Utility functions for images: mainly for PIL"""
+	"""Utility functions for images: mainly for PIL.
+
+	Conversions share pixels where they can. A PIL image made by toPIL()
+	reads the pixels of the surface itself when they are laid out the way
+	PIL keeps them (R, G, B and a fourth byte), which is only the case for
+	surfaces fromPIL() made of RGBX and RGBA images: display format
+	surfaces, as loadImage() returns, are BGRX or BGRA and are copied once.
+	A surface made by fromPIL() reads the bytes PIL hands out. bytes_copied
+	counts the bytes copied by the conversions that could not share"""
+
+	bytes_copied = 0
+	_copied_lock = threading.Lock()
+
+	@staticmethod
+	def _copied(nbytes):
+		# conversions run on the prefetch threads too
+		with ImageUtil._copied_lock:
+			ImageUtil.bytes_copied += nbytes
+
+	@staticmethod
+	def rawMode(image):
+		"""return the PIL raw mode of the pixels of a 24 or 32 bit pygame
+		image, e.g. 'BGRX', or None for other depths"""
+		bytesize = image.get_bytesize()
+		if bytesize not in (3, 4):
+			return None
+		channels = ['X'] * bytesize
+		for channel, mask, shift in zip('RGBA', image.get_masks(),
+		                                image.get_shifts()):
+			if mask:
+				i = shift // 8
+				if sys.byteorder == 'big':
+					i = bytesize - 1 - i
+				channels[i] = channel
+		return ''.join(channels)
 
 	@staticmethod
 	def toPIL(image):
-		"""convert a pygame image to a PIL image"""
-		raw = pygame.image.tostring(image, "RGBX")
-		return Image.fromstring("RGBX",
-		                           image.get_size(),
-		                           raw)
+		"""convert a pygame image to a PIL image. Without a copy if the
+		image is RGBX or RGBA in memory, as fromPIL() makes of RGBX and RGBA
+		images; the image then stays locked as long as the PIL image is
+		around, so do not keep it"""
+		rawmode = ImageUtil.rawMode(image)
+		if rawmode is None or not hasattr(image, 'get_buffer'):
+			raw = pygame.image.tostring(image, "RGBA")
+			ImageUtil._copied(len(raw))
+			return Image.frombuffer("RGBA", image.get_size(), raw,
+			                        "raw", "RGBA", 0, 1)
+		if 'A' in rawmode:
+			mode = "RGBA"
+		elif len(rawmode) == 4:
+			mode = "RGBX"
+		else:
+			mode = "RGB"
+		if rawmode != mode or mode == "RGB":
+			# PIL only maps RGBX and RGBA, it unpacks anything else
+			ImageUtil._copied(surfaceBytes(image))
+		return Image.frombuffer(mode, image.get_size(), image.get_buffer(),
+		                        "raw", rawmode, image.get_pitch(), 1)
 
 	@staticmethod
 	def fromPIL(pilimage):
-		"""convert a PIL image to a pygame image"""
-		raw = pilimage.tostring()
-		return pygame.image.fromstring(raw, pilimage.size, "RGBX")
+		"""convert a PIL image to a pygame image. PIL does not share its
+		pixels, so they are copied once, into bytes the image then reads
+		from. Those bytes are immutable, so the image must only be read
+		from: convert() it before drawing on it"""
+		if pilimage.mode not in ("RGB", "RGBA", "RGBX"):
+			pilimage = pilimage.convert("RGB")
+		if hasattr(pilimage, 'tobytes'):
+			raw = pilimage.tobytes()
+		else:
+			raw = pilimage.tostring()
+		ImageUtil._copied(len(raw))
+		return pygame.image.frombuffer(raw, pilimage.size, pilimage.mode)
+
+	@staticmethod
+	def loadDraft(fullname, size):
+		"""open a JPEG with PIL at a reduced resolution. The decoder is asked
+		for the smallest DCT scaled draft (1/2, 1/4 or 1/8) that is still at
+		least as large as the image fitted to size; the final resample is
+		left to the caller"""
+		pilimage = Image.open(fullname)
+		fitted = ImageUtil.fitSize(pilimage.size, size)
+		pilimage.draft("RGB", fitted)
+		pilimage.load()
+		return pilimage
+
+	@staticmethod
+	def fitSize(insize, size):
+		"""return insize scaled to fit inside size keeping its aspect ratio"""
+		scale = min(float(size[0]) / insize[0], float(size[1]) / insize[1])
+		return (max(1, int(insize[0] * scale)), max(1, int(insize[1] * scale)))
 
 	@staticmethod
 	def resize(image, size, filter=Image.BICUBIC):
-		"""resize a pygame image"""
-		return fromPIL(toPIL(image).resize(size, filter))
+		"""resize a pygame image with PIL's resampling. The result is a
+		display format image of its own, which can be drawn on"""
+		resized = ImageUtil.toPIL(image).resize(size, filter)
+		shared = ImageUtil.fromPIL(resized)
+		ImageUtil._copied(surfaceBytes(shared))
+		if resized.mode == "RGBA":
+			return shared.convert_alpha()
+		return shared.convert()
+
+
+class Crossfade(object):
+	"""Time based crossfade between two surfaces of the same size.
+
+	Every frame is blended from the source and target as they were when the
+	fade started, so frames do not compound on each other, and the blend
+	factor comes from the clock: when frames are slow some are dropped but
+	the fade still takes `duration` milliseconds. With NumPy the blend is
+	done on precomputed int16 arrays through pygame.surfarray, otherwise it
+	is a single alpha blit of the target over the source."""
+
+	def __init__(self, source, target, duration=850):
+		"""initialization.
+		@param  source    surface shown when the fade starts
+		@param  target    surface shown when the fade ends
+		@param  duration  length of the fade in milliseconds"""
+		self.duration = duration
+		self.start = pygame.time.get_ticks()
+		self.source = source.copy()
+		self.frame = pygame.Surface(target.get_size()).convert()
+		self._src = None
+		self._diff = None
+		self._tmp = None
+		self.set_target(target)
+
+	def set_target(self, target):
+		"""change the surface faded to, keeping the timing"""
+		self.target = target
+		if numpy is not None:
+			self._src = pygame.surfarray.array3d(self.source).astype(numpy.int16)
+			self._diff = pygame.surfarray.array3d(target).astype(numpy.int16)
+			self._diff -= self._src
+			self._tmp = numpy.empty_like(self._src)
+
+	def progress(self, now=None):
+		"""return how far the fade is, from 0.0 to 1.0"""
+		if now is None:
+			now = pygame.time.get_ticks()
+		if self.duration <= 0:
+			return 1.0
+		return min(1.0, max(0.0, float(now - self.start) / self.duration))
+
+	def done(self, now=None):
+		return self.progress(now) >= 1.0
+
+	@iv64_trace.traced('crossfade')
+	def render(self, now=None):
+		"""return the frame for the current time"""
+		t = self.progress(now)
+		if numpy is not None:
+			# src + diff * t, with t in 1/128 steps so int16 does not overflow
+			numpy.multiply(self._diff, int(t * 128), out=self._tmp)
+			numpy.right_shift(self._tmp, 7, out=self._tmp)
+			self._tmp += self._src
+			pygame.surfarray.blit_array(self.frame, self._tmp)
+		else:
+			self.frame.blit(self.source, (0, 0))
+			self.target.set_alpha(int(t * 255))
+			self.frame.blit(self.target, (0, 0))
+			self.target.set_alpha(None)
+		return self.frame
 
 
 class ImageView(pygame.sprite.Sprite):
@@ -68,7 +278,8 @@ class ImageView(pygame.sprite.Sprite):
 	def __init__(self, filename=None):
 		"""initialize with the image filename"""
 		pygame.sprite.Sprite.__init__(self)
-		self.alpha = 0
+		self.fade = None
+		self.fade_duration = 850 # in milliseconds
 		self.bg_color = (0, 0, 0)
 		self.filename = None
 		self.original_image = None
@@ -77,57 +288,164 @@ class ImageView(pygame.sprite.Sprite):
 		self.rect = None
 		self.imagenow = None
 		self.imagetgt = None
+		self.fitted = None
+		self.decoded_for = None
+		self.preview = False
+		self.transition = False  # a fade to a new image is running
+		self.dirty = False       # self.image changed since the last draw
 		self.set_filename(filename)
 
-	def set_filename(self, filename):
+	def set_filename(self, filename, prefetched=None):
+		"""show a new file. prefetched is an optional (image, rect, fitted)
+		tuple from the Prefetcher so the file does not need to be decoded here.
+		Without it, a cached rendition is shown if there is one and the full
+		quality image has to be handed in later with upgrade()"""
 		if filename is not None and os.path.exists(filename):
-			if self.alpha < 255 and self.image is not None:
-				self.image = self.imagetgt
-				self.image.set_alpha(255)
-				self.alpha = 255
+			# a fade still running starts over from the frame on screen
+			self.fade = None
+			self.transition = True
 			self.filename = filename
-			self.original_image, self.original_rect = loadImage(filename)
+			self.preview = False
+			winsize = self.get_window_rect().size
+			rendition = None
+			if prefetched is None:
+				rendition = iv64_renditions.shared.lookup(filename, winsize)
+			if prefetched is not None:
+				self.use(prefetched)
+			elif rendition is not None:
+				self.original_image, self.original_rect = loadImage(rendition)
+				self.decoded_for = None
+				self.fitted = None
+				self.preview = True
+			else:
+				self.load(winsize)
 			self.update()
 
+	def clear(self):
+		"""show the background only, e.g. once every file is gone"""
+		self.filename = None
+		self.fade = None
+		self.transition = False
+		self.preview = False
+		self.image = pygame.Surface(self.get_window_rect().size).convert()
+		self.image.fill(self.bg_color)
+		self.rect = self.image.get_rect()
+		self.dirty = True
+
+	def use(self, prefetched):
+		"""take over a prefetched (image, rect, fitted) tuple"""
+		self.original_image, self.original_rect, self.fitted = prefetched
+		self.decoded_for = self.fitted and self.fitted[2]
+
+	def upgrade(self, prefetched):
+		"""replace the rendition being shown with the full quality image"""
+		self.use(prefetched)
+		self.preview = False
+		if self.transition and self.fade is None:
+			return  # the fade has not started: it will pick up the new image
+		winrect = self.get_window_rect()
+		image, self.rect = self.fitted_image(winrect)
+		self.imagetgt = self.padded_image(image, winrect.size, self.bg_color)
+		if self.transition:
+			# a fade is running: continue it towards the full quality image
+			if self.fade.target.get_size() == self.imagetgt.get_size():
+				self.fade.set_target(self.imagetgt)
+		else:
+			self.image = self.imagetgt
+			self.dirty = True
+
+	def load(self, size):
+		"""decode the current file at a resolution good enough for size"""
+		self.original_image, self.original_rect = loadImage(self.filename, size)
+		self.decoded_for = tuple(size)
+		self.fitted = None
+
 	def update(self):
-		"""Update drawing"""
-		if self.filename is not None:
-			self.rect = winrect = self.get_window_rect()
-
-			if self.alpha == 0:
-				image, self.rect = self.fit_to_window(self.original_image,
-											self.original_rect,
-											winrect)
+		"""Update drawing. Does nothing unless a fade is running or the
+		window size changed; sets dirty when the image changed"""
+		if self.filename is None:
+			return
+		winrect = self.get_window_rect()
+
+		if not self.transition:
+			if self.image is not None and self.image.get_size() != winrect.size:
+				# window resized: refit without fading
+				image, self.rect = self.fitted_image(winrect)
 				self.imagetgt = self.padded_image(image, winrect.size, self.bg_color)
-				if self.image is None:
-					self.image = pygame.Surface(winrect.size)
-				self.alpha += 5
-			elif self.alpha < 255:
-				self.imagetgt.set_alpha(self.alpha)
-				self.image.blit(self.imagetgt, (0,0))
-				self.alpha += 5
-				if self.alpha >= 255:
-					self.alpha = 255
-			else:
-				self.imagetgt.set_alpha(255)
 				self.image = self.imagetgt
-				self.alpha = 0
-
+				self.dirty = True
+			return
+
+		self.rect = winrect
+		if self.fade is None:
+			image, self.rect = self.fitted_image(winrect)
+			self.imagetgt = self.padded_image(image, winrect.size, self.bg_color)
+			source = self.image
+			if source is None or source.get_size() != winrect.size:
+				source = pygame.Surface(winrect.size).convert()
+				source.fill(self.bg_color)
+			self.fade = Crossfade(source, self.imagetgt, self.fade_duration)
+			self.image = self.fade.render()
+		elif not self.fade.done():
+			self.image = self.fade.render()
+		else:
+			self.image = self.imagetgt
+			self.fade = None
+			self.transition = False
+		self.dirty = True
+
+	@property
+	def animating(self):
+		return self.transition
+
+	def fitted_image(self, winrect):
+		"""return the image fitted to winrect, reusing the last fit when the
+		window size has not changed"""
+		if self.fitted is None or self.fitted[2] != winrect.size:
+			if (self.decoded_for is not None and
+			    (winrect.width > self.decoded_for[0] or
+			     winrect.height > self.decoded_for[1])):
+				# the window grew past what a reduced decode can fill
+				self.load(winrect.size)
+			image, rect = self.cached_fit(self.filename, self.original_image,
+			                              probeRect(self.filename) or
+			                              self.original_rect, winrect,
+			                              preview=self.preview)
+			self.fitted = (image, rect, winrect.size)
+		return self.fitted[0], self.fitted[1]
+
+	@classmethod
+	def cached_fit(cls, filename, inimage, inrect, winrect, preview=False):
+		"""fit_to_window through the shared image cache. preview tells that
+		inimage is a rendition of filename: its fit is kept apart, so that
+		it is never handed out for the full quality one"""
+		def fit():
+			with iv64_hud.shared.timing('scale', filename):
+				return cls.fit_to_window(inimage, inrect, winrect)
+		target = tuple(winrect.size)
+		if preview:
+			target = ('rendition', target)
+		return iv64_cache.shared.fetch(filename, fit, surfaceBytes,
+		                               target=target)
 
 	@staticmethod
 	def get_window_rect():
 		return pygame.display.get_surface().get_rect()
 
 	@staticmethod
+	@iv64_trace.traced('fit_to_window')
 	def fit_to_window(inimage, inrect, winrect):
 		"""return scaled image and scaled rect which fits the window"""
 		scaled = inrect.fit(winrect)
-		image = pygame.transform.smoothscale(inimage, scaled.size)
-		image = image.convert()
+		with sdl_lock:
+			with iv64_trace.shared.span('smoothscale'):
+				image = pygame.transform.smoothscale(inimage, scaled.size)
+			image = image.convert()
 		rect = Rect((0,0), scaled.size)
 		return image, rect
 
 	@staticmethod
+	@iv64_trace.traced('padded_image')
 	def padded_image(image, size, bgcolor):
 		"""return image padded with background color to fill the entire window"""
 		surf = pygame.Surface(size).convert()
@@ -150,11 +468,21 @@ class FileInfo(pygame.sprite.Sprite):
 		self.image = None
 		self.rect = None
 		self.visible = True
+		self.rendered = None    # what the current image shows
+		self.dirty_rects = []   # screen areas changed since the last draw
 		# set meta calls update directly. So put this last
 		self.set_meta(filename, index, total)
 
 	def update(self):
-		"""display current meta"""
+		"""display current meta. The text is only rendered again when the
+		meta info, the visibility or the screen size changed"""
+		screen_size = pygame.display.get_surface().get_size()
+		state = (self.info(), self.visible, screen_size)
+		if state == self.rendered:
+			return
+		self.rendered = state
+		if self.rect is not None:
+			self.dirty_rects.append(self.rect)
 		if self.visible:
 			info = self.info()
 			text = self.font.render(info, 1, self.bg_color, self.fg_color)
@@ -166,6 +494,7 @@ class FileInfo(pygame.sprite.Sprite):
 			self.screen = pygame.display.get_surface()
 			self.rect = pygame.Rect((0, 0), self.image.get_size())
 			self.rect.bottomleft = (0, self.screen.get_height()+1)
+			self.dirty_rects.append(self.rect)
 		else:
 			self.image.set_alpha(0)
 
@@ -197,12 +526,77 @@ class FileInfo(pygame.sprite.Sprite):
 	def info(self):
 		"""Return completed info in this format:
 		[n/total]: filename """
+		return FileInfo.format(self.filename, self.index, self.total)
+
+	@staticmethod
+	def format(filename, index=None, total=None):
+		"""Return the info of a file, index being 0-based:
+		[n/total]: filename """
 		text = ''
-		if self.index is not None and self.total is not None:
-			text += '[%d/%d]: ' % (self.index+1, self.total) #display info is 1-based
-		text += self.filename
+		if index is not None and total is not None:
+			text += '[%d/%d]: ' % (index+1, total) #display info is 1-based
+		text += filename
 		return text
 
+
+class PerfHUD(pygame.sprite.Sprite):
+	"""Performance overlay in the top left corner: frame times, latencies
+	of the current file, cache and prefetch state. Hidden at first; the
+	text is made again at most every iv64_hud.REFRESH seconds"""
+
+	def __init__(self, queue, prefetcher):
+		"""initialization.
+		@param  queue       the Queue, for the file shown
+		@param  prefetcher  the Prefetcher, for its queue depth"""
+		pygame.sprite.Sprite.__init__(self)
+		self.queue = queue
+		self.prefetcher = prefetcher
+		self.stats = iv64_hud.shared
+		self.font = pygame.font.Font(pygame.font.match_font('Helvetica'), 12)
+		self.fg_color = (50, 50, 50)
+		self.bg_color = (250, 250, 250)
+		self.image = pygame.Surface((1, 1))
+		self.image.set_alpha(0)
+		self.rect = pygame.Rect(0, 0, 1, 1)
+		self.visible = False
+		self.rendered = None    # lines the current image shows
+		self.dirty_rects = []   # screen areas changed since the last draw
+
+	def update(self):
+		"""render the overlay when it is due and the text changed"""
+		if not self.visible:
+			if self.rendered is not None:
+				self.rendered = None
+				self.image.set_alpha(0)
+				self.dirty_rects.append(self.rect)
+			return
+		if not self.stats.due():
+			return
+		current = None
+		if self.queue.total_files():
+			current = self.queue.current_file()
+		lines = self.stats.lines(current,
+		                         queues=[('prefetch', self.prefetcher.depth())])
+		if lines == self.rendered:
+			return
+		self.rendered = lines
+		texts = [self.font.render(line, 1, self.bg_color, self.fg_color)
+		         for line in lines]
+		height = self.font.get_linesize()
+		self.dirty_rects.append(self.rect)
+		self.image = pygame.Surface((max(t.get_width() for t in texts) + 10,
+		                             height * len(texts) + 6))
+		self.image.fill(self.fg_color)
+		for i, text in enumerate(texts):
+			self.image.blit(text, (5, 3 + i * height))
+		self.rect = pygame.Rect((0, 0), self.image.get_size())
+		self.dirty_rects.append(self.rect)
+
+	def toggle_visibility(self):
+		"""show / hide the overlay"""
+		self.visible = not self.visible
+		self.stats.invalidate()
+
 class FileType(object):
 	"""small class used to store regular expression patterns to be used
 	in conjunction with the Foleer class"""
@@ -212,6 +606,11 @@ class FileType(object):
 	GIF = 1
 	PNG = 2
 	TIF = 3
+	OTHER = 4   # not an image
+	SYSTEM = 5  # system hidden file
+
+	images = (JPG, GIF, PNG, TIF)
+	extensions = {'jpg': JPG, 'jpeg': JPG, 'gif': GIF, 'png': PNG, 'tif': TIF}
 
 	# re patterns
 	isnot_sys = re.compile(r'^[^\.].+') # not system hidden files.
@@ -221,61 +620,183 @@ class FileType(object):
 	is_png = re.compile(r'.+\.(png)$', re.IGNORECASE)
 	is_tif = re.compile(r'.+\.(tif)$', re.IGNORECASE)
 
+	@classmethod
+	def classify(cls, name):
+		"""return the type constant of a file name, agreeing with the
+		patterns above but without running one of them per type"""
+		base = os.path.basename(name)
+		if len(base) < 2 or base[0] == '.':
+			return cls.SYSTEM
+		ext = os.path.splitext(base)[1]
+		return cls.extensions.get(ext[1:].lower(), cls.OTHER)
+
 class Folder(object):
 	"""Keep track of the image folder we are tracking"""
 
-	def __init__(self, path=''):
+	def __init__(self, path='', stream=False, recursive=False):
 		"""Initialization"""
-		self.set_path(path)
+		self.set_path(path, stream, recursive)
+
+	def set_path(self, path='', stream=False, recursive=False):
+		"""set the folder. Unless stream is True the folder is read right
+		away; otherwise the lists fill up as scan() is consumed. In recursive
+		mode subfolders are read too and allfiles is a PathIndex of paths
+		relative to the folder.
 
-	def set_path(self, path=''):
+		Each entry gets its FileType constant in types, and index holds the
+		positions in allfiles of the entries of each image type, so the
+		lists returned by images(), jpgs() and the like are only views"""
 		if os.path.isfile(path):
 			path = os.path.dirname(path) # make sure it's a folder
 		self.path = os.path.abspath(path) # get the absolute path
-		self.allfiles = [f for f in os.listdir(self.path) if FileType.isnot_sys.match(f)]
-		self.imagefiles = [f for f in self.allfiles if FileType.is_image.match(f)]
-
+		self.recursive = recursive
+		if recursive:
+			self.allfiles = iv64_scan.PathIndex()
+		else:
+			self.allfiles = []
+		self.types = array('B')
+		self.index = dict((code, array('I')) for code in FileType.images)
+		self.image_index = array('I')
+		if not stream:
+			for f in self.scan():
+				pass
+
+	def scan(self):
+		"""Read the folder, filling allfiles, types and the indexes as
+		entries are found, and yield the absolute path of each image"""
+		if self.recursive:
+			names = iv64_scan.walk_names(self.path)
+		else:
+			names = iv64_scan.iter_names(self.path)
+		classify = FileType.classify
+		for f in names:
+			code = classify(f)
+			if code == FileType.SYSTEM:
+				continue
+			i = len(self.allfiles)
+			self.allfiles.append(f)
+			self.types.append(code)
+			if code != FileType.OTHER:
+				self.index[code].append(i)
+				self.image_index.append(i)
+				yield os.path.join(self.path, f)
+
+	def path_of(self, i):
+		"""Return the absolute path of entry i of allfiles"""
+		return os.path.join(self.path, self.allfiles[i])
 
 	def files(self):
 		"""Return the list of files contained in the folder"""
-		return self._abspath(self.allfiles)
+		return FileView(self)
 
 	def images(self):
 		"""Return all image files contained in folder"""
-		return self._abspath(self.imagefiles)
+		return FileView(self, self.image_index)
 
 	def jpgs(self):
 		"""Return list of jpegs"""
-		return self._abspath([f for f in self.allfiles if FileType.is_jpg.search(f)])
+		return FileView(self, self.index[FileType.JPG])
 
 	def gifs(self):
 		"""Return list of gifs only"""
-		return self._abspath([f for f in self.allfiles if FileType.is_gif.search(f)])
+		return FileView(self, self.index[FileType.GIF])
 
 	def pngs(self):
 		"""Return list of pngs only"""
-		return self._abspath([f for f in self.allfiles if FileType.is_png.search(f)])
+		return FileView(self, self.index[FileType.PNG])
+
+	def tifs(self):
+		"""Return list of tiffs only"""
+		return FileView(self, self.index[FileType.TIF])
+
+
+class FileView(object):
+	"""Read only list of absolute paths of Folder entries. Nothing is
+	copied: index holds positions in folder.allfiles (None for all of
+	them), paths are joined when an item is read, and slicing gives
+	another view of the same index. A view of the whole index keeps up
+	with a folder that is still being scanned"""
+
+	def __init__(self, folder, index=None, window=None):
+		"""initialization.
+		@param  folder  the Folder
+		@param  index   array of positions in folder.allfiles, or None
+		@param  window  (start, stop, step) into the index, None for all"""
+		self.folder = folder
+		self.index = index
+		self.window = window
+
+	def _range(self):
+		if self.window is None:
+			if self.index is None:
+				return xrange(len(self.folder.allfiles))
+			return xrange(len(self.index))
+		return xrange(*self.window)
+
+	def __len__(self):
+		return len(self._range())
+
+	def __getitem__(self, i):
+		positions = self._range()
+		if isinstance(i, slice):
+			start, stop, step = i.indices(len(positions))
+			n = len(xrange(start, stop, step))
+			if self.window is None:
+				first, step0 = 0, 1
+			else:
+				first, step0 = self.window[0], self.window[2]
+			first += start * step0
+			step *= step0
+			return FileView(self.folder, self.index,
+			                (first, first + n * step, step))
+		i = positions[i]
+		if self.index is not None:
+			i = self.index[i]
+		return self.folder.path_of(i)
 
-	def _abspath(self, files=None):
-		"""Return a list of files with absolute paths"""
-		if files is None:
-			files = self.allfiles
-		return [os.path.join(self.path, f) for f in files]
+	def __iter__(self):
+		for i in xrange(len(self)):
+			yield self[i]
 
 
 class Queue(object):
 	"""File queue for slide show"""
-	def __init__(self, files=None):
+	def __init__(self, files=None, compact=False):
 		"""initialization.
-		@param  files   list of files to be put into queue"""
+		@param  files   list of files to be put into queue
+		@param  compact keep the files in a PathIndex instead of a list"""
 		self.current_index = 0
-		self.files = []
+		if compact:
+			self.files = iv64_scan.PathIndex()
+		else:
+			self.files = []
+		self.positions = iv64_watch.Positions(self.files)
 		self.addfiles(files)
 
 	def addfiles(self, files=None):
 		if files is not None:
 			self.files.extend(files)
 
+	def apply_order(self, result):
+		"""put the files in the order of an iv64_sort.SortKeys.poll()
+		result, keeping current_index on the same file. Returns False,
+		leaving the files alone, if some were removed since the sort was
+		started"""
+		index = iv64_sort.reorder(self.files, result, self.current_index)
+		if index is None:
+			return False
+		self.positions.reordered(len(result[1]))
+		self.current_index = index
+		return True
+
+	def apply_changes(self, changes, path):
+		"""apply iv64_watch events for the folder at path, skipping files
+		that are not images"""
+		def wanted(name):
+			return FileType.classify(name) in FileType.images
+		self.current_index = self.positions.apply(
+			changes, self.current_index, wanted, path)
+
 	def next(self):
 		"""Iterate to next file without returning the file"""
 		self.current_index += 1
@@ -298,7 +819,135 @@ class Queue(object):
 		return len(self.files)
 
 
+class Prefetcher(object):
+	"""Decode and fit the files around the current position of a Queue on a
+	small pool of worker threads, so that moving to the next or previous
+	slide only has to swap in a surface that is already loaded.
+
+	The window follows the navigation direction: `ahead` entries in the
+	direction of travel and `behind` entries the other way. Entries that fall
+	out of the window are dropped from the pending list; a decode already
+	running for them is allowed to finish and its result is thrown away."""
+
+	def __init__(self, queue, ahead=3, behind=1, workers=2):
+		"""initialization.
+		@param  queue    the Queue to follow
+		@param  ahead    number of entries to prepare in the direction of travel
+		@param  behind   number of entries to keep in the opposite direction
+		@param  workers  number of decoding threads"""
+		self.queue = queue
+		self.ahead = ahead
+		self.behind = behind
+		self.direction = 1
+		self.winsize = None
+		self._index = 0
+		self._window = []
+		self._pending = []   # indices waiting for a worker, most wanted first
+		self._working = set()  # indices being decoded
+		self._ready = {}     # index -> (filename, prefetched tuple)
+		self._cond = threading.Condition()
+		self._running = True
+		self._threads = []
+		for i in range(workers):
+			thread = threading.Thread(target=self._work,
+			                          name='prefetch-%d' % i)
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def update(self, index, winsize=None, direction=None):
+		"""move the window to index, optionally with a new window size and
+		navigation direction (1 forward, -1 backward)"""
+		with self._cond:
+			if direction is not None:
+				self.direction = direction
+			if winsize is not None and winsize != self.winsize:
+				self.winsize = winsize
+				self._ready.clear()
+			self._index = index
+			self._window = self._wanted(index)
+			for i in list(self._ready):
+				if i not in self._window:
+					del self._ready[i]
+			self._pending = [i for i in self._window
+			                 if i not in self._ready and i not in self._working]
+			self._cond.notify_all()
+
+	def get(self, index):
+		"""return the prefetched (image, rect, fitted) tuple for the entry at
+		index, or None if it is not ready yet"""
+		with self._cond:
+			item = self._ready.get(index)
+		if item is None or item[0] != self.queue.files[index]:
+			return None
+		return item[1]
+
+	def depth(self):
+		"""return the number of entries waiting for or being decoded"""
+		with self._cond:
+			return len(self._pending) + len(self._working)
+
+	def stop(self):
+		"""stop the worker threads"""
+		with self._cond:
+			self._running = False
+			self._pending = []
+			self._cond.notify_all()
+
+	def _wanted(self, index):
+		"""indices in the window around index, most wanted first"""
+		total = self.queue.total_files()
+		if total == 0:
+			return []
+		wanted = [index % total]
+		for step in range(1, self.ahead + 1):
+			wanted.append((index + step * self.direction) % total)
+		for step in range(1, self.behind + 1):
+			wanted.append((index - step * self.direction) % total)
+		window = []
+		for i in wanted:
+			if i not in window:
+				window.append(i)
+		return window
+
+	def _work(self):
+		"""worker loop: decode and fit pending entries"""
+		while True:
+			with self._cond:
+				while self._running and not self._pending:
+					self._cond.wait()
+				if not self._running:
+					return
+				index = self._pending.pop(0)
+				if index >= self.queue.total_files():
+					continue  # files were removed since update()
+				winsize = self.winsize
+				self._working.add(index)
+			try:
+				# the queue may still shrink under us: a file that is gone
+				# is skipped like one that cannot be read
+				filename = self.queue.files[index]
+				image, rect = loadImage(filename, winsize)
+				fitted = None
+				if winsize is not None:
+					fitimage, fitrect = ImageView.cached_fit(
+						filename, image, probeRect(filename) or rect,
+						Rect((0, 0), winsize))
+					fitted = (fitimage, fitrect, winsize)
+					iv64_renditions.shared.schedule(filename, winsize)
+				item = (filename, (image, rect, fitted))
+			except (ImageViewerError, IndexError):
+				item = None
+			with self._cond:
+				self._working.discard(index)
+				if (item is not None and index in self._window and
+				    winsize == self.winsize):
+					self._ready[index] = item
+
+
 def main(argv=None):
+	recursive = '-r' in argv or '--recursive' in argv
+	argv = [a for a in argv if a not in ('-r', '--recursive')]
 	folder=argv[1]
 	# Initialise screen
 	pygame.init()
@@ -314,9 +963,25 @@ def main(argv=None):
 	clock = pygame.time.Clock()
 
 
-	# Initialise game objects
-	folder = Folder(folder)
-	queue = Queue(folder.images())
+	# Initialise game objects: the folder is read in the background and the
+	# first image is shown as soon as it is found
+	folder = Folder(folder, stream=True, recursive=recursive)
+	queue = Queue(compact=recursive)
+	scanner = iv64_scan.Scanner(folder.scan(), queue.addfiles)
+
+	# Pick up files added to the folder while the slideshow runs. The
+	# watcher starts before the scan, so nothing is missed, and its events
+	# are applied once the scan is over: files the scan found as well are
+	# in the queue by then and are not added twice
+	watcher = iv64_watch.FolderWatcher(folder.path, recursive=recursive)
+	watcher.start()
+	scanner.start()
+	scanner.wait_first()
+
+	# Play order: sort keys are computed and the queue sorted in the
+	# background, see iv64_sort
+	sortkeys = iv64_sort.SortKeys(folder.path)
+	order = None
 
 	fileinfo = FileInfo( filename=queue.current_file(),
 	                     index=queue.current_index,
@@ -326,6 +991,10 @@ def main(argv=None):
 	imageview = ImageView(filename=queue.current_file())
 	imageview.update()
 
+	# Decode the neighbouring slides in the background
+	prefetcher = Prefetcher(queue)
+	prefetcher.update(queue.current_index, winsize=screen.get_size())
+
 	# Fill background
 	backsprite = pygame.sprite.Sprite()
 	rect = Rect((0,0),(1400,900))
@@ -335,12 +1004,17 @@ def main(argv=None):
 	backsprite.image = background
 	backsprite.rect = rect
 
-	allsprites = pygame.sprite.LayeredUpdates((backsprite, imageview, fileinfo))
+	# Performance overlay, toggled with h
+	hud = PerfHUD(queue, prefetcher)
+
+	allsprites = pygame.sprite.LayeredUpdates((backsprite, imageview, fileinfo,
+	                                           hud))
 
 	# Blit everything to screen
-	screen.blit(background, (0, 0))
-	allsprites.draw(screen)
-	pygame.display.flip()
+	with sdl_lock:
+		screen.blit(background, (0, 0))
+		allsprites.draw(screen)
+		pygame.display.flip()
 
 
 	# Fullscreen control
@@ -353,17 +1027,27 @@ def main(argv=None):
 		else:
 			screen = pygame.display.set_mode(size, pygame.RESIZABLE)
 
-	# reset screen
-	def update_screen(screen):
-		"""Reset display when screen is updated"""
-		pygame.display.set_caption('Image Viewer')
-
+	# update screen: only the areas that changed are sent to the display
+	def update_screen(screen, full=False):
+		"""Redraw when something changed. full repaints the whole window"""
 		allsprites.update()
-		allsprites.draw(screen)
-		pygame.display.flip()
-
-	# update screen
-	update_screen(screen)
+		screen = pygame.display.get_surface()
+		rects = fileinfo.dirty_rects + hud.dirty_rects
+		fileinfo.dirty_rects = []
+		hud.dirty_rects = []
+		slide = imageview.dirty or full
+		if slide:
+			rects = [screen.get_rect()]
+			imageview.dirty = False
+		if rects:
+			allsprites.draw(screen)
+			with iv64_trace.shared.span('present'):
+				pygame.display.update(rects)
+			if slide:
+				iv64_hud.shared.frame(imageview.animating)
+
+	with sdl_lock:
+		update_screen(screen, full=True)
 
 
 	# Event: auto-advance (aka slideshow)
@@ -375,6 +1059,11 @@ def main(argv=None):
 	slideshow_toggleinfo_evt = pygame.event.Event(SLIDESHOW_TOGGLEINFO)
 	slideshow_started = False
 
+	# Event: wake up now and then to pick up background work (folder scan
+	# and watcher, prefetched images) while waiting for input
+	SLIDESHOW_POLL           = pygame.USEREVENT + 5
+	pygame.time.set_timer(SLIDESHOW_POLL, 250)
+
 	# constants
 	NUM_KEYS = [K_1, K_2, K_3, K_4, K_5, K_6, K_7, K_8, K_9, K_0]
 
@@ -383,92 +1072,172 @@ def main(argv=None):
 
 	slideshow_delay_time = 2000
 
-	# Event loop
+	# Event loop: frames are only paced by the clock while a transition is
+	# running; otherwise the loop sleeps until the next event
 	while 1:
-		# Make sure game doesn't run at more than 60 fps
-		clock.tick(60)
-
-		for event in pygame.event.get():
-
-			# game quit
-			if event.type == QUIT:
-				return
-
-			# WINDOW: resize
-			elif event.type == VIDEORESIZE:
-				screen_size = event.size
-				create_screen(screen_size, is_fullscreen=False)
-
-			# SLIDESHOW: next file
-			elif event.type == SLIDESHOW_NEXTIMAGE:
-				queue.next()
-				fileinfo.set_meta( filename=queue.current_file(),
-								   index=queue.current_index,
-								   total=queue.total_files() )
-				imageview.set_filename( filename=queue.current_file() )
-
-			# SLIDESHOW: previous file
-			elif event.type == SLIDESHOW_PREVIMAGE:
-				queue.prev()
-				fileinfo.set_meta( filename=queue.current_file(),
-								   index=queue.current_index,
-								   total=queue.total_files() )
-				imageview.set_filename( filename=queue.current_file() )
-
-			# SLIDESHOW: toggle info
-			elif event.type == SLIDESHOW_TOGGLEINFO:
-				fileinfo.toggle_visibility()
-				fileinfo.update()
-
-			# keyboard inputs
-			elif event.type == KEYUP:
-
-				# APP: exit
-				if event.key == K_q:
+		if imageview.animating:
+			# Make sure game doesn't run at more than 60 fps
+			clock.tick(60)
+			events = pygame.event.get()
+		else:
+			events = [pygame.event.wait()] + pygame.event.get()
+			clock.tick()
+
+		# the prefetch threads wait while events are handled and the
+		# screen drawn, see sdl_lock
+		with sdl_lock:
+			full_redraw = False
+			for event in events:
+
+				# game quit
+				if event.type == QUIT:
+					prefetcher.stop()
+					watcher.stop()
+					iv64_probe.shared.save()
 					return
 
-				# WINDOW: full screen toggle
-				elif event.key == K_f:
-					is_fullscreen = not is_fullscreen
-					old_screen_size = pygame.display.get_surface().get_size()
-					create_screen(is_fullscreen=is_fullscreen)
-
-				# SLIDESHOW: forward
-				elif event.key == K_RIGHT:
-					pygame.event.post(slideshow_nextimage_evt)
-
-				# SLIDESHOW: backward
-				elif event.key == K_LEFT:
-					pygame.event.post(slideshow_previmage_evt)
-
-				# SLIDESHOW: Start / Stop
-				elif event.key == K_SPACE or event.key == K_s:
-					slideshow_started = not slideshow_started
-					if slideshow_started:
-						pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, slideshow_delay_time)
-					else:
-						pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, 0)
+				# WINDOW: resize
+				elif event.type == VIDEORESIZE:
+					screen_size = event.size
+					create_screen(screen_size, is_fullscreen=False)
+					prefetcher.update(queue.current_index, winsize=screen_size)
+					full_redraw = True
+
+				# WINDOW: uncovered
+				elif event.type == VIDEOEXPOSE:
+					full_redraw = True
+
+				# SLIDESHOW: next file
+				elif event.type == SLIDESHOW_NEXTIMAGE and queue.total_files():
+					queue.next()
+					fileinfo.set_meta( filename=queue.current_file(),
+									   index=queue.current_index,
+									   total=queue.total_files() )
+					imageview.set_filename( filename=queue.current_file(),
+					                        prefetched=prefetcher.get(queue.current_index) )
+					prefetcher.update(queue.current_index, direction=1)
+
+				# SLIDESHOW: previous file
+				elif event.type == SLIDESHOW_PREVIMAGE and queue.total_files():
+					queue.prev()
+					fileinfo.set_meta( filename=queue.current_file(),
+									   index=queue.current_index,
+									   total=queue.total_files() )
+					imageview.set_filename( filename=queue.current_file(),
+					                        prefetched=prefetcher.get(queue.current_index) )
+					prefetcher.update(queue.current_index, direction=-1)
 
 				# SLIDESHOW: toggle info
-				elif event.key == K_i:
-					pygame.event.post(slideshow_toggleinfo_evt)
-
-
-				# SLIDESHOW: speed control: 1000-10000ms
-				elif event.key in NUM_KEYS:
-					pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, 0)
-					slideshow_delay_time = NUM_TIME[event.key]
-					pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, slideshow_delay_time)
-					slideshow_started = True
-
-				# SLIDESHOW: speed control: 500ms
-				elif event.key == K_BACKQUOTE:
-					pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, 0)
-					slideshow_delay_time = 500
-					pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, slideshow_delay_time)
-					slideshow_started = True
+				elif event.type == SLIDESHOW_TOGGLEINFO:
+					fileinfo.toggle_visibility()
+					fileinfo.update()
+
+				# keyboard inputs
+				elif event.type == KEYUP:
+
+					# APP: exit
+					if event.key == K_q:
+						prefetcher.stop()
+						watcher.stop()
+						iv64_probe.shared.save()
+						return
+
+					# WINDOW: full screen toggle
+					elif event.key == K_f:
+						is_fullscreen = not is_fullscreen
+						old_screen_size = pygame.display.get_surface().get_size()
+						create_screen(is_fullscreen=is_fullscreen)
+						prefetcher.update(queue.current_index,
+						                  winsize=pygame.display.get_surface().get_size())
+						full_redraw = True
+
+					# SLIDESHOW: forward
+					elif event.key == K_RIGHT:
+						pygame.event.post(slideshow_nextimage_evt)
+
+					# SLIDESHOW: backward
+					elif event.key == K_LEFT:
+						pygame.event.post(slideshow_previmage_evt)
+
+					# SLIDESHOW: Start / Stop
+					elif event.key == K_SPACE or event.key == K_s:
+						slideshow_started = not slideshow_started
+						if slideshow_started:
+							pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, slideshow_delay_time)
+						else:
+							pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, 0)
+
+					# SLIDESHOW: toggle info
+					elif event.key == K_i:
+						pygame.event.post(slideshow_toggleinfo_evt)
+
+					# SLIDESHOW: performance overlay
+					elif event.key == K_h:
+						hud.toggle_visibility()
+
+					# SLIDESHOW: next play order
+					elif event.key == K_o:
+						order = iv64_sort.next_order(order)
+						sortkeys.sort(queue.files, order)
+
+
+					# SLIDESHOW: speed control: 1000-10000ms
+					elif event.key in NUM_KEYS:
+						pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, 0)
+						slideshow_delay_time = NUM_TIME[event.key]
+						pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, slideshow_delay_time)
+						slideshow_started = True
 
-		update_screen(screen)
+					# SLIDESHOW: speed control: 500ms
+					elif event.key == K_BACKQUOTE:
+						pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, 0)
+						slideshow_delay_time = 500
+						pygame.time.set_timer(SLIDESHOW_NEXTIMAGE, slideshow_delay_time)
+						slideshow_started = True
+
+			# apply files added, removed or renamed in the folder
+			changes = scanner.done and watcher.poll()
+			if changes:
+				current = None
+				if queue.total_files():
+					current = queue.current_file()
+				queue.apply_changes(changes, folder.path)
+				if queue.total_files() and queue.current_file() != current:
+					fileinfo.set_meta( filename=queue.current_file(),
+					                   index=queue.current_index,
+					                   total=queue.total_files() )
+					imageview.set_filename( filename=queue.current_file() )
+				prefetcher.update(queue.current_index)
+
+			# put the queue in order once it is sorted
+			sorted_files = sortkeys.poll()
+			if sorted_files is not None:
+				if not queue.apply_order(sorted_files):
+					sortkeys.sort(queue.files, order) # files were removed
+				elif queue.total_files():
+					fileinfo.set_meta( filename=queue.current_file(),
+					                   index=queue.current_index,
+					                   total=queue.total_files() )
+					prefetcher.update(queue.current_index)
+
+			# keep the total up to date while the folder is being read
+			if fileinfo.total != queue.total_files():
+				if queue.total_files():
+					fileinfo.set_meta( filename=queue.current_file(),
+					                   index=queue.current_index,
+					                   total=queue.total_files() )
+				else:
+					# every file is gone: show the empty folder as [0/0]
+					fileinfo.set_meta( filename=folder.path, index=-1, total=0 )
+					imageview.clear()
+
+			# swap a rendition for the full quality image once it is decoded
+			if imageview.preview:
+				prefetched = prefetcher.get(queue.current_index)
+				if prefetched is not None:
+					imageview.upgrade(prefetched)
+
+			update_screen(screen, full=full_redraw)
 
 
 if __name__ == '__main__':
@@ -14,16 +14,27 @@ from _ctypes import POINTER
 from ctypes import c_int
 from pyglet.event import EventDispatcher
 from pyglet.gl import gl
+from pyglet.gl import gl_info
 from pyglet.image import SolidColorImagePattern
 from pyglet.sprite import Sprite
 from pyglet.text.document import UnformattedDocument
 from pyglet.text.layout import IncrementalTextLayout
 from pyglet.window import key
+import iv64_decode
+import iv64_hud
+import iv64_mmap
+import iv64_probe
+import iv64_renditions
+import iv64_scan
+import iv64_shuffle
+import iv64_sort
+import iv64_trace
+import iv64_watch
 import pyglet
 import os
-import random
 import re
 import sys
+import time
 
 __author__ = 'See-ming Lee'
 __email__ = 'seeminglee@gmail.com'
@@ -44,12 +55,14 @@ class InvalidFolderError(ImageViewerError): pass
 class Loader(object):
 	"""Used for loading things"""
 	@classmethod
+	@iv64_trace.traced('Loader.load_image')
 	def load_image(cls, fullname):
-		"""Load image and return image object and its bounding size"""
+		"""Load image and return image object and its bounding size. The
+		file is read through a memory map, unmapped before returning"""
 		try:
-			image_stream = open(fullname, 'rb')
-			image = pyglet.image.load(fullname, file=image_stream)
-		except IOError, message:
+			with iv64_mmap.MappedFile(fullname) as image_stream:
+				image = pyglet.image.load(fullname, file=image_stream)
+		except EnvironmentError, message:
 			print 'Cannot load image:', fullname
 			raise ImageLoadFileIOError, message
 		return image
@@ -76,8 +89,10 @@ class FileType(object):
 ### Models _-------------------------------------------------------------------
 class SlideshowModel(EventDispatcher):
 	"""model of the slideshow"""
-	def __init__(self, folder):
-		"""initialize with name of the folder"""
+	def __init__(self, folder, recursive=False, seed=None):
+		"""initialize with name of the folder. In recursive mode subfolders
+		are read too and files holds paths relative to the folder in a
+		compact PathIndex. seed makes the random order reproducible"""
 		try:
 			self.folder = folder
 			if not os.path.exists(self.folder):
@@ -89,11 +104,33 @@ class SlideshowModel(EventDispatcher):
 			print "An exception occurred: message: ", e.msg
 			self.folder = None
 
-		self.all_files = [f for f in os.listdir(self.folder)
-		                 if FileType.isnot_sys.match(f)]
-		self.image_files = [f for f in self.all_files
-		                   if FileType.is_image.match(f)]
+		# the folder is read in the background: wait for the first image
+		# only and let files grow while the slideshow runs
+		self.recursive = recursive
+		if recursive:
+			self.all_files = iv64_scan.PathIndex()
+			self.image_files = iv64_scan.PathIndex()
+		else:
+			self.all_files = []
+			self.image_files = []
 		self.files = self.image_files
+		self._positions = iv64_watch.Positions(self.files)
+		self._scanned_total = 0
+		self._sort_keys = iv64_sort.SortKeys(self.folder)
+		self.order = None  # iv64_sort order, None for the folder's own
+		self._scanner = iv64_scan.Scanner(self._scan(), self.image_files.extend)
+
+		# pick up files added to the folder while the slideshow runs. The
+		# watcher starts before the scan and its events are applied once
+		# the scan is over, see _check_watch
+		self._watcher = iv64_watch.FolderWatcher(self.folder,
+		                                         recursive=recursive)
+		self._watcher.start()
+		pyglet.clock.schedule_interval(self._check_watch, 0.25)
+
+		self._scanner.start()
+		self._scanner.wait_first()
+		pyglet.clock.schedule_interval(self._check_scan, 0.25)
 
 		self.loop = True
 		self.random = False
@@ -102,11 +139,12 @@ class SlideshowModel(EventDispatcher):
 		self._direction = "forward"
 		self._play_random = False
 
-		# used for tracking random files. in particular, allow
-		# to go back to files just previously viewed when playing in random
+		# random order is an iv64_shuffle.Shuffle, made when random play is
+		# first turned on. It allows going back to files just previously
+		# viewed without keeping any history
 		self._play_random = False
-		self._id_queue_past = []
-		self._id_queue = []
+		self.seed = seed
+		self._shuffle = None
 
 		# animation properties
 		self._autonext_interval_msec = 2000 # in milliseconds
@@ -114,6 +152,57 @@ class SlideshowModel(EventDispatcher):
 		# animation started
 		self._playing = False
 
+	def _scan(self):
+		"""read the folder, filling all_files and yielding image names"""
+		if self.recursive:
+			names = iv64_scan.walk_names(self.folder)
+		else:
+			names = iv64_scan.iter_names(self.folder)
+		for f in names:
+			if FileType.isnot_sys.match(os.path.basename(f)):
+				self.all_files.append(f)
+				if FileType.is_image.match(f):
+					yield f
+
+	def _check_scan(self, dt):
+		"""tell the views about files found since the last check"""
+		done = self._scanner.done
+		if self.total_files != self._scanned_total:
+			self._scanned_total = self.total_files
+			self.dispatch_event("on_slideshow_model_scan", dict(total_files = self.total_files))
+		if done:
+			pyglet.clock.unschedule(self._check_scan)
+
+	def _check_watch(self, dt):
+		"""apply the changes seen by the folder watcher, once the scan is
+		over: files it found as well are in files then and are not added
+		twice"""
+		if not self._scanner.done:
+			return
+		changes = self._watcher.poll()
+		if not changes:
+			return
+		current = self.current_file if self.files else None
+		self.apply_changes(changes)
+		if self.total_files != self._scanned_total:
+			self._scanned_total = self.total_files
+			self.dispatch_event("on_slideshow_model_scan", dict(total_files = self.total_files))
+		if self.files and self.current_file != current:
+			self._dispatch_update()
+
+	def apply_changes(self, changes):
+		"""apply iv64_watch events to files, keeping current_id on the same
+		file"""
+		def wanted(name):
+			return (FileType.isnot_sys.match(os.path.basename(name)) and
+			        FileType.is_image.match(name))
+		self._current_id = self._positions.apply(
+			changes, self._current_id, wanted)
+		# files added go at the end, files removed move the ones after them
+		if self._shuffle is not None and \
+		   any(change[0] != iv64_watch.ADD for change in changes):
+			self._shuffle.reset(len(self.files), self._current_id)
+
 	@property
 	def direction(self):
 		return self._direction
@@ -128,11 +217,7 @@ class SlideshowModel(EventDispatcher):
 
 	@property
 	def current_file(self):
-		if self.play_random:
-			filename = self.files.index(self.current_id)
-		else:
-			filename = self.files[self.current_id]
-		return os.path.join(self.folder, filename)
+		return os.path.join(self.folder, self.files[self.current_id])
 
 	@property
 	def total_files(self):
@@ -199,12 +284,7 @@ class SlideshowModel(EventDispatcher):
 
 		# random
 		else:
-			if not len(self._id_queue):
-				self._id_queue = range(len(self.files))
-			else:
-				self._current_id = random.randrange(len(self._id_queue))
-				self._id_queue.remove(self.current_id)
-				self._id_queue_past.append(self.current_id)
+			self._current_id = self.shuffle.next()
 
 		self._dispatch_update()
 
@@ -220,14 +300,65 @@ class SlideshowModel(EventDispatcher):
 
 		# random
 		else:
-			if not len(self._id_queue_past):
+			if not self.shuffle.position:
 				return # no more previous queue to go to, so don't do anything
 			else:
-				self._current_id = self._id_queue_past.pop()
-				self._id_queue.append(self.current_id)
+				self._current_id = self.shuffle.prev()
 
 		self._dispatch_update()
 
+	def toggle_random(self):
+		"""switch between playing in order and in random order. The random
+		order carries on from the current file"""
+		self._play_random = not self._play_random
+		if self._play_random:
+			if self._shuffle is None:
+				self._shuffle = iv64_shuffle.Shuffle(len(self.files), self.seed)
+				self.seed = self._shuffle.seed
+				print("random order seed: %d" % self.seed)
+			self._shuffle.reset(len(self.files), self._current_id)
+
+	@property
+	def shuffle(self):
+		"""the random order, kept in step with the number of files: files
+		appended join it from the next pass on"""
+		if len(self.files) > self._shuffle.n:
+			self._shuffle.grow(len(self.files))
+		elif len(self.files) < self._shuffle.n:
+			self._shuffle.reset(len(self.files), self._current_id)
+		return self._shuffle
+
+	def set_order(self, order):
+		"""play the files in order, one of iv64_sort.ORDERS. The files are
+		sorted in the background and put in order by _check_sort"""
+		self.order = order
+		self._sort_keys.sort(self.files, order)
+		pyglet.clock.unschedule(self._check_sort)
+		pyglet.clock.schedule_interval(self._check_sort, 0.25)
+
+	def next_order(self):
+		"""switch to the order after the current one"""
+		self.set_order(iv64_sort.next_order(self.order))
+
+	def _check_sort(self, dt):
+		"""put the files in order once they are sorted, keeping current_id
+		on the same file"""
+		result = self._sort_keys.poll()
+		if result is None:
+			return
+		pyglet.clock.unschedule(self._check_sort)
+		current = iv64_sort.reorder(self.files, result, self._current_id)
+		if current is None:
+			self.set_order(self.order) # files were removed, sort again
+			return
+		self._positions.reordered(len(result[1]))
+		self._current_id = current
+		if self._shuffle is not None:
+			self._shuffle.reset(len(self.files), self._current_id)
+		self.dispatch_event("on_slideshow_model_scan",
+		                    dict(total_files = self.total_files,
+		                         current_id = self.current_id))
+
 	def limit_id_range(self):
 		self._current_id = (self._current_id + len(self.files)) \
 				% len(self.files)
@@ -244,6 +375,7 @@ class SlideshowModel(EventDispatcher):
 		)
 
 SlideshowModel.register_event_type("on_slideshow_model_update")
+SlideshowModel.register_event_type("on_slideshow_model_scan")
 
 
 ### Controllers ---------------------------------------------------------------
@@ -275,6 +407,14 @@ class SlideshowController(EventDispatcher):
 		elif symbol in [key.S, key.SPACE]:
 			self.model.toggle_play()
 
+		# random order on/off
+		elif symbol == key.R:
+			self.model.toggle_random()
+
+		# next play order
+		elif symbol == key.O:
+			self.model.next_order()
+
 		# adjust show timing and starts it off if not already playing
 		else:
 			time = 10000
@@ -291,6 +431,159 @@ class SlideshowController(EventDispatcher):
 		# self.started = not self.started
 
 ### Helpers -------------------------------------------------------------------
+def texture_bytes(texture):
+	"""video memory held by a texture, counted as RGBA"""
+	owner = getattr(texture, 'owner', texture)
+	return owner.width * owner.height * 4
+
+
+def mipmap_mode():
+	"""return how mipmaps are built with the current context: a function
+	generating them for the bound texture (GL 3.0 or the framebuffer object
+	extensions), 'auto' for the GL_GENERATE_MIPMAP texture parameter of GL
+	1.4, which is all older Mesa software renderers have, or None"""
+	for name, available in (
+		('glGenerateMipmap', gl_info.have_version(3) or
+		                     gl_info.have_extension('GL_ARB_framebuffer_object')),
+		('glGenerateMipmapEXT',
+		                     gl_info.have_extension('GL_EXT_framebuffer_object'))):
+		if available and hasattr(pyglet.gl, name):
+			return getattr(pyglet.gl, name)
+	if gl_info.have_version(1, 4):
+		return 'auto'
+	return None
+
+
+### Texture Pool --------------------------------------------------------------
+DEFAULT_TEXTURE_BUDGET = 128 * 1024 * 1024
+
+def texture_budget():
+	"""residency budget in bytes, from IV64_TEXTURE_MB if it is set"""
+	try:
+		return int(os.environ['IV64_TEXTURE_MB']) * 1024 * 1024
+	except (KeyError, ValueError):
+		return DEFAULT_TEXTURE_BUDGET
+
+
+class TexturePool(object):
+	"""Textures kept on the GPU for reuse. An image is uploaded into the
+	smallest free texture it fits in, one of its own size when mipmapped,
+	and a new texture is only created when none does. Free textures are
+	dropped, least recently released first, while the textures held take
+	more than the residency budget.
+
+	Textures are mipmapped when the GL allows it, so that minifying them
+	is filtered trilinearly instead of aliasing."""
+
+	def __init__(self, budget=DEFAULT_TEXTURE_BUDGET, mipmaps=True):
+		"""initialization.
+		@param  budget   bytes of video memory the pool may keep resident
+		@param  mipmaps  set to False for plain linear filtering"""
+		self.budget = budget
+		self.mipmaps = mipmaps
+		self._mode = None  # see mipmap_mode(), looked up with the first texture
+		self.bytes = 0
+		self.uploads = 0
+		self.reuses = 0
+		self.creates = 0
+		self.deletes = 0
+		self._used = set()
+		self._free = []  # least recently released first
+
+	def acquire(self, image):
+		"""upload image and return (texture, region) where texture is the
+		pooled texture to release() later and region the part of it holding
+		the image"""
+		width, height = image.width, image.height
+		texture = self._take(width, height)
+		if texture is None:
+			texture = self._create(width, height)
+			self.bytes += self._cost(texture)
+			self.creates += 1
+		else:
+			self.reuses += 1
+		with iv64_trace.shared.span('texture upload'):
+			texture.blit_into(image, 0, 0, 0)
+			if self.mipmaps and callable(self._mode):
+				gl.glBindTexture(texture.target, texture.id)
+				self._mode(texture.target)
+		self.uploads += 1
+		iv64_trace.shared.sample('texture bytes', self.bytes)
+		self._used.add(texture)
+		self._trim()
+		return texture, texture.get_region(0, 0, width, height)
+
+	def release(self, texture):
+		"""hand a texture back for reuse"""
+		if texture in self._used:
+			self._used.remove(texture)
+			self._free.append(texture)
+			self._trim()
+
+	def stats(self):
+		"""return a dictionary of the pool counters"""
+		return dict(
+			textures = len(self._used) + len(self._free),
+			in_use   = len(self._used),
+			free     = len(self._free),
+			bytes    = self.bytes,
+			budget   = self.budget,
+			uploads  = self.uploads,
+			reuses   = self.reuses,
+			creates  = self.creates,
+			deletes  = self.deletes,
+		)
+
+	@iv64_trace.traced('texture create')
+	def _create(self, width, height):
+		texture = pyglet.image.Texture.create(width, height, gl.GL_RGBA)
+		if self.mipmaps and self._mode is None:
+			self._mode = mipmap_mode()
+			self.mipmaps = self._mode is not None
+		if self.mipmaps:
+			gl.glBindTexture(texture.target, texture.id)
+			if self._mode == 'auto':
+				# the GL rebuilds the levels on every upload
+				gl.glTexParameteri(texture.target, gl.GL_GENERATE_MIPMAP,
+				                   gl.GL_TRUE)
+			gl.glTexParameteri(texture.target, gl.GL_TEXTURE_MIN_FILTER,
+			                   gl.GL_LINEAR_MIPMAP_LINEAR)
+		return texture
+
+	def _cost(self, texture):
+		"""bytes held by texture, a third more with its mipmaps"""
+		if self.mipmaps:
+			return texture_bytes(texture) * 4 // 3
+		return texture_bytes(texture)
+
+	def _take(self, width, height):
+		"""remove and return the smallest free texture width x height fits
+		in, or None. Mipmaps are made from the whole texture, so with them
+		only a texture of exactly that size will do: the texels a larger
+		one has left over from its last image would bleed into the lower
+		levels along the edges"""
+		exact = self.mipmaps
+		best = None
+		for texture in self._free:
+			if exact and (texture.width, texture.height) != (width, height):
+				continue
+			if texture.width >= width and texture.height >= height and (
+			    best is None or
+			    texture.width * texture.height < best.width * best.height):
+				best = texture
+		if best is not None:
+			self._free.remove(best)
+		return best
+
+	def _trim(self):
+		"""drop free textures until the pool is within budget. pyglet
+		deletes a texture once nothing refers to it any more"""
+		while self.bytes > self.budget and self._free:
+			texture = self._free.pop(0)
+			self.bytes -= self._cost(texture)
+			self.deletes += 1
+
+
 def draw_rect(x, y, width, height):
 	gl.glBegin(gl.GL_QUADS)
 	gl.glVertex2f(x,  y)
@@ -516,6 +809,7 @@ class FileInfoWidget(Control):
 		self.dispatch_event( "on_fileinfo_update", dict([
 			('content_width', self.layout.width)
 		]) )
+		self.parent.invalidate()
 #		self.dispatch_event("on_fileinfo_update",
 #			dict([(key, self.layout[key])
 #					for key in ('width', 'height',
@@ -529,6 +823,13 @@ class FileInfoWidget(Control):
 
 
 
+	def on_slideshow_model_scan(self, model):
+		self.file_total = model['total_files']
+		self.file_id = model.get('current_id', self.file_id)
+		if self.filename is not None:
+			self.document.text = self.text
+			self.parent.invalidate()
+
 	def draw(self):
 		if self.text is not '':
 			self.batch.draw()
@@ -536,6 +837,64 @@ class FileInfoWidget(Control):
 FileInfoWidget.register_event_type("on_fileinfo_update")
 
 
+class PerfHUDWidget(Control):
+	"""Performance overlay in the top left corner: frame times, latencies
+	of the current file, cache, texture pool and rendition queue. Toggled
+	with H. While it is shown its text is updated every iv64_hud.REFRESH
+	seconds; hidden it costs nothing"""
+
+	def __init__(self, parent, image_view, group=None, batch=None):
+		super(PerfHUDWidget, self).__init__(parent, group, batch)
+		self.image_view = image_view
+		self.stats = iv64_hud.shared
+		self.visible = False
+		self.filename = None
+		self.label = pyglet.text.Label(
+			'', font_name='Gill Sans', font_size=10.0,
+			color = (255, 255, 255, 255),
+			x = 10, y = parent.height - 10,
+			anchor_x = 'left', anchor_y = 'top',
+			multiline = True, width = 600
+		)
+
+	def toggle_visibility(self):
+		self.visible = not self.visible
+		if self.visible:
+			self.refresh(0)
+			pyglet.clock.schedule_interval(self.refresh, iv64_hud.REFRESH)
+		else:
+			pyglet.clock.unschedule(self.refresh)
+		self.parent.invalidate()
+
+	def refresh(self, dt):
+		"""make the text again, redrawing only when it changed"""
+		lines = self.stats.lines(
+			self.filename,
+			queues = [('renditions', iv64_renditions.shared.queued),
+			          ('upgrade', self.image_view.decoder.depth)],
+			resident = [('textures', self.image_view.pool.bytes)]
+		)
+		text = '\n'.join(lines)
+		if text != self.label.text:
+			self.label.text = text
+			self.parent.invalidate()
+
+	def on_slideshow_model_update(self, model):
+		self.filename = model['current_file']
+
+	def on_key_press(self, symbol, modifiers):
+		if symbol == key.H:
+			self.toggle_visibility()
+			return pyglet.event.EVENT_HANDLED
+
+	def on_resize(self, width, height):
+		self.label.y = height - 10
+
+	def draw(self):
+		if self.visible:
+			self.label.draw()
+
+
 class ImageView(object):
 	"""Container of an image"""
 
@@ -545,14 +904,27 @@ class ImageView(object):
 		self.y = 0
 		self.batch = pyglet.graphics.Batch()
 		self.group = None
-		self.sprite = None
+		self.sprite = None       # showing the current slide
+		self.back_sprite = None  # showing the previous slide during the fade
 		self.image = None
 		self.texture = None
+		self.shown = None     # file the front sprite shows, maybe a rendition
+		self.reduction = 1    # power of two it was decoded reduced by
+		self.decoder = iv64_decode.Decoder('upgrade')  # full images
+		self.fade_duration = 0.3  # seconds
+		self._fade_start = None
 
 		for key in ('img', 'x', 'y', 'batch', 'group', 'usage', 'folder'):
 			if key in kwargs:
 				setattr(self, key, kwargs[key])
 
+		# the two sprites are reused for every slide and their textures come
+		# from the pool, so nothing piles up in the batch or on the GPU
+		self.pool = TexturePool(texture_budget())
+		self._pooled = {}  # sprite -> pooled texture it shows
+		self.front_group = pyglet.graphics.OrderedGroup(1, parent=self.group)
+		self.back_group = pyglet.graphics.OrderedGroup(0, parent=self.group)
+
 		self.background = Rectangle(0, 0, 0, 255, 0, 0, 90, 90)
 		print("Image View Background")
 		print(self.background)
@@ -560,31 +932,101 @@ class ImageView(object):
 
 	def on_slideshow_model_update(self, model):
 		self.filename = model['current_file']
-		self.image, self.texture = self.load_texture(self.filename)
-
-		self.sprite = Sprite(img=self.image, batch=self.batch,
-							 group=self.group)
+		window_size = (self.parent.width, self.parent.height)
+
+		# show a cached rendition at once and the full image once the
+		# decoder thread is done with it
+		rendition = iv64_renditions.shared.lookup(self.filename, window_size)
+		if rendition is not None:
+			shown = rendition
+			self.decoder.request(self.filename, window_size)
+			pyglet.clock.schedule_once(self.upgrade, 0.05, self.filename,
+			                           window_size)
+		else:
+			shown = self.filename
+			iv64_renditions.shared.schedule(self.filename, window_size)
+
+		# the sprite of the previous slide stays behind for the fade; the one
+		# behind it is done with and takes the new slide
+		sprite, self.back_sprite = self.back_sprite, self.sprite
+		if self.back_sprite is not None:
+			self.back_sprite.group = self.back_group
+		if sprite is not None:
+			sprite.group = self.front_group
+			sprite.visible = True
+		self.sprite = sprite
+		self.show_file(shown, window_size)
 		self.fit(self.parent.width, self.parent.height)
 
+		# fade the new slide in
+		self.sprite.opacity = 0
+		self._fade_start = time.time()
+		self.parent.animate(self.fade_duration)
+
+	def upgrade(self, dt, filename, window_size):
+		"""replace the rendition on screen with the full quality image the
+		decoder thread was asked for, checking again a moment later while
+		it is not done. Only the upload is left to the main thread"""
+		if filename != self.filename or self.sprite is None:
+			return
+		done, image = self.decoder.result(filename, window_size)
+		if not done:
+			pyglet.clock.schedule_once(self.upgrade, 0.05, filename,
+			                           window_size)
+			return
+		if image is None:
+			return  # the rendition stays
+		self.reduction = iv64_decode.reduction_of(filename, window_size)
+		self.shown = filename
+		with iv64_hud.shared.timing('upload', filename):
+			self.show(image)
+		self.fit(self.parent.width, self.parent.height)
+		self.parent.invalidate()
+
+	def show_file(self, file, window_size):
+		"""show file, decoded at the reduced level suiting window_size"""
+		self.reduction = iv64_decode.reduction_of(file, window_size)
+		self.shown = file
+		image = self.load_image(file, self.reduction)
+		with iv64_hud.shared.timing('upload', file):
+			self.show(image)
+
+	def show(self, image):
+		"""upload image into a pooled texture and put it on the front
+		sprite, handing the texture it showed before back to the pool"""
+		self._release(self.sprite)
+		texture, self.texture = self.pool.acquire(image)
+		if self.sprite is None:
+			self.sprite = Sprite(img=self.texture, batch=self.batch,
+			                     group=self.front_group)
+		else:
+			self.sprite.image = self.texture
+		self._pooled[self.sprite] = texture
+		self.image = image
 
-	@classmethod
-	def load_texture(cls, file):
-		try:
-			image = pyglet.image.load(file)
-		except pyglet.image.codecs.dds.DDSException:
-			print ("%s is not a valid image file." % file)
-			raise ImageViewerError
-
-		texture = image.get_texture()
+	def _release(self, sprite):
+		texture = self._pooled.pop(sprite, None)
+		if texture is not None:
+			self.pool.release(texture)
 
-		return image, texture
+	@staticmethod
+	@iv64_trace.traced('load_image')
+	def load_image(file, reduction=1):
+		return iv64_decode.load(file, reduction)
 
 
 	def on_resize(self, width, height):
 		self.background.resize(width, height)
 
+		# decode again when the window needs another reduced level
+		if self.shown is not None and \
+		   iv64_decode.reduction_of(self.shown, (width, height)) != \
+		   self.reduction:
+			self.show_file(self.shown, (width, height))
 		self.fit(width, height)
+		self.parent.invalidate()
 
+	@iv64_trace.traced('fit')
 	def fit(self, dst_w, dst_h):
 		print ('image_view fit')
 
@@ -602,20 +1044,58 @@ class ImageView(object):
 
 
 	def draw(self):
+		if self._fade_start is not None:
+			elapsed = time.time() - self._fade_start
+			if elapsed >= self.fade_duration:
+				self.sprite.opacity = 255
+				self._fade_start = None
+				# the previous slide is hidden now, free its texture
+				if self.back_sprite is not None:
+					self.back_sprite.visible = False
+					self._release(self.back_sprite)
+			else:
+				self.sprite.opacity = int(255 * elapsed / self.fade_duration)
 		self.batch.draw()
 
 
 
+class RedrawEventLoop(pyglet.app.EventLoop):
+	"""Event loop that only redraws windows which have been invalidated
+	(see AppWindow.invalidate) instead of every window after every event or
+	scheduled call. With nothing to draw and nothing scheduled soon, the
+	process sleeps until the next event."""
+
+	def idle(self):
+		clock = pyglet.clock.get_default()
+		dt = clock.update_time()
+		clock.call_scheduled_functions(dt)
+		trace = iv64_trace.shared
+		for window in pyglet.app.windows:
+			if getattr(window, 'dirty', True):
+				window.switch_to()
+				with trace.span('draw'):
+					window.dispatch_event('on_draw')
+				with trace.span('present'):
+					window.flip()
+		return clock.get_sleep_time(True)
+
+
+
 class AppWindow(pyglet.window.Window):
 	"""Main app window"""
 
 	def __init__(self, folder, width=800, height=600, caption="Image Viewer",
-	             resizable= True, *args, **kwargs):
+	             resizable= True, recursive=False, seed=None, *args, **kwargs):
 
 		self.folder = folder
 		self.width  = width
 		self.height = height
 
+		# redraw scheduling: see invalidate() and animate()
+		self.dirty = True
+		self._animate_until = 0
+		self._animating = False
+
 		super(AppWindow, self).__init__(caption=caption, resizable=resizable,
 		                                *args, **kwargs)
 
@@ -627,7 +1107,7 @@ class AppWindow(pyglet.window.Window):
 		self.fg_group = pyglet.graphics.OrderedGroup(2)
 
 		# Slideshow model
-		self.ss_model = SlideshowModel(folder)
+		self.ss_model = SlideshowModel(folder, recursive=recursive, seed=seed)
 
 		# Slideshow: Views + Controls
 		self.image_view  = ImageView(
@@ -647,6 +1127,7 @@ class AppWindow(pyglet.window.Window):
 			batch = self.batch,
 			group = self.fg_group
 		)
+		self.perf_hud = PerfHUDWidget(self, self.image_view)
 
 		# Slideshow: Controller
 		self.ss_control = SlideshowController(
@@ -656,18 +1137,41 @@ class AppWindow(pyglet.window.Window):
 		# EVENTS: slideshow events
 		self.ss_control.add_model_observer( self.image_view )
 		self.ss_control.add_model_observer( self.file_info )
+		self.ss_control.add_model_observer( self.perf_hud )
 		# EVENTS: file info update event
 #		self.file_info.push_handlers(self.file_info_bg)
 		# EVENTS: window UI events
 		self.push_handlers(self.ss_control)
 		self.push_handlers(self.image_view)
 		self.push_handlers(self.file_info_bg)
+		self.push_handlers(self.perf_hud)  # before ss_control sees H
 
 
 	def update(self, _):
-		self.on_draw()
+		self.invalidate()
 #		self.clock += .01
 
+	def invalidate(self):
+		"""ask for the window to be drawn again"""
+		self.dirty = True
+
+	def animate(self, duration):
+		"""keep drawing frames for the next `duration` seconds"""
+		self._animate_until = max(self._animate_until, time.time() + duration)
+		self.dirty = True
+		if not self._animating:
+			self._animating = True
+			pyglet.clock.schedule_interval(self._animation_frame, 1 / 60.0)
+
+	def _animation_frame(self, dt):
+		self.dirty = True
+		if time.time() >= self._animate_until:
+			self._animating = False
+			pyglet.clock.unschedule(self._animation_frame)
+
+	def on_expose(self):
+		self.invalidate()
+
 	def on_draw(self):
 		self.clear()
 
@@ -675,6 +1179,9 @@ class AppWindow(pyglet.window.Window):
 		self.file_info.layout.draw()
 		self.file_info.draw()
 		self.image_view.draw()
+		self.perf_hud.draw()
+		self.dirty = False
+		iv64_hud.shared.frame(self._animating)
 
 	# Window control behavior
 	def on_key_press(self, symbol, modifiers):
@@ -700,13 +1207,24 @@ class AppWindow(pyglet.window.Window):
 def main(argv):
 	_folder = '/Volumes/Proteus/Pictures/test'
 	_caption = 'ImageViewer64'
+	_recursive = False
+	_seed = None
 	if argv is not None:
+		_recursive = '-r' in argv or '--recursive' in argv
+		argv = [a for a in argv if a not in ('-r', '--recursive')]
+		for a in argv:
+			if a.startswith('--seed='):
+				_seed = int(a[len('--seed='):])
+		argv = [a for a in argv if not a.startswith('--seed=')]
 		if len(argv) > 1:
 			_folder = argv[1]
 		if len(argv) > 2:
 			_caption = argv[2]
-	window = AppWindow(folder=_folder, caption=_caption)
+	window = AppWindow(folder=_folder, caption=_caption, recursive=_recursive,
+	                   seed=_seed)
+	pyglet.app.event_loop = RedrawEventLoop()
 	pyglet.app.run()
+	iv64_probe.shared.save()
 
 
 
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_renditions: persistent on-disk cache of downscaled renditions.
+
+Renditions come in a few standard sizes (longest edge in pixels) and are
+keyed on the (path, size, mtime) of the original, so an edited file gets a
+new rendition and the stale one ages out. The cache lives in
+$XDG_CACHE_HOME/iv64 (~/.cache/iv64 by default), is capped in bytes and
+cleaned up least recently used first; a hit touches the file's mtime.
+
+The viewers show a rendition at once when one exists and swap in the full
+quality decode later. Creating renditions needs PIL; without it the cache
+is read-only.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import hashlib
+import os
+import tempfile
+import threading
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+
+DEFAULT_CAP = 1024 * 1024 * 1024
+SIZES = (256, 1024, 2048)
+
+
+def default_path():
+	"""return the XDG style cache directory"""
+	base = os.environ.get('XDG_CACHE_HOME') or \
+	       os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(base, 'iv64')
+
+
+class RenditionCache(object):
+	"""Directory of downscaled renditions with a size cap"""
+
+	def __init__(self, path=None, cap=DEFAULT_CAP, sizes=SIZES):
+		"""initialization.
+		@param  path   cache directory, XDG cache directory by default
+		@param  cap    maximum number of bytes kept on disk
+		@param  sizes  standard rendition sizes, longest edge in pixels"""
+		self.path = path or default_path()
+		self.cap = cap
+		self.sizes = tuple(sorted(sizes))
+		self.bytes = None  # computed on first store
+		self._lock = threading.Lock()
+		self._pending = []
+		self._cond = threading.Condition()
+		self._writer = None
+
+	def size_for(self, window_size):
+		"""return the smallest standard size covering window_size, or the
+		largest one if the window is bigger than all of them"""
+		edge = max(window_size)
+		for size in self.sizes:
+			if size >= edge:
+				return size
+		return self.sizes[-1]
+
+	def rendition_path(self, filename, size):
+		"""return where the rendition of filename at size is kept.
+		Raises OSError if filename cannot be stat'ed"""
+		filename = os.path.abspath(filename)
+		st = os.stat(filename)
+		key = '%s\0%d\0%r' % (filename, st.st_size, st.st_mtime)
+		if not isinstance(key, bytes):
+			key = key.encode('utf-8', 'surrogateescape')
+		name = hashlib.sha1(key).hexdigest()
+		return os.path.join(self.path, str(size), name[:2], name + '.jpg')
+
+	def lookup(self, filename, window_size):
+		"""return the path of a rendition suitable for window_size or None"""
+		try:
+			path = self.rendition_path(filename, self.size_for(window_size))
+			os.utime(path, None)  # mark as recently used
+		except OSError:
+			return None
+		return path
+
+	def store(self, filename, window_size):
+		"""create the rendition of filename for window_size if it does not
+		exist yet and return its path, or None if it could not be made"""
+		if Image is None:
+			return None
+		size = self.size_for(window_size)
+		try:
+			path = self.rendition_path(filename, size)
+		except OSError:
+			return None
+		if os.path.exists(path):
+			return path
+		try:
+			image = Image.open(filename)
+			if max(image.size) <= size:
+				return None  # no smaller than the original, not worth keeping
+			image.draft('RGB', (size, size))
+			if image.mode != 'RGB':
+				image = image.convert('RGB')
+			image.thumbnail((size, size), Image.ANTIALIAS)
+			directory = os.path.dirname(path)
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			fd, tmp = tempfile.mkstemp(suffix='.jpg', dir=directory)
+			try:
+				with os.fdopen(fd, 'wb') as stream:
+					image.save(stream, 'JPEG', quality=90)
+				os.rename(tmp, path)
+			except:
+				os.unlink(tmp)
+				raise
+		except (IOError, OSError):
+			return None
+		self._account(os.path.getsize(path))
+		return path
+
+	def schedule(self, filename, window_size):
+		"""store() the rendition on a background thread"""
+		with self._cond:
+			self._pending.append((filename, tuple(window_size)))
+			if self._writer is None:
+				self._writer = threading.Thread(target=self._write,
+				                                name='renditions')
+				self._writer.daemon = True
+				self._writer.start()
+			self._cond.notify()
+
+	@property
+	def queued(self):
+		"""number of renditions waiting for the background writer"""
+		return len(self._pending)
+
+	def cleanup(self):
+		"""remove least recently used renditions until under the cap"""
+		with self._lock:
+			entries = self._entries()
+			self.bytes = sum(nbytes for mtime, nbytes, path in entries)
+			entries.sort()
+			for mtime, nbytes, path in entries:
+				if self.bytes <= self.cap:
+					break
+				try:
+					os.unlink(path)
+				except OSError:
+					continue
+				self.bytes -= nbytes
+
+	def _account(self, nbytes):
+		"""add a new file to the byte count and clean up when over the cap"""
+		with self._lock:
+			if self.bytes is not None:
+				self.bytes += nbytes
+				over = self.bytes > self.cap
+			else:
+				over = True  # first store: count what is on disk
+		if over:
+			self.cleanup()
+
+	def _write(self):
+		"""writer loop for schedule()"""
+		while True:
+			with self._cond:
+				while not self._pending:
+					self._cond.wait()
+				filename, window_size = self._pending.pop(0)
+			self.store(filename, window_size)
+
+	def _entries(self):
+		"""return (mtime, bytes, path) of every rendition on disk"""
+		entries = []
+		for root, dirs, files in os.walk(self.path):
+			for name in files:
+				path = os.path.join(root, name)
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				entries.append((st.st_mtime, st.st_size, path))
+		return entries
+
+
+# cache shared by everything in the process
+shared = RenditionCache()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_scan: streaming directory scans, so the viewers can show the first
+image of a huge folder before the whole listing has been read.
+
+Uses os.scandir (or the scandir backport on older pythons) and falls back
+to os.listdir, which still works but only yields once the listing is done.
+
+For recursive scans of large archives walk_names() reads subdirectories on
+several threads, and PathIndex keeps the resulting paths compact: every
+directory is stored once in a table and the file names are packed into a
+single buffer, instead of one absolute path string per file.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+from array import array
+import os
+import threading
+import time
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None
+
+
+def iter_names(path):
+	"""yield the names of the entries in path as the directory is read"""
+	if scandir is None:
+		for name in os.listdir(path):
+			yield name
+		return
+	for entry in scandir(path):
+		yield entry.name
+
+
+def _is_dir(path, entry=None):
+	if entry is not None:
+		return entry.is_dir(follow_symlinks=False)
+	return os.path.isdir(path) and not os.path.islink(path)
+
+
+def walk_names(root, workers=4):
+	"""yield the path, relative to root, of every file below root. Hidden
+	directories are skipped. Directories are read on `workers` threads, so
+	the order is not defined"""
+	results = queue.Queue()
+	work = queue.Queue()
+	state = dict(outstanding=1)
+	lock = threading.Lock()
+	done = object()
+
+	def read(rel):
+		path = os.path.join(root, rel)
+		if scandir is not None:
+			entries = [(e.name, e) for e in scandir(path)]
+		else:
+			entries = [(name, None) for name in os.listdir(path)]
+		files = []
+		for name, entry in entries:
+			child = os.path.join(rel, name) if rel else name
+			if _is_dir(os.path.join(path, name), entry):
+				if not name.startswith('.'):
+					with lock:
+						state['outstanding'] += 1
+					work.put(child)
+			else:
+				files.append(child)
+		return files
+
+	def worker():
+		while True:
+			rel = work.get()
+			if rel is None:
+				return
+			try:
+				files = read(rel)
+				if files:
+					results.put(files)
+			except OSError:
+				pass
+			finally:
+				with lock:
+					state['outstanding'] -= 1
+					finished = not state['outstanding']
+				if finished:
+					results.put(done)
+
+	threads = []
+	for i in range(workers):
+		thread = threading.Thread(target=worker, name='walker-%d' % i)
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+	work.put('')
+	try:
+		while True:
+			files = results.get()
+			if files is done:
+				break
+			for name in files:
+				yield name
+	finally:
+		for thread in threads:
+			work.put(None)
+
+
+def _encode(name):
+	if isinstance(name, bytes):
+		return name
+	return name.encode('utf-8', 'surrogateescape')
+
+def _decode(name):
+	if str is bytes:
+		return bytes(name)
+	return bytes(name).decode('utf-8', 'surrogateescape')
+
+
+class PathIndex(object):
+	"""Compact list of paths. Directories are interned in a table and names
+	are packed into one buffer; paths are only built as strings when they
+	are read. Behaves like a list for len(), indexing, slicing, iteration,
+	append(), extend(), insert(), item assignment and deletion.
+
+	Deleted and replaced names are left in the buffer; the index is meant
+	for playlists that mostly grow."""
+
+	def __init__(self, paths=None):
+		self.dirs = []
+		self._dir_ids = {}
+		self._dir_of = array('I')  # directory id per entry
+		self._starts = array('I')  # offset of each name in _names
+		self._ends = array('I')    # end offset of each name in _names
+		self._names = bytearray()
+		if paths is not None:
+			self.extend(paths)
+
+	def _pack(self, path):
+		"""store the parts of path and return (dir id, start, end)"""
+		directory, name = os.path.split(path)
+		dir_id = self._dir_ids.get(directory)
+		if dir_id is None:
+			dir_id = self._dir_ids[directory] = len(self.dirs)
+			self.dirs.append(directory)
+		start = len(self._names)
+		self._names.extend(_encode(name))
+		return dir_id, start, len(self._names)
+
+	def append(self, path):
+		dir_id, start, end = self._pack(path)
+		self._dir_of.append(dir_id)
+		self._starts.append(start)
+		self._ends.append(end)
+
+	def extend(self, paths):
+		for path in paths:
+			self.append(path)
+
+	def insert(self, i, path):
+		dir_id, start, end = self._pack(path)
+		self._dir_of.insert(i, dir_id)
+		self._starts.insert(i, start)
+		self._ends.insert(i, end)
+
+	def directory(self, i):
+		"""return the directory of the entry at i"""
+		return self.dirs[self._dir_of[i]]
+
+	def name(self, i):
+		"""return the file name of the entry at i"""
+		return _decode(self._names[self._starts[i]:self._ends[i]])
+
+	def index(self, path):
+		for i, p in enumerate(self):
+			if p == path:
+				return i
+		raise ValueError('%r is not in the index' % (path,))
+
+	def nbytes(self):
+		"""approximate memory held by the index, not counting the table of
+		directory strings"""
+		return (len(self._names) + self._dir_of.itemsize * len(self._dir_of) +
+		        self._starts.itemsize * len(self._starts) +
+		        self._ends.itemsize * len(self._ends))
+
+	def __len__(self):
+		return len(self._ends)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError('path index out of range')
+		return os.path.join(self.directory(i), self.name(i))
+
+	def __setitem__(self, i, path):
+		dir_id, start, end = self._pack(path)
+		self._dir_of[i] = dir_id
+		self._starts[i] = start
+		self._ends[i] = end
+
+	def permute(self, positions):
+		"""reorder the first len(positions) entries so that entry i is the
+		one that was at positions[i]. No names are copied"""
+		n = len(positions)
+		for field in (self._dir_of, self._starts, self._ends):
+			field[:n] = array('I', [field[i] for i in positions])
+
+	def keep(self, start, positions):
+		"""drop the entries from start on but those at positions, indexes
+		from start on in increasing order. No names are copied"""
+		for field in (self._dir_of, self._starts, self._ends):
+			field[start:] = array('I', [field[i] for i in positions])
+
+	def __delitem__(self, i):
+		del self._dir_of[i]
+		del self._starts[i]
+		del self._ends[i]
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def __contains__(self, path):
+		try:
+			self.index(path)
+		except ValueError:
+			return False
+		return True
+
+
+class Scanner(threading.Thread):
+	"""Drain an iterable of names on a background thread and hand them to
+	sink in batches. The first name is handed over on its own so it can be
+	shown at once; after that a batch is flushed when it is full or when
+	`interval` seconds have passed."""
+
+	def __init__(self, names, sink, batch=256, interval=0.25):
+		"""initialization.
+		@param  names     iterable of names, typically a generator over a scan
+		@param  sink      called with each list of names, e.g. list.extend
+		@param  batch     maximum number of names per call to sink
+		@param  interval  maximum number of seconds a name waits in a batch"""
+		super(Scanner, self).__init__(name='scanner')
+		self.daemon = True
+		self.names = names
+		self.sink = sink
+		self.batch = batch
+		self.interval = interval
+		self.count = 0
+		self.error = None
+		self._first = threading.Event()
+		self._done = threading.Event()
+
+	@property
+	def done(self):
+		return self._done.is_set()
+
+	def wait_first(self, timeout=None):
+		"""block until the first name has been handed to sink or the scan is
+		over. Returns True if at least one name was found"""
+		self._first.wait(timeout)
+		return self.count > 0
+
+	def wait(self, timeout=None):
+		"""block until the scan is over"""
+		self._done.wait(timeout)
+		return self.done
+
+	def run(self):
+		buf = []
+		flushed = time.time()
+		try:
+			for name in self.names:
+				buf.append(name)
+				if (not self.count or len(buf) >= self.batch or
+				    time.time() - flushed >= self.interval):
+					self._flush(buf)
+					buf = []
+					flushed = time.time()
+			self._flush(buf)
+		except (OSError, IOError) as e:
+			self.error = e
+		finally:
+			self._done.set()
+			self._first.set()
+
+	def _flush(self, buf):
+		if buf:
+			self.sink(buf)
+			self.count += len(buf)
+			self._first.set()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_shuffle: shuffled playback order for playlists of any size.
+
+The order is a seeded permutation of the playlist indexes that is computed
+on demand instead of being stored: a small Feistel network is a bijection
+on a power of two sized domain and cycle walking restricts it to the
+playlist length. Going to the next or previous file, or to any position,
+is O(1) and takes no memory however long the slideshow runs. Each pass
+through the playlist gets its own permutation, derived from the seed and
+the pass number, so the same seed always plays the same sequence.
+
+A pass keeps the length it started with. Files appended to the playlist
+while it is under way, by a scan still going or a folder watcher, take
+part from the next pass on, so prev() retraces what was shown. Only a
+pass that starts with another length than the one before it takes memory:
+one entry. Reordering the playlist or removing files from it changes its
+indexes, so the history is dropped then, see Shuffle.reset().
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import bisect
+import random
+
+ROUNDS = 4
+
+
+def _mix(x):
+	"""32 bit integer hash"""
+	x = ((x ^ (x >> 16)) * 0x45d9f3b) & 0xffffffff
+	x = ((x ^ (x >> 16)) * 0x45d9f3b) & 0xffffffff
+	return x ^ (x >> 16)
+
+
+class Shuffle(object):
+	"""Shuffled order of the indexes 0 .. n-1. position counts the steps
+	taken from the start; shuffle[position] is the playlist index shown at
+	that position and positions past the end of a pass carry on with the
+	next one"""
+
+	def __init__(self, n, seed=None, current=None):
+		"""initialization.
+		@param  n        length of the playlist
+		@param  seed     integer seed, a random one if None
+		@param  current  playlist index to start the shuffle at"""
+		if seed is None:
+			seed = random.getrandbits(32)
+		self.seed = seed
+		self.n = 0
+		self.position = 0
+		# passes of the same length come in runs: the positions a run
+		# starts at, and its first pass and length
+		self._starts = [0]
+		self._runs = [(0, 0)]
+		self._cycle = None  # pass and length the keys below are for
+		self._keys = None
+		self.reset(n, current)
+
+	def reset(self, n, current=None):
+		"""start again with a playlist of length n whose indexes changed,
+		after a reorder or a removal. The history is dropped: position 0
+		is where playlist index `current` is in the current pass, or its
+		start, and prev() goes back no further"""
+		cycle = self._locate(self.position)[0] if self.n else 0
+		offset = 0
+		if current is not None and 0 <= current < n:
+			offset = self._index(current, cycle, n)
+		self.n = n
+		self.position = 0
+		self._starts = [-offset]
+		self._runs = [(cycle, n)]
+
+	def grow(self, n):
+		"""lengthen the playlist to n, files appended at its end. The pass
+		under way keeps its order and the new files take part from the
+		next pass on"""
+		if n <= self.n:
+			return
+		self.n = n
+		start = self._starts[-1]
+		cycle, length = self._runs[-1]
+		if not length or start > self.position:
+			self._runs[-1] = (cycle, n)  # the run has not begun
+			return
+		passes = (self.position - start) // length + 1
+		self._starts.append(start + passes * length)
+		self._runs.append((cycle + passes, n))
+
+	def __len__(self):
+		return self.n
+
+	def __getitem__(self, position):
+		"""return the playlist index at position"""
+		if not self.n:
+			raise IndexError('shuffle of an empty playlist')
+		cycle, offset, n = self._locate(position)
+		keys, half, mask = self._keys_for(cycle, n)
+		x = self._encrypt(offset, keys, half, mask)
+		while x >= n:  # cycle walk back into the playlist
+			x = self._encrypt(x, keys, half, mask)
+		return int(x)
+
+	def index(self, i):
+		"""return the position of playlist index i within the current
+		pass"""
+		cycle, offset, n = self._locate(self.position)
+		return self._index(i, cycle, n)
+
+	@property
+	def current(self):
+		return self[self.position]
+
+	def peek(self, steps=1):
+		"""return the playlist index `steps` positions away without moving"""
+		return self[max(0, self.position + steps)]
+
+	def next(self):
+		self.position += 1
+		return self.current
+
+	def prev(self):
+		"""step back, staying at the very first position"""
+		self.position = max(0, self.position - 1)
+		return self.current
+
+	def seek(self, position):
+		self.position = max(0, position)
+		return self.current
+
+	def _locate(self, position):
+		"""return (pass, position within it, its length) of position"""
+		run = bisect.bisect_right(self._starts, position) - 1
+		cycle, n = self._runs[run]
+		steps = position - self._starts[run]
+		return cycle + steps // n, steps % n, n
+
+	def _index(self, i, cycle, n):
+		keys, half, mask = self._keys_for(cycle, n)
+		x = self._decrypt(i, keys, half, mask)
+		while x >= n:
+			x = self._decrypt(x, keys, half, mask)
+		return x
+
+	def _keys_for(self, cycle, n):
+		"""return the round keys of a pass and the half width and mask of
+		the smallest Feistel domain holding n"""
+		if (cycle, n) != self._cycle:
+			rng = random.Random(self.seed * 1000003 + cycle)
+			bits = 2
+			while (1 << bits) < n:
+				bits += 2
+			half = bits // 2
+			self._keys = ([rng.getrandbits(32) for i in range(ROUNDS)],
+			              half, (1 << half) - 1)
+			self._cycle = (cycle, n)
+		return self._keys
+
+	def _encrypt(self, x, keys, half, mask):
+		left, right = x >> half, x & mask
+		for key in keys:
+			left, right = right, left ^ (_mix(right ^ key) & mask)
+		return (left << half) | right
+
+	def _decrypt(self, x, keys, half, mask):
+		left, right = x >> half, x & mask
+		for key in reversed(keys):
+			left, right = right ^ (_mix(left ^ key) & mask), left
+		return (left << half) | right
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_sort: playback orders for the slideshows.
+
+Files can be played by natural name (img2 before img10), modification
+time, file size, capture time or image dimensions. The keys come from one
+stat and the iv64_probe header of each file, are computed on a background
+thread the first time an order other than by name is asked for, and are
+kept in $XDG_CACHE_HOME/iv64/sort with each file's mtime and size, so that
+a folder seen before is sorted without reading its files again. Within a
+run every file is looked at only once; switching orders after that only
+sorts.
+
+Sorting happens on the background thread as well. The viewers poll() for
+the result and apply it with reorder(), which moves the current position
+along with its file.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+
+import iv64_probe
+import iv64_renditions
+
+# orders
+NAME = 'name'
+MTIME = 'mtime'
+SIZE = 'size'
+CAPTURED = 'captured'
+DIMENSIONS = 'dimensions'
+
+ORDERS = (NAME, MTIME, SIZE, CAPTURED, DIMENSIONS)
+
+# position of each order's key in a key entry
+_FIELDS = {MTIME: 0, SIZE: 1, CAPTURED: 2, DIMENSIONS: 3}
+_MISSING = (0, 0, '', 0)
+
+_digits = re.compile(r'(\d+)')
+
+
+def natural_key(name):
+	"""sort key putting img2 before img10"""
+	parts = _digits.split(name.lower())
+	parts[1::2] = [int(part) for part in parts[1::2]]
+	return parts
+
+
+def next_order(order):
+	"""return the order after `order` in ORDERS, the first one after None"""
+	if order not in ORDERS:
+		return ORDERS[0]
+	return ORDERS[(ORDERS.index(order) + 1) % len(ORDERS)]
+
+
+def reorder(files, result, current):
+	"""put the first entries of files, a list or an iv64_scan.PathIndex, in
+	the order of a SortKeys.poll() result. Entries added after the sort was
+	started stay at the end. Returns the new index of the entry that was at
+	current, or None, leaving files alone, if entries were removed since"""
+	order, names, positions = result
+	n = len(names)
+	if len(files) < n or (n and (files[0] != names[0] or
+	                             files[n - 1] != names[n - 1])):
+		return None
+	if hasattr(files, 'permute'):
+		files.permute(positions)
+	else:
+		snapshot = files[:n]  # current names, in case one was renamed
+		files[:n] = [snapshot[i] for i in positions]
+	if current < n:
+		return positions.index(current)
+	return current
+
+
+class SortKeys(object):
+	"""Sort keys of the files of one folder. Names are relative to the
+	folder or absolute paths inside it"""
+
+	def __init__(self, folder, path=None):
+		"""initialization.
+		@param  folder  the folder the files are in
+		@param  path    directory the key tables are kept in"""
+		self.folder = os.path.abspath(folder)
+		self.path = path or os.path.join(iv64_renditions.default_path(),
+		                                 'sort')
+		self._keys = None      # name -> (mtime, size, captured, pixels)
+		self._checked = set()  # names looked at during this run
+		self._dirty = False
+		self._result = None
+		self._generation = 0
+		self._lock = threading.Lock()
+		self._work_lock = threading.Lock()
+
+	def sort(self, files, order):
+		"""sort files by order on a background thread; poll() hands out
+		the result. Only the files there now are sorted"""
+		with self._lock:
+			self._generation += 1
+			generation = self._generation
+			self._result = None
+		thread = threading.Thread(target=self._sort, name='sort',
+		                          args=(files, len(files), order, generation))
+		thread.daemon = True
+		thread.start()
+
+	def poll(self):
+		"""return (order, names, positions) once the last sort() is done,
+		None until then. positions[i] is the index in names of the file
+		that comes i-th"""
+		with self._lock:
+			result, self._result = self._result, None
+		return result
+
+	def positions(self, names, order):
+		"""return the indexes of names in order. Blocks while keys are
+		computed"""
+		if order == NAME:
+			keys = [natural_key(name) for name in names]
+			return sorted(range(len(names)), key=keys.__getitem__)
+		field = _FIELDS[order]
+		keys = [(self.keys(name)[field], natural_key(name)) for name in names]
+		self.save()
+		return sorted(range(len(names)), key=keys.__getitem__)
+
+	def keys(self, name):
+		"""return (mtime, size, capture time, pixels) of a file. The capture
+		time falls back to the mtime, formatted the EXIF way"""
+		if name.startswith(self.folder + os.sep):
+			name = name[len(self.folder) + 1:]
+		table = self._table()
+		entry = table.get(name)
+		if entry is not None and name in self._checked:
+			return entry
+		self._checked.add(name)
+		filename = os.path.join(self.folder, name)
+		try:
+			st = os.stat(filename)
+		except OSError:
+			return _MISSING
+		if entry is not None and entry[:2] == (st.st_mtime, st.st_size):
+			return entry
+		info = iv64_probe.shared.probe(filename)
+		captured = info is not None and info.captured
+		if not captured:
+			captured = time.strftime('%Y:%m:%d %H:%M:%S',
+			                         time.localtime(st.st_mtime))
+		pixels = info.width * info.height if info is not None else 0
+		entry = table[name] = (st.st_mtime, st.st_size, captured, pixels)
+		self._dirty = True
+		return entry
+
+	def save(self):
+		"""write the key table if it has new keys"""
+		if not self._dirty:
+			return
+		self._dirty = False
+		try:
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+			fd, tmp = tempfile.mkstemp(dir=self.path)
+			with os.fdopen(fd, 'wb') as f:
+				pickle.dump(self._keys, f, 2)
+			os.rename(tmp, self._table_path())
+		except (IOError, OSError):
+			pass
+
+	def _sort(self, files, n, order, generation):
+		"""worker for sort()"""
+		with self._work_lock:
+			if generation != self._generation:
+				return  # a newer sort was asked for meanwhile
+			while True:
+				try:
+					names = [files[i] for i in range(n)]
+					break
+				except IndexError:
+					n = min(n, len(files))  # files were removed meanwhile
+			positions = self.positions(names, order)
+		with self._lock:
+			if generation == self._generation:
+				self._result = (order, names, positions)
+
+	def _table_path(self):
+		key = self.folder
+		if not isinstance(key, bytes):
+			key = key.encode('utf-8', 'surrogateescape')
+		return os.path.join(self.path, hashlib.sha1(key).hexdigest())
+
+	def _table(self):
+		if self._keys is None:
+			try:
+				with open(self._table_path(), 'rb') as f:
+					self._keys = pickle.load(f)
+			except Exception:
+				self._keys = {}
+		return self._keys
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_trace: spans and counters for the image pipeline of the viewers.
+
+Set IV64_TRACE to a file name to switch tracing on:
+
+	IV64_TRACE=slides.json python iv64_pygame.py ~/Pictures
+
+Every span (reading and decoding a file, converting, scaling, padding,
+texture uploads, presenting a frame, ...) and every counter is recorded
+with its thread. At exit the events are written to that file in the Chrome
+trace event format, to be opened in chrome://tracing or Perfetto, and the
+count, mean and percentiles of each span are printed on stderr.
+
+Without IV64_TRACE nothing is recorded and tracing costs nothing: the
+functions decorated with traced() are left as they are, span() hands out
+one shared context manager that does nothing and count() returns at once.
+The decorators are applied when the viewers are imported, so only spans
+and counters see enable() being called later on.
+"""
+from __future__ import print_function
+
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+from array import array
+import atexit
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import timeit
+
+DEFAULT_MAX_EVENTS = 1000000
+RESERVOIR = 10000  # durations kept per span for the percentiles
+PERCENTILES = (50, 90, 99)
+
+timer = timeit.default_timer
+
+
+class _NullSpan(object):
+	"""the span handed out while tracing is disabled"""
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+_null_span = _NullSpan()
+
+
+class _Span(object):
+	__slots__ = ('tracer', 'name', 'args', 'start')
+
+	def __init__(self, tracer, name, args):
+		self.tracer = tracer
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		self.start = timer()
+		return self
+
+	def __exit__(self, *exc):
+		self.tracer.add(self.name, self.start, timer(), self.args)
+		return False
+
+
+class _Durations(object):
+	"""Count, sum and maximum of the durations of a span, and a uniform
+	sample of at most `size` of them for the percentiles (reservoir
+	sampling), so that the memory used does not grow with the run"""
+	__slots__ = ('size', 'count', 'total', 'max', 'sample')
+
+	def __init__(self, size=RESERVOIR):
+		self.size = size
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.sample = array('d')
+
+	def add(self, ms):
+		self.count += 1
+		self.total += ms
+		if ms > self.max:
+			self.max = ms
+		if len(self.sample) < self.size:
+			self.sample.append(ms)
+		else:
+			i = random.randrange(self.count)
+			if i < self.size:
+				self.sample[i] = ms
+
+
+class Tracer(object):
+	"""Records spans and counters as Chrome trace events and keeps the
+	durations of every span for the percentiles. At most max_events events
+	are kept for the trace file and the percentiles come from a sample of
+	at most RESERVOIR durations per span, so a long slideshow cannot run
+	out of memory"""
+
+	def __init__(self, path=None, max_events=DEFAULT_MAX_EVENTS):
+		"""initialization.
+		@param  path        file the trace is written to at exit, None to
+		                    leave tracing disabled
+		@param  max_events  number of events kept for the trace file"""
+		self.enabled = False
+		self.path = None
+		self.max_events = max_events
+		self.events = []
+		self.dropped = 0
+		self.durations = {}  # span name -> _Durations, in milliseconds
+		self.counters = {}
+		self._threads = set()
+		self._lock = threading.Lock()
+		self._origin = timer()
+		self._pid = os.getpid()
+		self._registered = False
+		if path:
+			self.enable(path)
+
+	def enable(self, path=None):
+		"""start recording, writing the trace to path at exit if given"""
+		if path:
+			self.path = path
+		self.enabled = True
+		if not self._registered:
+			self._registered = True
+			atexit.register(self.finish)
+
+	def disable(self):
+		self.enabled = False
+
+	def span(self, name, **args):
+		"""return a context manager recording the time spent in it as the
+		span name, with args shown along with it in the trace"""
+		if not self.enabled:
+			return _null_span
+		return _Span(self, name, args)
+
+	def wrap(self, name, fn):
+		"""return fn recording every call as the span name, or fn itself
+		while tracing is disabled"""
+		if not self.enabled:
+			return fn
+		add = self.add
+
+		@functools.wraps(fn)
+		def traced(*args, **kwargs):
+			start = timer()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				add(name, start, timer())
+		return traced
+
+	def count(self, name, value=1):
+		"""add value to the counter name"""
+		if not self.enabled:
+			return
+		with self._lock:
+			total = self.counters[name] = self.counters.get(name, 0) + value
+			self._event(dict(ph='C', name=name, ts=self._us(timer()),
+			                 args={name: total}))
+
+	def sample(self, name, value):
+		"""set the counter name to value"""
+		if not self.enabled:
+			return
+		with self._lock:
+			self.counters[name] = value
+			self._event(dict(ph='C', name=name, ts=self._us(timer()),
+			                 args={name: value}))
+
+	def add(self, name, start, end, args=None):
+		"""record a span from start to end, in timer() seconds"""
+		with self._lock:
+			durations = self.durations.get(name)
+			if durations is None:
+				durations = self.durations[name] = _Durations()
+			durations.add((end - start) * 1000.0)
+			event = dict(ph='X', name=name, ts=self._us(start),
+			             dur=self._us(end) - self._us(start))
+			if args:
+				event['args'] = args
+			self._event(event)
+
+	def percentiles(self):
+		"""return {span name: dict(count, mean, p50, p90, p99, max)} with
+		the times in milliseconds. Count, mean and max are exact, the
+		percentiles are those of the sampled durations"""
+		with self._lock:
+			spans = [(name, d.count, d.total, d.max, sorted(d.sample))
+			         for name, d in self.durations.items()]
+		result = {}
+		for name, count, total, longest, times in spans:
+			if not times:
+				continue
+			stats = dict(count=count, mean=total / count, max=longest)
+			for p in PERCENTILES:
+				# nearest rank
+				rank = max(0, -(-p * len(times) // 100) - 1)
+				stats['p%d' % p] = times[rank]
+			result[name] = stats
+		return result
+
+	def write(self, path=None):
+		"""write the trace events, with the percentiles and counters as
+		metadata, to path or the path tracing was enabled with"""
+		path = path or self.path
+		with self._lock:
+			events = list(self.events)
+			dropped = self.dropped
+			counters = dict(self.counters)
+		data = dict(
+			traceEvents     = events,
+			displayTimeUnit = 'ms',
+			otherData       = dict(percentiles = self.percentiles(),
+			                       counters    = counters,
+			                       dropped     = dropped),
+		)
+		with open(path, 'w') as f:
+			json.dump(data, f)
+
+	def report(self, out=None):
+		"""print the percentiles of every span"""
+		out = out or sys.stderr
+		stats = self.percentiles()
+		if not stats:
+			return
+		print('%-24s %8s %9s %9s %9s %9s %9s' % (
+			'span (ms)', 'count', 'mean', 'p50', 'p90', 'p99', 'max'), file=out)
+		for name in sorted(stats):
+			s = stats[name]
+			print('%-24s %8d %9.3f %9.3f %9.3f %9.3f %9.3f' % (
+				name, s['count'], s['mean'], s['p50'], s['p90'], s['p99'],
+				s['max']), file=out)
+		for name in sorted(self.counters):
+			print('%-24s %8s' % (name, self.counters[name]), file=out)
+
+	def finish(self):
+		"""write the trace and print the percentiles, run at exit"""
+		if self.path:
+			try:
+				self.write()
+				print('trace written to %s' % self.path, file=sys.stderr)
+			except (IOError, OSError) as e:
+				print('cannot write trace %s: %s' % (self.path, e),
+				      file=sys.stderr)
+		self.report()
+
+	def _us(self, t):
+		return int((t - self._origin) * 1000000)
+
+	def _event(self, event):
+		"""store a trace event. The lock must be held by the caller"""
+		if len(self.events) >= self.max_events:
+			self.dropped += 1
+			return
+		thread = threading.current_thread()
+		tid = thread.ident
+		if tid not in self._threads:
+			self._threads.add(tid)
+			self.events.append(dict(ph='M', name='thread_name', pid=self._pid,
+			                        tid=tid, args=dict(name=thread.name)))
+		event['pid'] = self._pid
+		event['tid'] = tid
+		self.events.append(event)
+
+
+def traced(name):
+	"""decorator recording every call of the function as the span name.
+	Leaves the function alone when tracing is disabled"""
+	def decorate(fn):
+		return shared.wrap(name, fn)
+	return decorate
+
+
+# tracer shared by everything in the process
+shared = Tracer(os.environ.get('IV64_TRACE') or None)
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+iv64_watch: watch a folder for files being added, removed or renamed so a
+running slideshow can pick them up without rescanning the folder.
+
+On Linux the kernel's inotify interface is used through ctypes. Elsewhere,
+or if inotify is not available, the mtimes of the folders are polled and
+the listing of one is diffed against the last one when it changes; renames
+then show up as a remove plus an add.
+
+Only the top level of the folder is watched, unless the watcher is made
+recursive: then the subfolders are watched too, those created or moved in
+while it runs included, and hidden ones are skipped as iv64_scan does.
+Events are collected on a background thread and handed out by poll(), so
+they can be applied to the playlist on the thread that owns it, through
+the Positions of the playlist.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import bisect
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+
+# event kinds
+ADD = 'add'
+REMOVE = 'remove'
+RENAME = 'rename'
+REMOVE_DIR = 'remove_dir'  # a directory went away with all it held
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE)
+
+_event_header = struct.Struct('iIII')
+
+
+class Positions(object):
+	"""name -> index map of a playlist, a list or an iv64_scan.PathIndex,
+	through which bursts of events are applied to it.
+
+	The map is made on the first burst and then kept up to date: entries
+	appended to the playlist since the last burst are picked up by count,
+	reordered ones are told with reordered(), and apply() updates it for
+	the entries it adds, renames and removes. A burst then costs time in
+	the number of its events and of the entries after the first one
+	removed, not in the length of the playlist. A playlist that never
+	changes never pays for the map."""
+
+	def __init__(self, files):
+		self.files = files
+		self._map = None
+		self._count = 0  # entries of files that are in the map
+
+	def _sync(self):
+		"""add the entries appended to files since the last call"""
+		if self._map is None:
+			self._map = {}
+			self._count = 0
+		files = self.files
+		for i in range(self._count, len(files)):
+			self._map.setdefault(files[i], i)
+		self._count = len(files)
+
+	def reordered(self, n):
+		"""update the map after the first n entries were reordered"""
+		if self._map is None:
+			return
+		files = self.files
+		for i in range(n):
+			self._map[files[i]] = i
+
+	def apply(self, changes, current, wanted, path=None):
+		"""apply a burst of events to the playlist and return the new index
+		of the entry that was at current. It stays on the same file, or
+		moves on to the next one if that file is removed.
+		@param  wanted  tells whether a name added or renamed to belongs in
+		                the playlist
+		@param  path    folder the names are joined to, None to keep them
+		                bare"""
+		def full(name):
+			if path is None:
+				return name
+			return os.path.join(path, name)
+		self._sync()
+		files = self.files
+		positions = self._map
+		removed = []
+
+		def add(f):
+			if f not in positions:
+				positions[f] = len(files)
+				files.append(f)
+
+		def remove(f):
+			i = positions.pop(f, None)
+			if i is not None:
+				removed.append(i)
+
+		for change in changes:
+			kind, name = change[0], change[-1]
+			if kind == ADD:
+				if wanted(name):
+					add(full(name))
+			elif kind == REMOVE:
+				remove(full(name))
+			elif kind == REMOVE_DIR:
+				prefix = os.path.join(full(name), '')
+				for f in [f for f in positions if f.startswith(prefix)]:
+					remove(f)
+			elif kind == RENAME:
+				old = full(change[1])
+				if not wanted(name) or full(name) in positions:
+					remove(old)
+					if wanted(name):
+						add(full(name))
+					continue
+				i = positions.pop(old, None)
+				if i is None:
+					add(full(name))
+				else:
+					files[i] = full(name)
+					positions[full(name)] = i
+
+		if removed:
+			removed.sort()
+			self._compact(removed)
+			current -= bisect.bisect_left(removed, current)
+		self._count = len(files)
+		if current >= len(files):
+			current = 0
+		return current
+
+	def _compact(self, removed):
+		"""drop the entries at the sorted indexes removed, moving the ones
+		after the first of them down in one pass"""
+		files = self.files
+		first = removed[0]
+		gone = set(removed)
+		kept = [i for i in range(first, len(files)) if i not in gone]
+		if hasattr(files, 'keep'):
+			files.keep(first, kept)
+		else:
+			files[first:] = [files[i] for i in kept]
+		positions = self._map
+		for i in range(first, len(files)):
+			positions[files[i]] = i
+
+
+def _load_libc():
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		libc.inotify_init
+		libc.inotify_add_watch
+		libc.inotify_rm_watch
+	except (OSError, AttributeError):
+		return None
+	return libc
+
+_libc = _load_libc()
+
+
+class FolderWatcher(threading.Thread):
+	"""Watch a folder, and its subfolders if recursive. Events are tuples:
+	(ADD, name), (REMOVE, name), (RENAME, old_name, new_name) or
+	(REMOVE_DIR, name), with names relative to the folder"""
+
+	def __init__(self, path, interval=0.5, use_inotify=True,
+	             recursive=False):
+		"""initialization.
+		@param  path         folder to watch
+		@param  interval     seconds between checks when polling, and the
+		                     longest the thread waits before seeing stop()
+		@param  use_inotify  set to False to force polling
+		@param  recursive    watch the subfolders too"""
+		super(FolderWatcher, self).__init__(name='watcher')
+		self.daemon = True
+		self.path = os.path.abspath(path)
+		self.interval = interval
+		self.recursive = recursive
+		self.events = []
+		self._lock = threading.Lock()
+		self._stopped = threading.Event()
+		self._dirs = {}  # inotify watch descriptor -> folder it watches
+		self._fd = None
+		if use_inotify and _libc is not None:
+			self._fd = self._inotify_open()
+
+	@property
+	def polling(self):
+		return self._fd is None
+
+	def poll(self):
+		"""return and forget the events collected since the last call"""
+		with self._lock:
+			events, self.events = self.events, []
+		return events
+
+	def stop(self):
+		self._stopped.set()
+
+	def run(self):
+		try:
+			if self.polling:
+				self._run_polling()
+			else:
+				self._run_inotify()
+		finally:
+			if self._fd is not None:
+				os.close(self._fd)
+				self._fd = None
+
+	def _emit(self, *event):
+		with self._lock:
+			self.events.append(event)
+
+	def _full(self, rel):
+		if not rel:
+			return self.path
+		return os.path.join(self.path, rel)
+
+	def _walk(self, rel):
+		"""yield (folder, names of its files) for folder rel and the ones
+		below it, relative to the watched folder. Hidden folders are
+		skipped"""
+		for dirpath, dirnames, filenames in os.walk(self._full(rel)):
+			dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+			folder = os.path.relpath(dirpath, self.path)
+			if folder == os.curdir:
+				folder = ''
+			yield folder, filenames
+
+	### inotify ---------------------------------------------------------------
+	def _inotify_open(self):
+		fd = _libc.inotify_init()
+		if fd < 0:
+			return None
+		if not self._add_watch(fd, ''):
+			os.close(fd)
+			return None
+		return fd
+
+	def _add_watch(self, fd, rel):
+		path = self._full(rel)
+		if not isinstance(path, bytes):
+			path = path.encode('utf-8', 'surrogateescape')
+		wd = _libc.inotify_add_watch(fd, path, WATCH_MASK)
+		if wd < 0:
+			return False
+		self._dirs[wd] = rel
+		return True
+
+	def _watch_tree(self, rel, emit):
+		"""watch folder rel and the ones below it, with ADD events for the
+		files in them if emit"""
+		for folder, names in self._walk(rel):
+			self._add_watch(self._fd, folder)
+			if emit:
+				for name in names:
+					self._emit(ADD, os.path.join(folder, name))
+
+	def _unwatch_tree(self, rel):
+		"""stop watching folder rel, gone or moved away, and the ones below
+		it"""
+		prefix = os.path.join(rel, '')
+		for wd, folder in list(self._dirs.items()):
+			if folder == rel or folder.startswith(prefix):
+				_libc.inotify_rm_watch(self._fd, wd)
+				del self._dirs[wd]
+		self._emit(REMOVE_DIR, rel)
+
+	def _run_inotify(self):
+		if self.recursive:
+			for folder, names in self._walk(''):
+				if folder:
+					self._add_watch(self._fd, folder)
+		while not self._stopped.is_set():
+			try:
+				ready, _, _ = select.select([self._fd], [], [], self.interval)
+			except select.error as e:
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+			if ready:
+				self._read_inotify(os.read(self._fd, 64 * 1024))
+
+	def _read_inotify(self, buf):
+		"""turn a buffer of inotify events into ADD/REMOVE/RENAME events.
+		A move out is paired with the move in carrying the same cookie;
+		unpaired ones are reported as a remove or an add. Folders moved
+		within the tree are reported as gone and their files as added"""
+		moved_from = {}
+		dirs_moved_from = {}
+		offset = 0
+		while offset < len(buf):
+			wd, mask, cookie, length = _event_header.unpack_from(buf, offset)
+			offset += _event_header.size
+			name = buf[offset:offset + length].rstrip(b'\0')
+			offset += length
+			if mask & IN_IGNORED:  # folder deleted, or watch removed
+				self._dirs.pop(wd, None)
+				continue
+			folder = self._dirs.get(wd)
+			if folder is None:
+				continue
+			if str is not bytes:
+				name = name.decode('utf-8', 'surrogateescape')
+			hidden = name.startswith('.')
+			if folder:
+				name = os.path.join(folder, name)
+			if mask & IN_ISDIR:
+				if not self.recursive:
+					continue
+				if mask & IN_MOVED_FROM:
+					dirs_moved_from[cookie] = name
+				elif mask & IN_MOVED_TO:
+					old = dirs_moved_from.pop(cookie, None)
+					if old is not None:
+						self._unwatch_tree(old)
+					if not hidden:
+						self._watch_tree(name, True)
+				elif mask & IN_CREATE and not hidden:
+					# files written before the watch was set are in the walk
+					self._watch_tree(name, True)
+				continue
+			if mask & IN_MOVED_FROM:
+				moved_from[cookie] = name
+			elif mask & IN_MOVED_TO:
+				if cookie in moved_from:
+					self._emit(RENAME, moved_from.pop(cookie), name)
+				else:
+					self._emit(ADD, name)
+			elif mask & IN_CLOSE_WRITE:
+				self._emit(ADD, name)
+			elif mask & IN_DELETE:
+				self._emit(REMOVE, name)
+		for name in moved_from.values():
+			self._emit(REMOVE, name)
+		for name in dirs_moved_from.values():
+			self._unwatch_tree(name)
+
+	### polling ---------------------------------------------------------------
+	def _list(self, rel):
+		"""return (mtime, file names, subfolder names) of folder rel. Names
+		of folders are only told apart when recursive, and hidden ones are
+		left out then"""
+		path = self._full(rel)
+		mtime = os.stat(path).st_mtime
+		names = set(os.listdir(path))
+		folders = set()
+		if self.recursive:
+			for name in names:
+				child = os.path.join(path, name)
+				if os.path.isdir(child) and not os.path.islink(child):
+					folders.add(name)
+			names -= folders
+			folders = set(f for f in folders if not f.startswith('.'))
+		return mtime, names, folders
+
+	def _run_polling(self):
+		listings = {}  # folder -> (mtime, file names, subfolder names)
+		first = True
+		while not self._stopped.is_set():
+			stack = ['']
+			while stack:
+				rel = stack.pop()
+				old = listings.get(rel)
+				try:
+					mtime = os.stat(self._full(rel)).st_mtime
+					if old is None or mtime != old[0]:
+						listings[rel] = self._diff(rel, old, first, listings)
+				except OSError:
+					continue  # gone: the listing of its parent tells
+				stack.extend(os.path.join(rel, f) for f in listings[rel][2])
+			first = False
+			self._stopped.wait(self.interval)
+
+	def _diff(self, rel, old, first, listings):
+		"""list folder rel again and emit what changed since its listing
+		old, every file if it is a new folder. Nothing is emitted for the
+		listings of the first sweep"""
+		listing = self._list(rel)
+		mtime, names, folders = listing
+		if old is None:
+			if not first:
+				for name in sorted(names):
+					self._emit(ADD, os.path.join(rel, name))
+			return listing
+		for name in sorted(old[1] - names):
+			self._emit(REMOVE, os.path.join(rel, name))
+		for name in sorted(names - old[1]):
+			self._emit(ADD, os.path.join(rel, name))
+		for name in sorted(old[2] - folders):
+			gone = os.path.join(rel, name)
+			prefix = os.path.join(gone, '')
+			for folder in [f for f in listings
+			               if f == gone or f.startswith(prefix)]:
+				del listings[folder]
+			self._emit(REMOVE_DIR, gone)
+		return listing
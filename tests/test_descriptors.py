@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Loading images must not leave file descriptors open: the loops of a
+slideshow run for days and would end in EMFILE.
+
+	python -m pytest tests
+
+Counts the entries of /proc/self/fd, so it is skipped where there is no
+such directory. The Loader test needs pyglet with a usable GL context or
+headless mode and is skipped without one.
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import iv64_mmap
+
+FD_DIR = '/proc/self/fd'
+LOOPS = 50
+
+
+def open_descriptors():
+	return len(os.listdir(FD_DIR))
+
+
+def write_png(path, width=8, height=8):
+	"""write a grey RGB PNG without needing PIL"""
+	def chunk(kind, data):
+		body = kind + data
+		return (struct.pack('>I', len(data)) + body +
+		        struct.pack('>I', zlib.crc32(body) & 0xffffffff))
+	rows = b''.join(b'\x00' + b'\x80' * (width * 3) for i in range(height))
+	with open(path, 'wb') as f:
+		f.write(b'\x89PNG\r\n\x1a\n')
+		f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+		                                   0, 0, 0)))
+		f.write(chunk(b'IDAT', zlib.compress(rows)))
+		f.write(chunk(b'IEND', b''))
+
+
+@unittest.skipUnless(os.path.isdir(FD_DIR), 'cannot count open descriptors')
+class DescriptorTest(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp(prefix='iv64_test')
+		self.image = os.path.join(self.folder, 'image.png')
+		write_png(self.image)
+		self.empty = os.path.join(self.folder, 'empty.png')
+		open(self.empty, 'wb').close()
+
+	def tearDown(self):
+		shutil.rmtree(self.folder, ignore_errors=True)
+
+	def assertNoLeak(self, fn):
+		fn()  # whatever is opened once and kept is not a leak
+		before = open_descriptors()
+		for i in range(LOOPS):
+			fn()
+		self.assertEqual(open_descriptors(), before)
+
+	def test_mapped_file(self):
+		def read():
+			with iv64_mmap.MappedFile(self.image) as f:
+				self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
+				f.seek(0)
+				self.assertEqual(len(f.read()), os.path.getsize(self.image))
+		self.assertNoLeak(read)
+
+	def test_mapped_empty_file(self):
+		def read():
+			with iv64_mmap.MappedFile(self.empty) as f:
+				self.assertEqual(f.read(), b'')
+		self.assertNoLeak(read)
+
+	def test_mapped_file_closed_twice(self):
+		def read():
+			f = iv64_mmap.MappedFile(self.image)
+			f.close()
+			f.close()
+		self.assertNoLeak(read)
+
+	def test_loader_load_image(self):
+		try:
+			import pyglet
+			if not os.environ.get('DISPLAY'):
+				pyglet.options['headless'] = True
+			import iv64_pyglet
+		except Exception as e:
+			self.skipTest('pyglet is not usable here: %s' % e)
+		def load():
+			image = iv64_pyglet.Loader.load_image(self.image)
+			self.assertEqual((image.width, image.height), (8, 8))
+		self.assertNoLeak(load)
+
+
+if __name__ == '__main__':
+	unittest.main()
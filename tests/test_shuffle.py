@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+The random order must go back over what was shown, also while a scan or
+a folder watcher appends files to the playlist.
+
+	python -m pytest tests
+"""
+__author__ = 'See-ming Lee'
+__email__ = 'seeminglee@gmail.com'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import iv64_shuffle
+
+
+class ShuffleTest(unittest.TestCase):
+
+	def test_pass_is_a_permutation(self):
+		shuffle = iv64_shuffle.Shuffle(37, seed=1)
+		for cycle in range(3):
+			shown = [shuffle[cycle * 37 + i] for i in range(37)]
+			self.assertEqual(sorted(shown), list(range(37)))
+
+	def test_same_seed_same_order(self):
+		a = iv64_shuffle.Shuffle(100, seed=7)
+		b = iv64_shuffle.Shuffle(100, seed=7)
+		self.assertEqual([a.next() for i in range(250)],
+		                 [b.next() for i in range(250)])
+
+	def test_prev_after_grow_retraces(self):
+		shuffle = iv64_shuffle.Shuffle(10, seed=3, current=0)
+		shown = [shuffle.current]
+		for n in range(11, 40):
+			shuffle.grow(n)  # a file appended after every step
+			shown.append(shuffle.next())
+		back = [shuffle.current]
+		while shuffle.position:
+			back.append(shuffle.prev())
+		self.assertEqual(back[::-1], shown)
+
+	def test_grown_files_join_the_next_pass(self):
+		shuffle = iv64_shuffle.Shuffle(10, seed=5)
+		first = [shuffle.current] + [shuffle.next() for i in range(4)]
+		shuffle.grow(25)
+		first += [shuffle.next() for i in range(5)]
+		self.assertEqual(sorted(first), list(range(10)))
+		second = [shuffle.next() for i in range(25)]
+		self.assertEqual(sorted(second), list(range(25)))
+
+	def test_reset_starts_at_current(self):
+		shuffle = iv64_shuffle.Shuffle(20, seed=9)
+		for i in range(7):
+			shuffle.next()
+		shuffle.reset(15, 4)
+		self.assertEqual((shuffle.position, shuffle.current), (0, 4))
+		self.assertEqual(shuffle.prev(), 4)  # nothing to go back to
+		self.assertTrue(all(shuffle.next() < 15 for i in range(40)))
+
+
+if __name__ == '__main__':
+	unittest.main()